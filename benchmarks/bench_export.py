@@ -0,0 +1,203 @@
+# Benchmark for the exporter on synthetic node trees, run without Blender through fake_bpy.py
+#
+#   python benchmarks/bench_export.py --nodes 10 1000 100000 --json results.json
+#   python benchmarks/bench_export.py --compare results.json
+#   python benchmarks/bench_export.py --option sparse_defaults --default-fraction 0.7
+#
+# --compare runs the same sizes and options as the saved results and prints the ratio
+# for each measurement, so regressions show up when checking out another revision.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, ".."))
+
+import fake_bpy
+fake_bpy.install()
+
+import cyclesmax_defaults
+import cyclesmax_reader
+import io_cyclesmax_shader
+import node_tree_generator
+
+RESULTS_VERSION = 1
+
+def get_revision():
+    try:
+        completed = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    except OSError:
+        return None
+    if completed.returncode != 0:
+        return None
+    return completed.stdout.strip()
+
+def get_export_options(option_names):
+    options = io_cyclesmax_shader.ExportOptions()
+    for this_name in option_names:
+        setattr(options, this_name, True)
+    return options
+
+def best_time(function, repeat):
+    best_seconds = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start_time
+        best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+    return best_seconds, result
+
+def convert_nodes(node_tree):
+    max_tex_manager = io_cyclesmax_shader.MaxTexManager()
+    return [io_cyclesmax_shader.get_cycles_node("node" + str(index + 1), this_node, max_tex_manager) for index, this_node in enumerate(node_tree.nodes)]
+
+def convert_connections(node_tree, converted):
+    graph = io_cyclesmax_shader.SerializedNodeGraph()
+    io_cyclesmax_shader.add_tree_connections(node_tree, converted, graph)
+    return graph.connections
+
+def reset_to_defaults(node_tree, fraction, seed):
+    # The generator gives every input a random value, real materials leave most of them at the default
+    rng = random.Random(seed)
+    for this_node in node_tree.nodes:
+        converter = io_cyclesmax_shader.CONVERTER_BY_IDNAME.get(this_node.bl_idname)
+        if converter is None:
+            continue
+        default_values = cyclesmax_defaults.DEFAULT_VALUES.get(converter.node_type.value, dict())
+        for this_socket in this_node.inputs:
+            default = default_values.get(converter.copy_sockets.get(this_socket.identifier))
+            if isinstance(default, (float, tuple)) and rng.random() < fraction:
+                this_socket.default_value = default
+
+def run(node_count, seed, repeat, options, default_fraction=0.0):
+    node_tree = node_tree_generator.make_node_tree(node_count, seed)
+    if default_fraction > 0.0:
+        reset_to_defaults(node_tree, default_fraction, seed)
+    link_count = len(node_tree.links)
+    result = dict()
+    result["nodes"] = node_count
+    result["links"] = link_count
+
+    # The exporter still prints some diagnostics per node, keep them off the console but in the timing
+    with contextlib.redirect_stdout(io.StringIO()):
+        group_cache = io_cyclesmax_shader.NodeGroupCache()
+        convert_seconds, _ = best_time(lambda: convert_nodes(node_tree), repeat)
+        converted = io_cyclesmax_shader.add_tree_nodes(node_tree, io_cyclesmax_shader.SerializedNodeGraph(), io_cyclesmax_shader.MaxTexManager(), group_cache)
+        connect_seconds, _ = best_time(lambda: convert_connections(node_tree, converted), repeat)
+        serialize_seconds, graph = best_time(lambda: io_cyclesmax_shader.serialize_node_graph(node_tree, options), repeat)
+        write_seconds, shader_string = best_time(graph.get_graph_string, repeat)
+        parse_seconds, _ = best_time(lambda: cyclesmax_reader.parse_shader_string(shader_string), repeat)
+        fingerprint_seconds, _ = best_time(lambda: io_cyclesmax_shader.get_node_tree_fingerprint(node_tree, options), repeat)
+
+        # tracemalloc slows everything down, so peak memory gets a run of its own
+        tracemalloc.start()
+        traced_graph = io_cyclesmax_shader.serialize_node_graph(node_tree, options)
+        # Memory blocks still allocated once the graph is built, that is mostly the graph itself
+        graph_blocks = sum(x.count for x in tracemalloc.take_snapshot().statistics("filename"))
+        traced_graph.get_graph_string()
+        _current, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del traced_graph
+
+    result["seconds"] = {
+        "get_cycles_node": convert_seconds,
+        "connections": connect_seconds,
+        "serialize_node_graph": serialize_seconds,
+        "write_string": write_seconds,
+        "fingerprint": fingerprint_seconds,
+        "parse": parse_seconds,
+    }
+    result["nodes_per_second"] = node_count / convert_seconds if convert_seconds > 0 else None
+    result["links_per_second"] = link_count / connect_seconds if connect_seconds > 0 else None
+    result["export_nodes_per_second"] = node_count / (serialize_seconds + write_seconds)
+    result["peak_memory_bytes"] = peak_bytes
+    result["graph_blocks"] = graph_blocks
+    result["output_bytes"] = len(shader_string.encode("utf-8"))
+    result["exported_nodes"] = len(graph.nodes)
+    result["exported_connections"] = len(graph.connections)
+    return result
+
+def print_result(result):
+    seconds = result["seconds"]
+    print("{0:>7} nodes {1:>7} links | get_cycles_node {2:10.0f} nodes/s | connections {3:10.0f} links/s | export {4:8.3f}s {5:10.0f} nodes/s | fingerprint {6:8.3f}s | peak {7:8.1f} MB {8:9} blocks | output {9:8.2f} MB | parse {10:8.3f}s".format(
+        result["nodes"], result["links"],
+        result["nodes_per_second"] or 0.0, result["links_per_second"] or 0.0,
+        seconds["serialize_node_graph"] + seconds["write_string"], result["export_nodes_per_second"],
+        seconds["fingerprint"],
+        result["peak_memory_bytes"] / (1024.0 * 1024.0), result["graph_blocks"], result["output_bytes"] / (1024.0 * 1024.0),
+        seconds.get("parse", 0.0)))
+
+def print_comparison(old_result, new_result):
+    # Ratios above 1.0 mean the current tree is slower or bigger than the saved results
+    parts = list()
+    for this_name, old_seconds in sorted(old_result["seconds"].items()):
+        new_seconds = new_result["seconds"].get(this_name)
+        if new_seconds is None or old_seconds <= 0:
+            continue
+        parts.append("{0} x{1:.2f}".format(this_name, new_seconds / old_seconds))
+    if old_result["peak_memory_bytes"] > 0:
+        parts.append("memory x{0:.2f}".format(new_result["peak_memory_bytes"] / old_result["peak_memory_bytes"]))
+    if old_result.get("graph_blocks", 0) > 0:
+        parts.append("blocks x{0:.2f}".format(new_result["graph_blocks"] / old_result["graph_blocks"]))
+    if old_result["output_bytes"] > 0:
+        parts.append("output x{0:.2f}".format(new_result["output_bytes"] / old_result["output_bytes"]))
+    print("{0:>7} nodes | {1}".format(new_result["nodes"], " | ".join(parts)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the exporter on synthetic node trees without Blender")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3, help="Report the best of this many runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--option", action="append", default=[], choices=("prune_unreachable", "fold_constants", "merge_duplicates", "sparse_defaults", "topological_order"), help="Export option to enable, may be given more than once")
+    parser.add_argument("--default-fraction", type=float, default=0.0, help="Fraction of unlinked inputs to reset to their Blender default")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Rerun the sizes and options from this JSON file and compare against it")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        args.nodes = [x["nodes"] for x in baseline["results"]]
+        args.seed = baseline["seed"]
+        args.option = baseline["options"]
+        args.default_fraction = baseline.get("default_fraction", 0.0)
+
+    options = get_export_options(args.option)
+    results = list()
+    for node_count in args.nodes:
+        this_result = run(node_count, args.seed, args.repeat, options, args.default_fraction)
+        print_result(this_result)
+        results.append(this_result)
+
+    if baseline is not None:
+        print("Compared with {0} ({1}):".format(args.compare, baseline.get("revision")))
+        for old_result, new_result in zip(baseline["results"], results):
+            print_comparison(old_result, new_result)
+
+    if args.json is not None:
+        output = dict()
+        output["version"] = RESULTS_VERSION
+        output["revision"] = get_revision()
+        output["python"] = platform.python_version()
+        output["platform"] = platform.platform()
+        output["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        output["seed"] = args.seed
+        output["options"] = args.option
+        output["default_fraction"] = args.default_fraction
+        output["results"] = results
+        with open(args.json, "w") as output_file:
+            json.dump(output, output_file, indent=2)
+
+if __name__ == "__main__":
+    main()
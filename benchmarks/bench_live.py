@@ -0,0 +1,131 @@
+# Benchmark for the live updates of watch mode, run without Blender through fake_bpy.py
+#
+#   python benchmarks/bench_live.py --nodes 100 1000 10000 --updates 50
+#
+# For each size a synthetic material is streamed to a client in this process, then one input
+# value is changed and the material exported and pushed again, like dragging a slider. It reports
+# the time from the push until the client has applied the update, the bytes sent per update
+# and how that compares to sending the whole graph again.
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, ".."))
+
+import fake_bpy
+fake_bpy.install()
+
+import cyclesmax_live
+import io_cyclesmax_shader
+import node_tree_generator
+
+class ReceivingClient:
+    # Applies messages on a thread of its own and records when each seq was applied
+    def __init__(self, port):
+        self.client = cyclesmax_live.LiveClient(port=port)
+        self.applied = threading.Condition()
+        self.applied_times = dict()
+        self.sizes = dict()
+        self.thread = threading.Thread(target=self.receive_loop, daemon=True)
+        self.thread.start()
+
+    def receive_loop(self):
+        while True:
+            received = self.client.receive()
+            if received is None:
+                return
+            message, size = received
+            with self.applied:
+                self.applied_times[message["seq"]] = time.perf_counter()
+                self.sizes[message["seq"]] = size
+                self.applied.notify_all()
+
+    def wait_for(self, count, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        with self.applied:
+            while len(self.applied_times) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0.0:
+                    raise RuntimeError("Client applied {0} of {1} messages".format(len(self.applied_times), count))
+                self.applied.wait(remaining)
+            return max(self.applied_times), self.applied_times[max(self.applied_times)]
+
+def get_value_sockets(node_tree):
+    return [this_socket for this_node in node_tree.nodes for this_socket in this_node.inputs if this_socket.type == "VALUE" and not this_socket.is_linked]
+
+def run(node_count, seed, update_count):
+    node_tree = node_tree_generator.make_node_tree(node_count, seed)
+    rng = random.Random(seed)
+    sockets = get_value_sockets(node_tree)
+    server = cyclesmax_live.LiveServer(port=0)
+    receiver = ReceivingClient(server.port)
+    options = io_cyclesmax_shader.ExportOptions()
+    latencies = list()
+    export_seconds = 0.0
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            shader_string = io_cyclesmax_shader.serialize_node_graph(node_tree, options).get_graph_string()
+        server.push("Material", shader_string)
+        receiver.wait_for(1)
+        graph_bytes = receiver.sizes[1]
+        for update_index in range(update_count):
+            this_socket = sockets[rng.randrange(len(sockets))]
+            this_socket.default_value = round(rng.random(), 3)
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                shader_string = io_cyclesmax_shader.serialize_node_graph(node_tree, options).get_graph_string()
+            push_time = time.perf_counter()
+            export_seconds += push_time - start_time
+            server.push("Material", shader_string)
+            # Values that round to the same text as before produce no message
+            if not server.wait_until_acknowledged():
+                raise RuntimeError("Update was not acknowledged")
+            with receiver.applied:
+                last_seq = max(receiver.applied_times)
+                if receiver.applied_times[last_seq] >= push_time:
+                    latencies.append(receiver.applied_times[last_seq] - push_time)
+        reconstructed = receiver.client.snapshots["Material"]
+        expected = cyclesmax_live.split_shader_string(shader_string)
+        if reconstructed.nodes != expected.nodes or reconstructed.links != expected.links:
+            raise RuntimeError("Client graph does not match the last export")
+    finally:
+        receiver.client.close()
+        server.close()
+
+    result = dict()
+    result["nodes"] = node_count
+    result["graph_bytes"] = graph_bytes
+    result["updates"] = server.delta_count
+    result["bytes_per_update"] = server.delta_bytes / server.delta_count if server.delta_count > 0 else 0.0
+    latencies.sort()
+    result["median_latency"] = latencies[len(latencies) // 2] if len(latencies) > 0 else 0.0
+    result["max_latency"] = latencies[-1] if len(latencies) > 0 else 0.0
+    result["export_seconds"] = export_seconds / update_count if update_count > 0 else 0.0
+    return result
+
+def print_result(result):
+    ratio = result["graph_bytes"] / result["bytes_per_update"] if result["bytes_per_update"] > 0 else 0.0
+    print("{0:>7} nodes | full graph {1:10} bytes | {2:4} updates {3:8.0f} bytes each, {4:8.1f}x smaller | applied after {5:7.3f} ms median {6:7.3f} ms max | export {7:8.3f} ms".format(
+        result["nodes"], result["graph_bytes"], result["updates"], result["bytes_per_update"], ratio,
+        1000.0 * result["median_latency"], 1000.0 * result["max_latency"], 1000.0 * result["export_seconds"]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the live updates of watch mode without Blender")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--updates", type=int, default=50, help="Number of value changes to push for each size")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    for node_count in args.nodes:
+        print_result(run(node_count, args.seed, args.updates))
+
+if __name__ == "__main__":
+    main()
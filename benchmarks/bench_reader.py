@@ -0,0 +1,100 @@
+# Benchmark for cyclesmax_reader on large synthetic .shader files
+#
+#   python benchmarks/bench_reader.py --nodes 1000 10000 100000
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cyclesmax_binary
+import cyclesmax_reader
+
+def make_shader_string(node_count, seed=0):
+    # Roughly the mix of value types a procedural material produces
+    rng = random.Random(seed)
+    tokens = ["cycles_shader", "1", "section_nodes"]
+    for index in range(node_count):
+        name = "node" + str(index + 1)
+        kind = index % 4
+        if kind == 0:
+            tokens += ["noise_tex", name, str(rng.randint(-2000, 2000)), str(float(rng.randint(-2000, 2000)))]
+            for param in ("w", "scale", "detail", "roughness", "distortion"):
+                tokens += [param, "{0:.4f}".format(rng.random())]
+            tokens += ["dimensions", "3D"]
+        elif kind == 1:
+            tokens += ["math", name, str(rng.randint(-2000, 2000)), str(float(rng.randint(-2000, 2000)))]
+            for param in ("value1", "value2", "value3"):
+                tokens += [param, "{0:.4f}".format(rng.random())]
+            tokens += ["math_type", "multiply", "use_clamp", "0"]
+        elif kind == 2:
+            tokens += ["mix_rgb", name, str(rng.randint(-2000, 2000)), str(float(rng.randint(-2000, 2000)))]
+            tokens += ["fac", "{0:.4f}".format(rng.random())]
+            for param in ("color1", "color2"):
+                tokens += [param, "{0:.4f},{1:.4f},{2:.4f}".format(rng.random(), rng.random(), rng.random())]
+            tokens += ["mix_type", "mix", "use_clamp", "0"]
+        else:
+            tokens += ["mapping", name, str(rng.randint(-2000, 2000)), str(float(rng.randint(-2000, 2000)))]
+            for param in ("vector", "location", "rotation", "scale"):
+                tokens += [param, "{0:.4f},{1:.4f},{2:.4f}".format(rng.random(), rng.random(), rng.random())]
+            tokens += ["mapping_type", "point"]
+        tokens.append("node_end")
+    tokens.append("section_connections")
+    for index in range(1, node_count):
+        tokens += ["node" + str(rng.randint(1, index)), "Color", "node" + str(index + 1), "Fac"]
+    return "|".join(tokens) + "|"
+
+def run(node_count, repeat):
+    shader_string = make_shader_string(node_count)
+    binary_data = cyclesmax_binary.encode_graph(cyclesmax_reader.parse_shader_string(shader_string))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, "bench.shader")
+        with open(filepath, "w") as output_file:
+            output_file.write(shader_string)
+        binary_filepath = os.path.join(temp_dir, "bench_binary.shader")
+        with open(binary_filepath, "wb") as output_file:
+            output_file.write(binary_data)
+
+        eager_seconds = None
+        lazy_seconds = None
+        binary_seconds = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            graph = cyclesmax_reader.read_shader(filepath)
+            elapsed = time.perf_counter() - start_time
+            eager_seconds = elapsed if eager_seconds is None else min(eager_seconds, elapsed)
+
+            start_time = time.perf_counter()
+            record_count = 0
+            for _record in cyclesmax_reader.iter_shader_records(filepath):
+                record_count += 1
+            elapsed = time.perf_counter() - start_time
+            lazy_seconds = elapsed if lazy_seconds is None else min(lazy_seconds, elapsed)
+
+            start_time = time.perf_counter()
+            cyclesmax_binary.read_any_shader(binary_filepath)
+            elapsed = time.perf_counter() - start_time
+            binary_seconds = elapsed if binary_seconds is None else min(binary_seconds, elapsed)
+
+    megabytes = len(shader_string) / (1024.0 * 1024.0)
+    binary_megabytes = len(binary_data) / (1024.0 * 1024.0)
+    print("{0:>8} nodes {1:8.2f} MB | eager {2:8.3f}s {3:10.0f} nodes/s {4:7.1f} MB/s | lazy {5:8.3f}s {6:10.0f} records/s | binary {7:8.2f} MB {8:8.3f}s".format(
+        node_count, megabytes,
+        eager_seconds, len(graph.nodes) / eager_seconds, megabytes / eager_seconds,
+        lazy_seconds, record_count / lazy_seconds,
+        binary_megabytes, binary_seconds))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the .shader reader on synthetic files")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3, help="Report the best of this many runs")
+    args = parser.parse_args(argv)
+    for node_count in args.nodes:
+        run(node_count, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# Minimal stand-in for the parts of bpy used by io_cyclesmax_shader.py, so the exporter can be
+# imported and benchmarked with a plain Python interpreter. Call install() before importing the add-on.
+#
+# Only attributes the exporter reads are modelled. Node trees are built with the Fake* classes
+# below, usually through node_tree_generator.py.
+
+import os
+import re
+import sys
+import types
+
+class FakeProperty:
+    def __init__(self, identifier, property_type):
+        self.identifier = identifier
+        self.type = property_type
+
+class FakePropertyCollection(list):
+    def keys(self):
+        return [this_property.identifier for this_property in self]
+
+class FakeCollection(list):
+    def get(self, name, default=None):
+        for this_item in self:
+            if this_item.name == name:
+                return this_item
+        return default
+
+    def foreach_get(self, attribute, buffer):
+        # Flattens the attribute of every item into buffer, like bpy_prop_collection.foreach_get
+        index = 0
+        for this_item in self:
+            value = getattr(this_item, attribute)
+            if isinstance(value, (tuple, list)):
+                for component in value:
+                    buffer[index] = component
+                    index += 1
+            else:
+                buffer[index] = value
+                index += 1
+
+class FakeRNA:
+    def __init__(self, properties):
+        self.properties = FakePropertyCollection(properties)
+
+# Properties every ShaderNode has, the exporter skips these when fingerprinting
+BASE_NODE_PROPERTIES = [
+    FakeProperty("name", 'STRING'),
+    FakeProperty("label", 'STRING'),
+    FakeProperty("location", 'FLOAT'),
+    FakeProperty("width", 'FLOAT'),
+    FakeProperty("height", 'FLOAT'),
+    FakeProperty("select", 'BOOLEAN'),
+    FakeProperty("hide", 'BOOLEAN'),
+    FakeProperty("mute", 'BOOLEAN'),
+    FakeProperty("show_options", 'BOOLEAN'),
+    FakeProperty("show_preview", 'BOOLEAN'),
+    FakeProperty("use_custom_color", 'BOOLEAN'),
+    FakeProperty("color", 'FLOAT'),
+    FakeProperty("bl_idname", 'STRING'),
+]
+
+PROPERTY_TYPE_BY_PYTHON_TYPE = {
+    bool: 'BOOLEAN',
+    int: 'INT',
+    float: 'FLOAT',
+    str: 'ENUM',
+}
+
+class FakeSocket:
+    def __init__(self, identifier, name, socket_type, default_value=None):
+        self.identifier = identifier
+        self.name = name
+        self.type = socket_type
+        self.default_value = default_value
+        self.is_linked = False
+        self.enabled = True
+        self.hide = False
+        self.node = None
+
+class FakeCurvePoint:
+    def __init__(self, location, handle_type='AUTO'):
+        self.location = location
+        self.handle_type = handle_type
+
+class FakeCurve:
+    def __init__(self, points):
+        self.points = points
+
+def interpolate_linear(positions, values, position):
+    # Straight lines between the points and flat past either end, which is close enough to Blender's curves for timing
+    if position <= positions[0]:
+        return values[0]
+    for index in range(1, len(positions)):
+        if position <= positions[index]:
+            t = (position - positions[index - 1]) / (positions[index] - positions[index - 1]) if positions[index] > positions[index - 1] else 0.0
+            return tuple(a + t * (b - a) for a, b in zip(values[index - 1], values[index]))
+    return values[-1]
+
+class FakeCurveMapping:
+    def __init__(self, curves):
+        self.curves = curves
+        self.use_clip = True
+        self.clip_min_x = 0.0
+        self.clip_min_y = 0.0
+        self.clip_max_x = 1.0
+        self.clip_max_y = 1.0
+        self.extend = 'EXTRAPOLATED'
+
+    def initialize(self):
+        pass
+
+    def evaluate(self, curve, position):
+        points = sorted(curve.points, key=lambda x: x.location[0])
+        return interpolate_linear([x.location[0] for x in points], [(x.location[1],) for x in points], position)[0]
+
+class FakeColorRampElement:
+    def __init__(self, position, color):
+        self.position = position
+        self.color = color
+        self.alpha = color[3]
+
+class FakeColorRamp:
+    def __init__(self, elements, interpolation='LINEAR'):
+        self.elements = elements
+        self.interpolation = interpolation
+        self.color_mode = 'RGB'
+        self.hue_interpolation = 'NEAR'
+
+    def evaluate(self, position):
+        elements = sorted(self.elements, key=lambda x: x.position)
+        return interpolate_linear([x.position for x in elements], [tuple(x.color) for x in elements], position)
+
+class FakeColorspaceSettings:
+    def __init__(self, name):
+        self.name = name
+
+class FakePackedFile:
+    def __init__(self, data):
+        self.data = data
+
+class FakeImage:
+    def __init__(self, filepath, colorspace="sRGB", packed_data=None):
+        self.filepath = filepath
+        self.source = 'FILE'
+        self.colorspace_settings = FakeColorspaceSettings(colorspace)
+        self.packed_file = None if packed_data is None else FakePackedFile(packed_data)
+        self.library = None
+
+class FakeNode:
+    def __init__(self, bl_idname, name, location=(0.0, 0.0), inputs=None, outputs=None, properties=None):
+        self.bl_idname = bl_idname
+        self.name = name
+        self.label = ""
+        self.location = location
+        self.mute = False
+        # Links from inputs to outputs that a muted node passes through
+        self.internal_links = list()
+        self.inputs = list() if inputs is None else inputs
+        self.outputs = list() if outputs is None else outputs
+        for this_socket in self.inputs + self.outputs:
+            this_socket.node = self
+        rna_properties = list(BASE_NODE_PROPERTIES)
+        if properties is not None:
+            for identifier, value in properties.items():
+                setattr(self, identifier, value)
+                rna_properties.append(FakeProperty(identifier, PROPERTY_TYPE_BY_PYTHON_TYPE.get(type(value), 'POINTER')))
+        self.bl_rna = FakeRNA(rna_properties)
+
+class FakeLink:
+    def __init__(self, from_socket, to_socket):
+        self.from_node = from_socket.node
+        self.from_socket = from_socket
+        self.to_node = to_socket.node
+        self.to_socket = to_socket
+        self.is_valid = True
+        self.is_muted = False
+        to_socket.is_linked = True
+        from_socket.is_linked = True
+
+class FakeNodeTree:
+    def __init__(self, name="NodeTree"):
+        self.name = name
+        self.nodes = FakeCollection()
+        self.links = FakeCollection()
+
+    def as_pointer(self):
+        return id(self)
+
+    def link(self, from_socket, to_socket):
+        this_link = FakeLink(from_socket, to_socket)
+        self.links.append(this_link)
+        return this_link
+
+    def get_output_node(self, target):
+        for this_node in self.nodes:
+            if this_node.bl_idname == "ShaderNodeOutputMaterial" and getattr(this_node, "is_active_output", True):
+                return this_node
+        return None
+
+class FakeMaterial:
+    def __init__(self, name, node_tree):
+        self.name = name
+        self.node_tree = node_tree
+        self.use_nodes = True
+
+class FakeData:
+    def __init__(self):
+        self.materials = FakeCollection()
+        self.node_groups = FakeCollection()
+        self.filepath = ""
+
+class FakeOperator:
+    def report(self, level, message):
+        print(level, message)
+
+class FakeMenu:
+    @staticmethod
+    def append(function):
+        pass
+
+    @staticmethod
+    def remove(function):
+        pass
+
+class FakeShaderNode:
+    bl_rna = FakeRNA(BASE_NODE_PROPERTIES)
+
+class FakeExportHelper:
+    filepath = ""
+
+class FakeTimers:
+    # Timers never fire on their own, call run() to run the registered functions once
+    def __init__(self):
+        self.functions = list()
+
+    def register(self, function, first_interval=0.0):
+        self.functions.append(function)
+
+    def unregister(self, function):
+        self.functions.remove(function)
+
+    def is_registered(self, function):
+        return function in self.functions
+
+    def run(self):
+        for this_function in list(self.functions):
+            if this_function() is None:
+                self.functions.remove(this_function)
+
+def fake_property(**kwargs):
+    return kwargs.get("default")
+
+def clean_name(name, replace="_"):
+    return re.sub(r"[^A-Za-z0-9_.-]", replace, name)
+
+def make_module(name, **attributes):
+    module = types.ModuleType(name)
+    for attribute_name, value in attributes.items():
+        setattr(module, attribute_name, value)
+    sys.modules[name] = module
+    return module
+
+def install():
+    # Registers fake bpy and bpy_extras modules, returns the fake bpy module
+    bpy_props = make_module("bpy.props",
+        BoolProperty=fake_property, EnumProperty=fake_property, FloatProperty=fake_property,
+        IntProperty=fake_property, StringProperty=fake_property)
+    bpy_types = make_module("bpy.types",
+        Operator=FakeOperator, ShaderNode=FakeShaderNode, TOPBAR_MT_file_export=FakeMenu,
+        Material=FakeMaterial, NodeTree=FakeNodeTree)
+    bpy_utils = make_module("bpy.utils",
+        register_class=lambda cls: None, unregister_class=lambda cls: None)
+    data = FakeData()
+
+    def abspath(path, start=None, library=None):
+        # Paths starting with // are relative to the open .blend file
+        if path.startswith("//"):
+            return os.path.join(os.path.dirname(data.filepath) if start is None else start, path[2:])
+        return path
+
+    bpy_path = make_module("bpy.path", clean_name=clean_name, abspath=abspath)
+    bpy_app_handlers = make_module("bpy.app.handlers", depsgraph_update_post=list(), load_pre=list(), persistent=lambda function: function)
+    bpy_app = make_module("bpy.app", background=True, version=(2, 83, 0), handlers=bpy_app_handlers, timers=FakeTimers())
+    bpy = make_module("bpy", props=bpy_props, types=bpy_types, utils=bpy_utils, path=bpy_path, app=bpy_app, data=data)
+    bpy_extras_io_utils = make_module("bpy_extras.io_utils", ExportHelper=FakeExportHelper)
+    make_module("bpy_extras", io_utils=bpy_extras_io_utils)
+    return bpy
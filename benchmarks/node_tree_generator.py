@@ -0,0 +1,251 @@
+# Synthetic shader node trees built from the fake_bpy stand-ins, for benchmarking the exporter
+#
+# The type mix follows a typical procedural material: texture coordinates and mapping feeding
+# noise, voronoi and wave textures, post-processed by math, ramps, curves and mixes, with a few
+# image textures, bump and normal maps and a shading layer of principled BSDFs and mix shaders.
+
+import random
+
+from fake_bpy import (
+    FakeCollection,
+    FakeColorRamp,
+    FakeColorRampElement,
+    FakeCurve,
+    FakeCurveMapping,
+    FakeCurvePoint,
+    FakeImage,
+    FakeMaterial,
+    FakeNode,
+    FakeNodeTree,
+    FakeSocket,
+)
+
+# Shared sources are picked from this many of the most recently made nodes, which keeps the graph local like a hand-built one
+LINK_WINDOW = 32
+# Chance that a non-shader input is linked rather than left at its default value
+LINK_PROBABILITY = 0.35
+# Chance that a linked input reads from an existing node instead of a new one
+SHARE_PROBABILITY = 0.2
+# Chance of adding a node that is not connected to anything
+STRAY_PROBABILITY = 0.02
+
+SHADER_IDNAMES = ("ShaderNodeBsdfPrincipled", "ShaderNodeMixShader")
+SHADER_WEIGHTS = (3, 1)
+
+MATH_OPERATIONS = ('ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE', 'POWER', 'MINIMUM', 'MAXIMUM', 'GREATER_THAN', 'SINE', 'ABSOLUTE', 'FRACT', 'SMOOTH_MIN')
+VECTOR_MATH_OPERATIONS = ('ADD', 'SUBTRACT', 'MULTIPLY', 'SCALE', 'NORMALIZE', 'CROSS_PRODUCT', 'DOT_PRODUCT', 'LENGTH')
+BLEND_TYPES = ('MIX', 'MULTIPLY', 'ADD', 'SCREEN', 'OVERLAY', 'DARKEN', 'LIGHTEN', 'SOFT_LIGHT')
+
+class NodeRecipe:
+    def __init__(self, bl_idname, weight, inputs, outputs, make_properties=None):
+        self.bl_idname = bl_idname
+        # Relative frequency in the body of the graph, 0 for nodes only placed by the generator itself
+        self.weight = weight
+        # (identifier, name, type) for each socket
+        self.inputs = inputs
+        self.outputs = outputs
+        self.make_properties = make_properties
+
+def value_socket(name, identifier=None):
+    return (name if identifier is None else identifier, name, 'VALUE')
+
+def color_socket(name, identifier=None):
+    return (name if identifier is None else identifier, name, 'RGBA')
+
+def vector_socket(name, identifier=None):
+    return (name if identifier is None else identifier, name, 'VECTOR')
+
+def shader_socket(name, identifier=None):
+    return (name if identifier is None else identifier, name, 'SHADER')
+
+def make_curve_mapping(rng):
+    curves = list()
+    for _ in range(4):
+        points = [FakeCurvePoint((0.0, 0.0))]
+        for _ in range(rng.randint(0, 3)):
+            points.append(FakeCurvePoint((rng.random(), rng.random()), rng.choice(('AUTO', 'VECTOR'))))
+        points.append(FakeCurvePoint((1.0, 1.0)))
+        points.sort(key=lambda x: x.location[0])
+        curves.append(FakeCurve(points))
+    return FakeCurveMapping(curves)
+
+def make_color_ramp(rng):
+    elements = list()
+    for _ in range(rng.randint(2, 5)):
+        elements.append(FakeColorRampElement(rng.random(), (rng.random(), rng.random(), rng.random(), 1.0)))
+    elements.sort(key=lambda x: x.position)
+    return FakeColorRamp(elements, rng.choice(('LINEAR', 'EASE', 'CONSTANT')))
+
+def get_recipes(image_count):
+    output = list()
+    output.append(NodeRecipe("ShaderNodeTexCoord", 4, [],
+        [vector_socket("Generated"), vector_socket("Normal"), vector_socket("UV"), vector_socket("Object"), vector_socket("Camera"), vector_socket("Window"), vector_socket("Reflection")],
+        lambda rng: {"from_instancer": False}))
+    output.append(NodeRecipe("ShaderNodeMapping", 5,
+        [vector_socket("Vector"), vector_socket("Location"), vector_socket("Rotation"), vector_socket("Scale")],
+        [vector_socket("Vector")],
+        lambda rng: {"vector_type": 'POINT'}))
+    output.append(NodeRecipe("ShaderNodeTexNoise", 8,
+        [vector_socket("Vector"), value_socket("W"), value_socket("Scale"), value_socket("Detail"), value_socket("Roughness"), value_socket("Distortion")],
+        [value_socket("Fac"), color_socket("Color")],
+        lambda rng: {"noise_dimensions": '3D'}))
+    output.append(NodeRecipe("ShaderNodeTexVoronoi", 5,
+        [vector_socket("Vector"), value_socket("W"), value_socket("Scale"), value_socket("Smoothness"), value_socket("Exponent"), value_socket("Randomness")],
+        [value_socket("Distance"), color_socket("Color"), vector_socket("Position"), value_socket("W"), value_socket("Radius")],
+        lambda rng: {"voronoi_dimensions": '3D', "feature": rng.choice(('F1', 'F2', 'SMOOTH_F1')), "distance": 'EUCLIDEAN'}))
+    output.append(NodeRecipe("ShaderNodeTexWave", 2,
+        [vector_socket("Vector"), value_socket("Scale"), value_socket("Distortion"), value_socket("Detail"), value_socket("Detail Scale"), value_socket("Detail Roughness"), value_socket("Phase Offset")],
+        [color_socket("Color"), value_socket("Fac")],
+        lambda rng: {"wave_type": rng.choice(('BANDS', 'RINGS')), "bands_direction": 'X', "rings_direction": 'X', "wave_profile": 'SIN'}))
+    output.append(NodeRecipe("ShaderNodeTexMusgrave", 2,
+        [vector_socket("Vector"), value_socket("W"), value_socket("Scale"), value_socket("Detail"), value_socket("Dimension"), value_socket("Lacunarity"), value_socket("Offset"), value_socket("Gain")],
+        [value_socket("Fac")],
+        lambda rng: {"musgrave_type": 'FBM', "musgrave_dimensions": '3D'}))
+    output.append(NodeRecipe("ShaderNodeTexImage", 3 if image_count > 0 else 0,
+        [vector_socket("Vector")],
+        [color_socket("Color"), value_socket("Alpha")],
+        lambda rng: {"image": FakeImage("//textures/texture_{0}.png".format(rng.randrange(image_count))), "interpolation": 'Linear', "projection": 'FLAT', "extension": 'REPEAT'}))
+    output.append(NodeRecipe("ShaderNodeMath", 14,
+        [value_socket("Value"), value_socket("Value", "Value_001"), value_socket("Value", "Value_002")],
+        [value_socket("Value")],
+        lambda rng: {"operation": rng.choice(MATH_OPERATIONS), "use_clamp": rng.random() < 0.2}))
+    output.append(NodeRecipe("ShaderNodeVectorMath", 5,
+        [vector_socket("Vector"), vector_socket("Vector", "Vector_001"), vector_socket("Vector", "Vector_002"), value_socket("Scale")],
+        [vector_socket("Vector"), value_socket("Value")],
+        lambda rng: {"operation": rng.choice(VECTOR_MATH_OPERATIONS)}))
+    output.append(NodeRecipe("ShaderNodeMixRGB", 10,
+        [value_socket("Fac"), color_socket("Color1"), color_socket("Color2")],
+        [color_socket("Color")],
+        lambda rng: {"blend_type": rng.choice(BLEND_TYPES), "use_clamp": rng.random() < 0.2}))
+    output.append(NodeRecipe("ShaderNodeValToRGB", 7,
+        [value_socket("Fac")],
+        [color_socket("Color"), value_socket("Alpha")],
+        lambda rng: {"color_ramp": make_color_ramp(rng)}))
+    output.append(NodeRecipe("ShaderNodeRGBCurve", 2,
+        [value_socket("Fac"), color_socket("Color")],
+        [color_socket("Color")],
+        lambda rng: {"mapping": make_curve_mapping(rng)}))
+    output.append(NodeRecipe("ShaderNodeMapRange", 3,
+        [value_socket("Value"), value_socket("From Min"), value_socket("From Max"), value_socket("To Min"), value_socket("To Max"), value_socket("Steps")],
+        [value_socket("Result")],
+        lambda rng: {"interpolation_type": 'LINEAR', "clamp": True}))
+    output.append(NodeRecipe("ShaderNodeSeparateXYZ", 2,
+        [vector_socket("Vector")],
+        [value_socket("X"), value_socket("Y"), value_socket("Z")]))
+    output.append(NodeRecipe("ShaderNodeCombineXYZ", 2,
+        [value_socket("X"), value_socket("Y"), value_socket("Z")],
+        [vector_socket("Vector")]))
+    output.append(NodeRecipe("ShaderNodeValue", 4, [], [value_socket("Value")]))
+    output.append(NodeRecipe("ShaderNodeRGB", 3, [], [color_socket("Color")]))
+    output.append(NodeRecipe("ShaderNodeBump", 2,
+        [value_socket("Strength"), value_socket("Distance"), value_socket("Height"), vector_socket("Normal")],
+        [vector_socket("Normal")],
+        lambda rng: {"invert": False}))
+    output.append(NodeRecipe("ShaderNodeNormalMap", 1,
+        [value_socket("Strength"), color_socket("Color")],
+        [vector_socket("Normal")],
+        lambda rng: {"space": 'TANGENT', "uv_map": ""}))
+    output.append(NodeRecipe("ShaderNodeBsdfPrincipled", 0,
+        [color_socket("Base Color"), value_socket("Subsurface"), vector_socket("Subsurface Radius"), color_socket("Subsurface Color"),
+            value_socket("Metallic"), value_socket("Specular"), value_socket("Specular Tint"), value_socket("Roughness"),
+            value_socket("Anisotropic"), value_socket("Anisotropic Rotation"), value_socket("Sheen"), value_socket("Sheen Tint"),
+            value_socket("Clearcoat"), value_socket("Clearcoat Roughness"), value_socket("IOR"), value_socket("Transmission"),
+            value_socket("Transmission Roughness"), color_socket("Emission"), value_socket("Emission Strength"), value_socket("Alpha"),
+            vector_socket("Normal"), vector_socket("Clearcoat Normal"), vector_socket("Tangent")],
+        [shader_socket("BSDF")],
+        lambda rng: {"distribution": 'GGX', "subsurface_method": 'BURLEY'}))
+    output.append(NodeRecipe("ShaderNodeMixShader", 0,
+        [value_socket("Fac"), shader_socket("Shader"), shader_socket("Shader", "Shader_001")],
+        [shader_socket("Shader")]))
+    output.append(NodeRecipe("ShaderNodeOutputMaterial", 0,
+        [shader_socket("Surface"), shader_socket("Volume"), vector_socket("Displacement")],
+        [],
+        lambda rng: {"is_active_output": True, "target": 'ALL'}))
+    return output
+
+def get_default_value(rng, socket_type):
+    if socket_type == 'VALUE':
+        return rng.random()
+    if socket_type == 'RGBA':
+        return (rng.random(), rng.random(), rng.random(), 1.0)
+    if socket_type == 'VECTOR':
+        return (rng.random(), rng.random(), rng.random())
+    return None
+
+def make_node(rng, recipe, name):
+    inputs = [FakeSocket(identifier, name, socket_type, get_default_value(rng, socket_type)) for identifier, name, socket_type in recipe.inputs]
+    outputs = [FakeSocket(identifier, name, socket_type, get_default_value(rng, socket_type)) for identifier, name, socket_type in recipe.outputs]
+    properties = None if recipe.make_properties is None else recipe.make_properties(rng)
+    return FakeNode(recipe.bl_idname, name, (0.0, 0.0), inputs, outputs, properties)
+
+def add_open_inputs(rng, node_index, node, open_inputs):
+    for input_socket in node.inputs:
+        # Shader inputs are always linked, the shading layer would not make sense otherwise
+        if input_socket.type == 'SHADER' or rng.random() < LINK_PROBABILITY:
+            open_inputs.append((node_index, input_socket))
+
+def make_node_tree(node_count, seed=0, image_count=8, name="Material"):
+    # Builds a material node tree with exactly node_count nodes, ending in a material output.
+    # The tree is grown backwards from the output by filling open inputs, either with a new node
+    # or with one made after the input's node, so links always point from later nodes to earlier
+    # ones and the graph can't have cycles.
+    rng = random.Random(seed)
+    recipes = get_recipes(image_count)
+    recipe_by_idname = dict((x.bl_idname, x) for x in recipes)
+    body_recipes = [x for x in recipes if x.weight > 0 and x.bl_idname not in SHADER_IDNAMES]
+    body_weights = [x.weight for x in body_recipes]
+    shader_recipes = [recipe_by_idname[x] for x in SHADER_IDNAMES]
+
+    node_tree = FakeNodeTree(name)
+    if node_count <= 0:
+        return node_tree
+    nodes = [make_node(rng, recipe_by_idname["ShaderNodeOutputMaterial"], "Material Output")]
+    # Only the surface of the output is used, a volume shader would be a different kind of material
+    open_inputs = [(0, nodes[0].inputs[0])]
+    while len(nodes) < node_count:
+        if len(open_inputs) == 0:
+            # Everything so far is fully linked, grow again from a random input that is still unlinked
+            node_index = rng.randrange(len(nodes))
+            unlinked = [x for x in nodes[node_index].inputs if not x.is_linked and x.type != 'SHADER']
+            if len(unlinked) > 0:
+                open_inputs.append((node_index, rng.choice(unlinked)))
+            continue
+        if rng.random() < STRAY_PROBABILITY:
+            # A leftover node that is not connected to anything
+            recipe = rng.choices(body_recipes, body_weights)[0]
+            nodes.append(make_node(rng, recipe, "{0}.{1:03d}".format(recipe.bl_idname[10:], len(nodes))))
+            continue
+        # Swap a random open input to the end so taking it out is cheap
+        swap_index = rng.randrange(len(open_inputs))
+        open_inputs[swap_index], open_inputs[-1] = open_inputs[-1], open_inputs[swap_index]
+        dest_index, input_socket = open_inputs.pop()
+        is_shader = input_socket.type == 'SHADER'
+        # Reuse a recent node for some inputs so outputs are shared like in a hand-built graph
+        if not is_shader and dest_index + 1 < len(nodes) and rng.random() < SHARE_PROBABILITY:
+            source_index = rng.randrange(max(dest_index + 1, len(nodes) - LINK_WINDOW), len(nodes))
+            sources = [x for x in nodes[source_index].outputs if x.type != 'SHADER']
+            if len(sources) > 0:
+                node_tree.link(rng.choice(sources), input_socket)
+                continue
+        if is_shader:
+            # Mix shaders are rarer than BSDFs so the shading layer stays small
+            recipe = rng.choices(shader_recipes, SHADER_WEIGHTS)[0]
+        else:
+            recipe = rng.choices(body_recipes, body_weights)[0]
+        node_index = len(nodes)
+        node = make_node(rng, recipe, "{0}.{1:03d}".format(recipe.bl_idname[10:], node_index))
+        nodes.append(node)
+        sources = [x for x in node.outputs if (x.type == 'SHADER') == is_shader]
+        node_tree.link(rng.choice(sources), input_socket)
+        add_open_inputs(rng, node_index, node, open_inputs)
+
+    # Creation order is from the output backwards, lay nodes out left to right in columns of 20
+    nodes.reverse()
+    # Jitter has two decimals so floor() gives the same position whether it is read as float32 like Blender or as float64
+    for index, this_node in enumerate(nodes):
+        this_node.location = (300.0 * (index // 20), -200.0 * (index % 20) + round(rng.uniform(-50.0, 50.0), 2))
+    node_tree.nodes = FakeCollection(nodes)
+    return node_tree
+
+def make_material(node_count, seed=0, image_count=8, name="Material"):
+    return FakeMaterial(name, make_node_tree(node_count, seed, image_count, name))
@@ -0,0 +1,221 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Batch driver that exports every material from a directory of .blend files.
+# Each .blend file is handled by its own background Blender process running
+# io_cyclesmax_shader.py, so this script itself does not need bpy.
+#
+#   python cyclesmax_batch.py path/to/blends path/to/output --jobs 8 --resume
+#
+# Options not recognized here are passed on to io_cyclesmax_shader.py, for example --force or --prune
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+ADDON_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "io_cyclesmax_shader.py")
+STATE_FILENAME = "batch_state.jsonl"
+# Written in each .blend file's output directory with --bundle
+BUNDLE_FILENAME = "materials.shaderlib"
+
+class BatchJob:
+    def __init__(self):
+        self.blend_path = ""
+        self.output_dir = ""
+        # Empty unless the materials go to a bundle instead of separate .shader files
+        self.bundle_path = ""
+        self.report_path = ""
+        self.mtime = 0.0
+
+class BatchResult:
+    def __init__(self):
+        self.blend_path = ""
+        self.mtime = 0.0
+        self.ok = False
+        self.seconds = 0.0
+        self.material_count = 0
+        self.error = ""
+
+    def to_dict(self):
+        output = dict()
+        output["blend_file"] = self.blend_path
+        output["mtime"] = self.mtime
+        output["ok"] = self.ok
+        output["seconds"] = self.seconds
+        output["materials"] = self.material_count
+        output["error"] = self.error
+        return output
+
+def find_blend_files(input_dir, recursive):
+    output = list()
+    if recursive:
+        for dir_path, dir_names, file_names in os.walk(input_dir):
+            dir_names.sort()
+            for this_name in sorted(file_names):
+                if this_name.lower().endswith(".blend"):
+                    output.append(os.path.join(dir_path, this_name))
+    else:
+        for this_name in sorted(os.listdir(input_dir)):
+            if this_name.lower().endswith(".blend"):
+                output.append(os.path.join(input_dir, this_name))
+    return output
+
+def load_completed(state_path):
+    # Later lines win, so a file that failed and then succeeded counts as done
+    completed = dict()
+    if not os.path.isfile(state_path):
+        return completed
+    with open(state_path, "r") as state_file:
+        for this_line in state_file:
+            this_line = this_line.strip()
+            if len(this_line) == 0:
+                continue
+            try:
+                entry = json.loads(this_line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if entry.get("ok"):
+                completed[entry["blend_file"]] = entry.get("mtime")
+            else:
+                completed.pop(entry["blend_file"], None)
+    return completed
+
+def make_job(blend_path, input_dir, output_dir, bundle):
+    job = BatchJob()
+    job.blend_path = os.path.abspath(blend_path)
+    job.mtime = os.path.getmtime(blend_path)
+    # Keep one output directory per .blend so material names from different files can't collide
+    relative_path = os.path.relpath(blend_path, input_dir)
+    job.output_dir = os.path.join(output_dir, os.path.splitext(relative_path)[0])
+    if bundle:
+        job.bundle_path = os.path.join(job.output_dir, BUNDLE_FILENAME)
+    job.report_path = os.path.join(job.output_dir, "export_report.json")
+    return job
+
+def run_job(blender, job, timeout, export_args):
+    result = BatchResult()
+    result.blend_path = job.blend_path
+    result.mtime = job.mtime
+    os.makedirs(job.output_dir, exist_ok=True)
+    if os.path.isfile(job.report_path):
+        os.remove(job.report_path)
+    command = [
+        blender,
+        "--background",
+        "--factory-startup",
+        job.blend_path,
+        "--python-exit-code", "1",
+        "--python", ADDON_SCRIPT,
+        "--",
+        "--report", job.report_path,
+    ]
+    # The export script takes one or the other
+    if job.bundle_path != "":
+        command += ["--bundle", job.bundle_path]
+    else:
+        command += ["--output-dir", job.output_dir]
+    command += export_args
+    start_time = time.perf_counter()
+    try:
+        completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout, universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        result.seconds = time.perf_counter() - start_time
+        result.error = "Timed out after {0}s".format(timeout)
+        return result
+    except OSError as error:
+        result.seconds = time.perf_counter() - start_time
+        result.error = "Failed to launch Blender: {0}".format(error)
+        return result
+    result.seconds = time.perf_counter() - start_time
+
+    if completed.returncode != 0 or not os.path.isfile(job.report_path):
+        # Keep the tail of Blender's output, that is where the traceback ends up
+        output_lines = completed.stdout.strip().splitlines()
+        result.error = "Blender exited with code {0}: {1}".format(completed.returncode, " / ".join(output_lines[-5:]))
+        return result
+
+    with open(job.report_path, "r") as report_file:
+        report = json.load(report_file)
+    result.ok = True
+    result.material_count = len(report["materials"])
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export every material from a directory of .blend files to .shader files.")
+    parser.add_argument("input_dir", help="Directory containing .blend files")
+    parser.add_argument("output_dir", help="Directory to write .shader files to, one subdirectory per .blend file")
+    parser.add_argument("--blender", default="blender", help="Path to the Blender executable")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of Blender processes to run at once")
+    parser.add_argument("--recursive", action="store_true", help="Also search subdirectories of input_dir")
+    parser.add_argument("--resume", action="store_true", help="Skip .blend files that were exported successfully by a previous run and have not changed since")
+    parser.add_argument("--bundle", action="store_true", help="Write the materials of each .blend file to one shader library bundle, {0} in its subdirectory".format(BUNDLE_FILENAME))
+    parser.add_argument("--timeout", type=float, default=None, help="Give up on a single .blend file after this many seconds")
+    # Any other options (--force, --prune...) are passed on to io_cyclesmax_shader.py
+    args, export_args = parser.parse_known_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    state_path = os.path.join(args.output_dir, STATE_FILENAME)
+    if args.resume:
+        completed = load_completed(state_path)
+    else:
+        completed = dict()
+        if os.path.isfile(state_path):
+            os.remove(state_path)
+
+    jobs = list()
+    skipped_count = 0
+    for this_path in find_blend_files(args.input_dir, args.recursive):
+        this_job = make_job(this_path, args.input_dir, args.output_dir, args.bundle)
+        if completed.get(this_job.blend_path) == this_job.mtime:
+            skipped_count += 1
+            continue
+        jobs.append(this_job)
+
+    print("Exporting {0} .blend files with {1} workers ({2} skipped as already done)".format(len(jobs), args.jobs, skipped_count))
+
+    start_time = time.perf_counter()
+    failures = list()
+    material_count = 0
+    # Each worker thread only waits on its own Blender subprocess
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor, open(state_path, "a") as state_file:
+        futures = [executor.submit(run_job, args.blender, this_job, args.timeout, export_args) for this_job in jobs]
+        for this_future in as_completed(futures):
+            result = this_future.result()
+            state_file.write(json.dumps(result.to_dict()) + "\n")
+            state_file.flush()
+            if result.ok:
+                material_count += result.material_count
+                print("[ok]   {0:8.2f}s {1} ({2} materials)".format(result.seconds, result.blend_path, result.material_count))
+            else:
+                failures.append(result)
+                print("[fail] {0:8.2f}s {1}: {2}".format(result.seconds, result.blend_path, result.error))
+    total_seconds = time.perf_counter() - start_time
+
+    print("Exported {0} materials from {1} files in {2:.2f}s, {3} failed".format(material_count, len(jobs) - len(failures), total_seconds, len(failures)))
+    if len(failures) > 0:
+        print("Rerun with --resume to retry only the failed files")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Binary encoding of the .shader node and connection model, and a converter between it and the text format.
+# Binary files keep the .shader extension and are told apart from text files by their magic bytes.
+# This module does not use bpy.
+#
+# Layout, all numbers little-endian:
+#   header: magic, string count, node count, connection count
+#   string table: varint byte length and utf-8 bytes of every node type, name, parameter name,
+#     socket name, string value and header field, each stored once
+#   header fields: varint count, then a name and value string index for each, the same fields as in text files
+#   nodes: varint type and name string indices, float32 x and y position, varint value count,
+#     then a type tag, varint name string index and packed value for each value
+#   connections: varint source node index, source socket string index, destination node index
+#     and destination socket string index
+#
+# Floats are stored as float32, the precision Cycles uses, rather than rounded to 4 decimal places.
+# The few values whose float32 would be written with a different last decimal in the text format are stored
+# as float64 instead, so converting a file to text gives exactly the text the exporter writes.
+# Colors keep their alpha component, which the text format drops.
+# CMXSHDB1 files have no header fields or float64 values and are still read.
+#
+#   python cyclesmax_binary.py material.shader material_binary.shader
+#   python cyclesmax_binary.py material_binary.shader material_text.shader --to text
+
+import argparse
+import gc
+import struct
+import sys
+
+import cyclesmax_reader
+
+BINARY_MAGIC = b"CMXSHDB2"
+OLD_BINARY_MAGIC = b"CMXSHDB1"
+BINARY_VERSION = "binary"
+HEADER_STRUCT = struct.Struct("<8sIII")
+POSITION_STRUCT = struct.Struct("<2f")
+FLOAT_STRUCT = struct.Struct("<f")
+FLOAT3_STRUCT = struct.Struct("<3f")
+FLOAT4_STRUCT = struct.Struct("<4f")
+INT_STRUCT = struct.Struct("<i")
+DOUBLE_STRUCT = struct.Struct("<d")
+DOUBLE3_STRUCT = struct.Struct("<3d")
+DOUBLE4_STRUCT = struct.Struct("<4d")
+
+VALUE_FLOAT = 0
+VALUE_FLOAT3 = 1
+VALUE_FLOAT4 = 2
+VALUE_STRING = 3
+VALUE_INT = 4
+VALUE_DOUBLE = 5
+VALUE_DOUBLE3 = 6
+VALUE_DOUBLE4 = 7
+
+# float32 is within a relative 2^-24 of a value, so it can only change the value's 4th decimal in text when
+# value * 10000 is within that of a half. Twice that covers the error of the multiplication.
+# Infinities and NaN give a NaN remainder, which compares False, and float32 holds them exactly.
+DOUBLE_MARGIN = 2.0 ** -23
+
+def pack_varint(output, value):
+    while value >= 0x80:
+        output.append((value & 0x7f) | 0x80)
+        value >>= 7
+    output.append(value)
+
+def unpack_varint(buffer, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+class BinaryShaderWriter:
+    def __init__(self):
+        self.strings = list()
+        self.string_indices = dict()
+        self.node_indices = dict()
+        self.node_data = bytearray()
+        self.connection_data = bytearray()
+        self.connection_count = 0
+        self.header_fields = dict()
+
+    def intern(self, value):
+        index = self.string_indices.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self.string_indices[value] = index
+        return index
+
+    def add_node(self, node_type, name, position, float_values, float3_values, float4_values, string_values, int_values):
+        data = self.node_data
+        self.node_indices[name] = len(self.node_indices)
+        pack_varint(data, self.intern(node_type))
+        pack_varint(data, self.intern(name))
+        data += POSITION_STRUCT.pack(position[0], position[1])
+        pack_varint(data, len(float_values) + len(float3_values) + len(float4_values) + len(string_values) + len(int_values))
+        margin = DOUBLE_MARGIN
+        for value_name, value in float_values.items():
+            scaled = value * 10000.0
+            if abs(scaled % 1.0 - 0.5) <= abs(scaled) * margin:
+                data.append(VALUE_DOUBLE)
+                pack_varint(data, self.intern(value_name))
+                data += DOUBLE_STRUCT.pack(value)
+                continue
+            data.append(VALUE_FLOAT)
+            pack_varint(data, self.intern(value_name))
+            data += FLOAT_STRUCT.pack(value)
+        for value_name, value in float3_values.items():
+            x = value[0] * 10000.0
+            y = value[1] * 10000.0
+            z = value[2] * 10000.0
+            if abs(x % 1.0 - 0.5) <= abs(x) * margin or abs(y % 1.0 - 0.5) <= abs(y) * margin or abs(z % 1.0 - 0.5) <= abs(z) * margin:
+                data.append(VALUE_DOUBLE3)
+                pack_varint(data, self.intern(value_name))
+                data += DOUBLE3_STRUCT.pack(value[0], value[1], value[2])
+                continue
+            data.append(VALUE_FLOAT3)
+            pack_varint(data, self.intern(value_name))
+            data += FLOAT3_STRUCT.pack(value[0], value[1], value[2])
+        for value_name, value in float4_values.items():
+            # The alpha component is not written to text files, so its precision does not matter
+            x = value[0] * 10000.0
+            y = value[1] * 10000.0
+            z = value[2] * 10000.0
+            if abs(x % 1.0 - 0.5) <= abs(x) * margin or abs(y % 1.0 - 0.5) <= abs(y) * margin or abs(z % 1.0 - 0.5) <= abs(z) * margin:
+                data.append(VALUE_DOUBLE4)
+                pack_varint(data, self.intern(value_name))
+                data += DOUBLE4_STRUCT.pack(value[0], value[1], value[2], value[3])
+                continue
+            data.append(VALUE_FLOAT4)
+            pack_varint(data, self.intern(value_name))
+            data += FLOAT4_STRUCT.pack(value[0], value[1], value[2], value[3])
+        for value_name, value in string_values.items():
+            data.append(VALUE_STRING)
+            pack_varint(data, self.intern(value_name))
+            pack_varint(data, self.intern(value))
+        for value_name, value in int_values.items():
+            data.append(VALUE_INT)
+            pack_varint(data, self.intern(value_name))
+            data += INT_STRUCT.pack(int(value))
+
+    def add_connection(self, source_node, source_socket, dest_node, dest_socket):
+        # Connections refer to nodes by their position in the file, so nodes must be added first
+        data = self.connection_data
+        pack_varint(data, self.node_indices[source_node])
+        pack_varint(data, self.intern(source_socket))
+        pack_varint(data, self.node_indices[dest_node])
+        pack_varint(data, self.intern(dest_socket))
+        self.connection_count += 1
+
+    def get_bytes(self):
+        header_indices = list()
+        for name, value in self.header_fields.items():
+            header_indices.append(self.intern(name))
+            header_indices.append(self.intern(value))
+        output = bytearray(HEADER_STRUCT.pack(BINARY_MAGIC, len(self.strings), len(self.node_indices), self.connection_count))
+        for this_string in self.strings:
+            encoded = this_string.encode("utf-8")
+            pack_varint(output, len(encoded))
+            output += encoded
+        pack_varint(output, len(self.header_fields))
+        for index in header_indices:
+            pack_varint(output, index)
+        output += self.node_data
+        output += self.connection_data
+        return bytes(output)
+
+def is_binary_shader(data):
+    return data[:len(BINARY_MAGIC)] in (BINARY_MAGIC, OLD_BINARY_MAGIC)
+
+def parse_shader_bytes(data):
+    data = bytes(data)
+    if len(data) < HEADER_STRUCT.size or not is_binary_shader(data):
+        raise cyclesmax_reader.ShaderFormatError("Not a binary .shader file")
+    magic, string_count, node_count, connection_count = HEADER_STRUCT.unpack_from(data, 0)
+    offset = HEADER_STRUCT.size
+
+    # Nearly every varint is a single byte, so that case is handled inline before falling back to unpack_varint
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        strings = list()
+        for _ in range(string_count):
+            length = data[offset]
+            if length < 0x80:
+                offset += 1
+            else:
+                length, offset = unpack_varint(data, offset)
+            strings.append(data[offset:offset + length].decode("utf-8"))
+            offset += length
+
+        graph = cyclesmax_reader.ShaderGraph()
+        graph.version = BINARY_VERSION
+        if magic != OLD_BINARY_MAGIC:
+            field_count, offset = unpack_varint(data, offset)
+            for _ in range(field_count):
+                name_index, offset = unpack_varint(data, offset)
+                value_index, offset = unpack_varint(data, offset)
+                name = strings[name_index]
+                if name not in cyclesmax_reader.HEADER_FIELDS or name in graph.header_fields:
+                    raise cyclesmax_reader.ShaderFormatError("Unsupported header field '{0}'".format(name[:32]))
+                graph.header_fields[name] = strings[value_index]
+            if graph.header_fields.get("order", "topological") != "topological":
+                raise cyclesmax_reader.ShaderFormatError("Unsupported node order '{0}'".format(graph.header_fields["order"]))
+        for _ in range(node_count):
+            record = cyclesmax_reader.ShaderNodeRecord()
+            index = data[offset]
+            if index < 0x80:
+                offset += 1
+            else:
+                index, offset = unpack_varint(data, offset)
+            record.node_type = strings[index]
+            index = data[offset]
+            if index < 0x80:
+                offset += 1
+            else:
+                index, offset = unpack_varint(data, offset)
+            record.name = strings[index]
+            record.position = POSITION_STRUCT.unpack_from(data, offset)
+            offset += POSITION_STRUCT.size
+            value_count = data[offset]
+            if value_count < 0x80:
+                offset += 1
+            else:
+                value_count, offset = unpack_varint(data, offset)
+            for _ in range(value_count):
+                tag = data[offset]
+                index = data[offset + 1]
+                if index < 0x80:
+                    offset += 2
+                else:
+                    index, offset = unpack_varint(data, offset + 1)
+                name = strings[index]
+                if tag == VALUE_FLOAT:
+                    record.float_values[name] = FLOAT_STRUCT.unpack_from(data, offset)[0]
+                    offset += 4
+                elif tag == VALUE_FLOAT3:
+                    record.float3_values[name] = FLOAT3_STRUCT.unpack_from(data, offset)
+                    offset += 12
+                elif tag == VALUE_FLOAT4:
+                    record.float4_values[name] = FLOAT4_STRUCT.unpack_from(data, offset)
+                    offset += 16
+                elif tag == VALUE_STRING:
+                    index, offset = unpack_varint(data, offset)
+                    record.string_values[name] = strings[index]
+                elif tag == VALUE_INT:
+                    record.int_values[name] = INT_STRUCT.unpack_from(data, offset)[0]
+                    offset += 4
+                elif tag == VALUE_DOUBLE:
+                    record.float_values[name] = DOUBLE_STRUCT.unpack_from(data, offset)[0]
+                    offset += 8
+                elif tag == VALUE_DOUBLE3:
+                    record.float3_values[name] = DOUBLE3_STRUCT.unpack_from(data, offset)
+                    offset += 24
+                elif tag == VALUE_DOUBLE4:
+                    record.float4_values[name] = DOUBLE4_STRUCT.unpack_from(data, offset)
+                    offset += 32
+                else:
+                    raise cyclesmax_reader.ShaderFormatError("Unknown value type {0} in node '{1}'".format(tag, record.name))
+            graph.nodes.append(record)
+
+        # The connection section is nothing but varints, so it is decoded in one pass and then split up
+        varints = list()
+        value = 0
+        shift = 0
+        for byte in data[offset:]:
+            if byte < 0x80:
+                varints.append(value | (byte << shift))
+                value = 0
+                shift = 0
+            else:
+                value |= (byte & 0x7f) << shift
+                shift += 7
+        if shift != 0 or len(varints) != connection_count * 4:
+            raise cyclesmax_reader.ShaderFormatError("Connection section does not match the connection count")
+        offset = len(data)
+        node_names = [this_node.name for this_node in graph.nodes]
+        connections = graph.connections
+        for index in range(0, len(varints), 4):
+            connections.append(cyclesmax_reader.ShaderConnectionRecord(
+                node_names[varints[index]], strings[varints[index + 1]], node_names[varints[index + 2]], strings[varints[index + 3]]))
+    except (IndexError, struct.error):
+        raise cyclesmax_reader.ShaderFormatError("File is truncated or refers to a string or node that does not exist")
+    except UnicodeDecodeError:
+        raise cyclesmax_reader.ShaderFormatError("String table is not valid utf-8")
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    if offset != len(data):
+        raise cyclesmax_reader.ShaderFormatError("Unexpected data after the last connection")
+    return graph
+
+def get_binary_header_fields(header_fields):
+    # The counts only check text files and binary files always hold every value, so neither is kept
+    return dict((name, value) for name, value in header_fields.items() if name not in cyclesmax_reader.COUNT_HEADER_FIELDS and name != "defaults")
+
+def encode_graph(graph):
+    writer = BinaryShaderWriter()
+    writer.header_fields = get_binary_header_fields(graph.header_fields)
+    for this_node in graph.nodes:
+        writer.add_node(this_node.node_type, this_node.name, this_node.position,
+            this_node.float_values, this_node.float3_values, this_node.float4_values, this_node.string_values, this_node.int_values)
+    for this_connection in graph.connections:
+        writer.add_connection(this_connection.source_node, this_connection.source_socket, this_connection.dest_node, this_connection.dest_socket)
+    return writer.get_bytes()
+
+def encode_text(graph):
+    # Written by the exporter's own text writer, so converting an exported binary file gives the text the exporter writes
+    # io_cyclesmax_shader.py can be imported without Blender, it must be importable from where this script is run
+    import io_cyclesmax_shader
+    cycles_graph = io_cyclesmax_shader.graph_from_shader_graph(graph)
+    # The counts are written again from the graph itself, and the values that the reader filled in are left out again
+    cycles_graph.header_fields = get_binary_header_fields(graph.header_fields)
+    if "defaults" in graph.header_fields:
+        io_cyclesmax_shader.omit_default_values(cycles_graph)
+    return cycles_graph.get_graph_string()
+
+def read_any_shader(filepath):
+    with open(filepath, "rb") as input_file:
+        data = input_file.read()
+    if is_binary_shader(data):
+        return parse_shader_bytes(data)
+    try:
+        shader_string = data.decode("utf-8")
+    except UnicodeDecodeError:
+        raise cyclesmax_reader.ShaderFormatError("Not a .shader file")
+    return cyclesmax_reader.parse_shader_string(shader_string)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert .shader files between the text and binary formats.")
+    parser.add_argument("input", help=".shader file to convert, in either format")
+    parser.add_argument("output", help="Path to write the converted file to")
+    parser.add_argument("--to", choices=("binary", "text"), default=None, help="Output format, defaults to the opposite of the input's format")
+    args = parser.parse_args(argv)
+
+    try:
+        graph = read_any_shader(args.input)
+    except (OSError, cyclesmax_reader.ShaderFormatError) as error:
+        print("{0}: {1}".format(args.input, error))
+        return 1
+
+    to_format = args.to
+    if to_format is None:
+        to_format = "text" if graph.version == BINARY_VERSION else "binary"
+    if to_format == "binary":
+        data = encode_graph(graph)
+    else:
+        try:
+            data = encode_text(graph).encode("utf-8")
+        except ValueError as error:
+            print("{0}: {1}".format(args.input, error))
+            return 1
+    with open(args.output, "wb") as output_file:
+        output_file.write(data)
+    print("Wrote {0} nodes and {1} connections to {2} as {3} ({4} bytes)".format(len(graph.nodes), len(graph.connections), args.output, to_format, len(data)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Shader library bundles pack many serialized shaders into one file with an index at the end.
+# This module does not use bpy, so render nodes can read bundles without Blender.
+#
+# Layout:
+#   header: magic, offset and size of the current index
+#   entry data, appended one after another
+#   index: name, fingerprint, offset, sizes, compression and crc32 of every entry
+#
+# Adding or replacing entries only appends new data and a new index, then rewrites the header.
+# The old index is left in place, so a bundle interrupted mid-update still points at the
+# previous complete index. Space left behind by replaced entries is reclaimed with compact().
+#
+#   python cyclesmax_bundle.py pack library.shaderlib path/to/*.shader
+#   python cyclesmax_bundle.py list library.shaderlib
+#   python cyclesmax_bundle.py extract library.shaderlib material_name
+#   python cyclesmax_bundle.py compact library.shaderlib
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+BUNDLE_MAGIC = b"CMXSLIB1"
+HEADER_STRUCT = struct.Struct("<8sQQ")
+INDEX_COUNT_STRUCT = struct.Struct("<I")
+INDEX_STRING_STRUCT = struct.Struct("<H")
+INDEX_ENTRY_STRUCT = struct.Struct("<QQQBI")
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+class BundleFormatError(Exception):
+    pass
+
+class BundleEntry:
+    def __init__(self):
+        self.name = ""
+        self.fingerprint = ""
+        self.offset = 0
+        self.stored_size = 0
+        self.raw_size = 0
+        self.compression = COMPRESSION_NONE
+        self.crc32 = 0
+
+def pack_index_string(value):
+    encoded = value.encode("utf-8")
+    if len(encoded) > 0xFFFF:
+        raise ValueError("Bundle entry names and fingerprints must be shorter than 64KiB")
+    return INDEX_STRING_STRUCT.pack(len(encoded)) + encoded
+
+def unpack_index_string(buffer, offset):
+    length = INDEX_STRING_STRUCT.unpack_from(buffer, offset)[0]
+    offset += INDEX_STRING_STRUCT.size
+    return bytes(buffer[offset:offset + length]).decode("utf-8"), offset + length
+
+def pack_index(entries):
+    output = [INDEX_COUNT_STRUCT.pack(len(entries))]
+    for this_entry in entries.values():
+        output.append(pack_index_string(this_entry.name))
+        output.append(pack_index_string(this_entry.fingerprint))
+        output.append(INDEX_ENTRY_STRUCT.pack(this_entry.offset, this_entry.stored_size, this_entry.raw_size, this_entry.compression, this_entry.crc32))
+    return b"".join(output)
+
+def unpack_index(buffer, offset, size):
+    entries = dict()
+    end = offset + size
+    if end > len(buffer):
+        raise BundleFormatError("Bundle index extends past the end of the file")
+    count = INDEX_COUNT_STRUCT.unpack_from(buffer, offset)[0]
+    offset += INDEX_COUNT_STRUCT.size
+    for _ in range(count):
+        this_entry = BundleEntry()
+        this_entry.name, offset = unpack_index_string(buffer, offset)
+        this_entry.fingerprint, offset = unpack_index_string(buffer, offset)
+        values = INDEX_ENTRY_STRUCT.unpack_from(buffer, offset)
+        offset += INDEX_ENTRY_STRUCT.size
+        this_entry.offset, this_entry.stored_size, this_entry.raw_size, this_entry.compression, this_entry.crc32 = values
+        entries[this_entry.name] = this_entry
+    if offset != end:
+        raise BundleFormatError("Bundle index size does not match its contents")
+    return entries
+
+def read_header(buffer):
+    if len(buffer) < HEADER_STRUCT.size:
+        raise BundleFormatError("File is too small to be a shader bundle")
+    magic, index_offset, index_size = HEADER_STRUCT.unpack_from(buffer, 0)
+    if magic != BUNDLE_MAGIC:
+        raise BundleFormatError("Not a shader bundle")
+    return index_offset, index_size
+
+class BundleReader:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.file = open(filepath, "rb")
+        try:
+            self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            index_offset, self.index_size = read_header(self.mapped)
+            self.entries = unpack_index(self.mapped, index_offset, self.index_size)
+        except BaseException:
+            self.file.close()
+            raise
+
+    def close(self):
+        self.mapped.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get_names(self):
+        return list(self.entries.keys())
+
+    def read_bytes(self, name):
+        this_entry = self.entries[name]
+        data = self.mapped[this_entry.offset:this_entry.offset + this_entry.stored_size]
+        if this_entry.compression == COMPRESSION_ZLIB:
+            data = zlib.decompress(data)
+        elif this_entry.compression != COMPRESSION_NONE:
+            raise BundleFormatError("Entry '{0}' uses unknown compression {1}".format(name, this_entry.compression))
+        if zlib.crc32(data) != this_entry.crc32:
+            raise BundleFormatError("Entry '{0}' is corrupt, its checksum does not match".format(name))
+        return data
+
+    def read_string(self, name):
+        return self.read_bytes(name).decode("utf-8")
+
+    def get_wasted_bytes(self):
+        # Data from replaced or removed entries and old indexes, reclaimed by compact()
+        live_bytes = HEADER_STRUCT.size + self.index_size + sum(this_entry.stored_size for this_entry in self.entries.values())
+        return len(self.mapped) - live_bytes
+
+class BundleWriter:
+    # Only one writer may have a bundle open at a time, readers can keep using it while it is updated
+    def __init__(self, filepath, compression=COMPRESSION_ZLIB, compression_level=6):
+        self.filepath = filepath
+        self.compression = compression
+        self.compression_level = compression_level
+        self.entries = dict()
+        self.is_dirty = False
+        if os.path.isfile(filepath):
+            self.file = open(filepath, "r+b")
+            try:
+                index_offset, index_size = read_header(self.file.read(HEADER_STRUCT.size))
+                self.file.seek(index_offset)
+                self.entries = unpack_index(self.file.read(index_size), 0, index_size)
+                self.data_end = self.file.seek(0, os.SEEK_END)
+            except BaseException:
+                self.file.close()
+                raise
+        else:
+            self.file = open(filepath, "w+b")
+            self.file.write(HEADER_STRUCT.pack(BUNDLE_MAGIC, HEADER_STRUCT.size, 0))
+            self.data_end = HEADER_STRUCT.size
+            self.is_dirty = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Leave the bundle on its previous index if the update failed part way through
+        if exc_type is None:
+            self.commit()
+        self.file.close()
+
+    def close(self):
+        self.commit()
+        self.file.close()
+
+    def is_current(self, name, fingerprint):
+        return name in self.entries and self.entries[name].fingerprint == fingerprint
+
+    def add(self, name, data, fingerprint="", compression=None):
+        self.add_prepared(*self.prepare(name, data, fingerprint, compression))
+
+    def prepare(self, name, data, fingerprint="", compression=None):
+        # Encodes and compresses an entry without touching the file, so it can run on another thread
+        # Returns (entry, stored data) for add_prepared
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if compression is None:
+            compression = self.compression
+        this_entry = BundleEntry()
+        this_entry.name = name
+        this_entry.fingerprint = fingerprint
+        this_entry.raw_size = len(data)
+        this_entry.crc32 = zlib.crc32(data)
+        this_entry.compression = COMPRESSION_NONE
+        if compression == COMPRESSION_ZLIB:
+            compressed = zlib.compress(data, self.compression_level)
+            # Small entries can grow when compressed
+            if len(compressed) < len(data):
+                data = compressed
+                this_entry.compression = COMPRESSION_ZLIB
+        return this_entry, data
+
+    def add_prepared(self, this_entry, data):
+        this_entry.offset = self.data_end
+        this_entry.stored_size = len(data)
+        self.file.seek(self.data_end)
+        self.file.write(data)
+        self.data_end += len(data)
+        self.entries[this_entry.name] = this_entry
+        self.is_dirty = True
+
+    def remove(self, name):
+        if name in self.entries:
+            del self.entries[name]
+            self.is_dirty = True
+
+    def commit(self):
+        if not self.is_dirty:
+            return
+        index_data = pack_index(self.entries)
+        index_offset = self.data_end
+        self.file.seek(index_offset)
+        self.file.write(index_data)
+        self.data_end += len(index_data)
+        # The new data and index must be on disk before the header points at them
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.seek(0)
+        self.file.write(HEADER_STRUCT.pack(BUNDLE_MAGIC, index_offset, len(index_data)))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.is_dirty = False
+
+def compact(filepath):
+    # Rewrite the bundle with only its live entries, then rename it over the original
+    temp_path = "{0}.{1}.tmp".format(filepath, os.getpid())
+    try:
+        with BundleReader(filepath) as reader, open(temp_path, "wb") as output_file:
+            output_file.write(HEADER_STRUCT.pack(BUNDLE_MAGIC, 0, 0))
+            new_entries = dict()
+            offset = HEADER_STRUCT.size
+            for name, old_entry in reader.entries.items():
+                data = reader.mapped[old_entry.offset:old_entry.offset + old_entry.stored_size]
+                output_file.write(data)
+                new_entry = BundleEntry()
+                new_entry.__dict__.update(old_entry.__dict__)
+                new_entry.offset = offset
+                new_entries[name] = new_entry
+                offset += len(data)
+            index_data = pack_index(new_entries)
+            output_file.write(index_data)
+            output_file.seek(0)
+            output_file.write(HEADER_STRUCT.pack(BUNDLE_MAGIC, offset, len(index_data)))
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def get_entry_name(filepath):
+    return os.path.splitext(os.path.basename(filepath))[0]
+
+def pack_files(bundle_path, filepaths, compression):
+    # Files whose contents are unchanged are not rewritten, so updating a large library is cheap
+    added_count = 0
+    with BundleWriter(bundle_path, compression=compression) as writer:
+        for this_path in filepaths:
+            with open(this_path, "rb") as input_file:
+                data = input_file.read()
+            fingerprint = "crc32:{0:08x}:{1}".format(zlib.crc32(data), len(data))
+            name = get_entry_name(this_path)
+            if writer.is_current(name, fingerprint):
+                continue
+            writer.add(name, data, fingerprint)
+            added_count += 1
+    return added_count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create and read shader library bundles")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    pack_parser = subparsers.add_parser("pack", help="Add or replace .shader files in a bundle")
+    pack_parser.add_argument("bundle")
+    pack_parser.add_argument("files", nargs="+")
+    pack_parser.add_argument("--no-compression", action="store_true")
+    list_parser = subparsers.add_parser("list", help="List the entries in a bundle")
+    list_parser.add_argument("bundle")
+    extract_parser = subparsers.add_parser("extract", help="Write one entry to stdout or a file")
+    extract_parser.add_argument("bundle")
+    extract_parser.add_argument("name")
+    extract_parser.add_argument("--output")
+    remove_parser = subparsers.add_parser("remove", help="Remove entries from a bundle")
+    remove_parser.add_argument("bundle")
+    remove_parser.add_argument("names", nargs="+")
+    compact_parser = subparsers.add_parser("compact", help="Reclaim space left by replaced entries")
+    compact_parser.add_argument("bundle")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        compression = COMPRESSION_NONE if args.no_compression else COMPRESSION_ZLIB
+        added_count = pack_files(args.bundle, args.files, compression)
+        print("Added {0} entries, {1} unchanged".format(added_count, len(args.files) - added_count))
+    elif args.command == "list":
+        with BundleReader(args.bundle) as reader:
+            for this_entry in reader.entries.values():
+                print("{0}\t{1}\t{2}".format(this_entry.name, this_entry.raw_size, this_entry.stored_size))
+            print("{0} entries, {1} bytes reclaimable by compact".format(len(reader.entries), reader.get_wasted_bytes()))
+    elif args.command == "extract":
+        with BundleReader(args.bundle) as reader:
+            if args.name not in reader:
+                print("No entry named '{0}'".format(args.name), file=sys.stderr)
+                return 1
+            data = reader.read_bytes(args.name)
+        if args.output is None:
+            # As stored, binary .shader entries are not text
+            sys.stdout.flush()
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        else:
+            with open(args.output, "wb") as output_file:
+                output_file.write(data)
+    elif args.command == "remove":
+        with BundleWriter(args.bundle) as writer:
+            for this_name in args.names:
+                writer.remove(this_name)
+    elif args.command == "compact":
+        compact(args.bundle)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
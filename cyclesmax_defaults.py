@@ -0,0 +1,150 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Default values of the parameters sparse .shader files leave out, shared by io_cyclesmax_shader.py and cyclesmax_reader.py
+# This module does not use bpy or the add-on, so loaders can import it on its own.
+
+# Sparse files, the ones with a defaults header field, leave out every parameter listed here for its node
+# type that equals the value here. cyclesmax_reader.py fills them back in when the file is read, so the exporter
+# and every loader must agree on this table, a change to it needs a new DEFAULTS_VERSION.
+# Values are the Blender defaults of each socket. Floats, three or four component tuples and ints are
+# stored as float_values, float3_values, float4_values and int_values.
+DEFAULTS_VERSION = "1"
+DEFAULT_VALUES = {
+    # Color
+    "bright_contrast": {"color": (1.0, 1.0, 1.0, 1.0), "bright": 0.0, "contrast": 0.0},
+    "gamma": {"color": (1.0, 1.0, 1.0, 1.0), "gamma": 1.0},
+    "hsv": {"hue": 0.5, "saturation": 1.0, "value": 1.0, "fac": 1.0, "color": (0.8, 0.8, 0.8, 1.0)},
+    "invert": {"fac": 1.0, "color": (0.0, 0.0, 0.0, 1.0)},
+    "light_falloff": {"strength": 100.0, "smooth": 0.0},
+    "mix_rgb": {"fac": 0.5, "color1": (0.5, 0.5, 0.5, 1.0), "color2": (0.5, 0.5, 0.5, 1.0), "use_clamp": 0},
+    "rgb_curves": {"fac": 1.0, "color": (1.0, 1.0, 1.0, 1.0)},
+    # Converter
+    "blackbody": {"temperature": 1500.0},
+    "clamp": {"value": 1.0, "min": 0.0, "max": 1.0},
+    "color_ramp": {"fac": 0.5},
+    "combine_hsv": {"h": 0.0, "s": 0.0, "v": 0.0},
+    "combine_rgb": {"r": 0.0, "g": 0.0, "b": 0.0},
+    "combine_xyz": {"x": 0.0, "y": 0.0, "z": 0.0},
+    "map_range": {"value": 1.0, "from_min": 0.0, "from_max": 1.0, "to_min": 0.0, "to_max": 1.0, "steps": 4.0, "clamp": 1},
+    "math": {"value1": 0.5, "value2": 0.5, "value3": 0.5, "use_clamp": 0},
+    "rgb_to_bw": {"color": (0.5, 0.5, 0.5, 1.0)},
+    "separate_hsv": {"color": (0.8, 0.8, 0.8, 1.0)},
+    "separate_rgb": {"image": (0.8, 0.8, 0.8, 1.0)},
+    "separate_xyz": {"vector": (0.0, 0.0, 0.0)},
+    "vector_math": {"vector1": (0.0, 0.0, 0.0), "vector2": (0.0, 0.0, 0.0), "vector3": (0.0, 0.0, 0.0), "scale": 1.0},
+    "wavelength": {"wavelength": 500.0},
+    # Input
+    "ambient_occlusion": {"color": (1.0, 1.0, 1.0, 1.0), "distance": 1.0, "samples": 16, "inside": 0, "only_local": 0},
+    "bevel": {"radius": 0.05, "samples": 4},
+    "fresnel": {"IOR": 1.45},
+    "layer_weight": {"blend": 0.5},
+    "rgb": {"value": (0.5, 0.5, 0.5, 1.0)},
+    "value": {"value": 0.5},
+    "wireframe": {"size": 0.01, "use_pixel_size": 0},
+    # Shader
+    "anisotropic_bsdf": {"color": (0.8, 0.8, 0.8, 1.0), "roughness": 0.5, "anisotropy": 0.5, "rotation": 0.0},
+    "diffuse_bsdf": {"color": (0.8, 0.8, 0.8, 1.0), "roughness": 0.0},
+    "emission": {"color": (1.0, 1.0, 1.0, 1.0), "strength": 1.0},
+    "glass_bsdf": {"color": (1.0, 1.0, 1.0, 1.0), "roughness": 0.0, "IOR": 1.45},
+    "glossy_bsdf": {"color": (0.8, 0.8, 0.8, 1.0), "roughness": 0.5},
+    "hair_bsdf": {"color": (0.8, 0.8, 0.8, 1.0), "offset": 0.0, "roughness_u": 0.1, "roughness_v": 1.0},
+    "mix_shader": {"fac": 0.5},
+    "principled_bsdf": {
+        "base_color": (0.8, 0.8, 0.8, 1.0),
+        "subsurface": 0.0,
+        "subsurface_radius": (1.0, 0.2, 0.1),
+        "subsurface_color": (0.8, 0.8, 0.8, 1.0),
+        "metallic": 0.0,
+        "specular": 0.5,
+        "specular_tint": 0.0,
+        "roughness": 0.5,
+        "anisotropic": 0.0,
+        "anisotropic_rotation": 0.0,
+        "sheen": 0.0,
+        "sheen_tint": 0.5,
+        "clearcoat": 0.0,
+        "clearcoat_roughness": 0.03,
+        "ior": 1.45,
+        "transmission": 0.0,
+        "emission": (0.0, 0.0, 0.0, 1.0),
+        "emission_strength": 1.0,
+        "alpha": 1.0,
+    },
+    "principled_hair": {
+        "color": (0.017513, 0.005763, 0.002059, 1.0),
+        "melanin": 0.8,
+        "melanin_redness": 1.0,
+        "tint": (1.0, 1.0, 1.0, 1.0),
+        "absorption_coefficient": (0.245531, 0.52, 1.365),
+        "roughness": 0.3,
+        "radial_roughness": 0.3,
+        "coat": 0.0,
+        "ior": 1.55,
+        "random_roughness": 0.0,
+        "random_color": 0.0,
+        "random": 0.0,
+    },
+    "principled_volume": {
+        "color": (0.5, 0.5, 0.5, 1.0),
+        "density": 1.0,
+        "anisotropy": 0.0,
+        "absorption_color": (0.0, 0.0, 0.0, 1.0),
+        "emission_strength": 0.0,
+        "emission_color": (1.0, 1.0, 1.0, 1.0),
+        "blackbody_intensity": 0.0,
+        "blackbody_tint": (1.0, 1.0, 1.0, 1.0),
+        "temperature": 1000.0,
+    },
+    "refraction_bsdf": {"color": (1.0, 1.0, 1.0, 1.0), "roughness": 0.0, "IOR": 1.45},
+    "subsurface_scatter": {"color": (0.8, 0.8, 0.8, 1.0), "scale": 1.0, "radius": (1.0, 1.0, 1.0), "texture_blur": 0.0},
+    "toon_bsdf": {"color": (0.8, 0.8, 0.8, 1.0), "size": 0.5, "smooth": 0.0},
+    "translucent_bsdf": {"color": (0.8, 0.8, 0.8, 1.0)},
+    "transparent_bsdf": {"color": (1.0, 1.0, 1.0, 1.0)},
+    "velvet_bsdf": {"color": (0.8, 0.8, 0.8, 1.0), "sigma": 1.0},
+    "vol_absorb": {"color": (0.8, 0.8, 0.8, 1.0), "density": 1.0},
+    "vol_scatter": {"color": (0.8, 0.8, 0.8, 1.0), "density": 1.0, "anisotropy": 0.0},
+    # Texture
+    "brick_tex": {
+        "color1": (0.8, 0.8, 0.8, 1.0),
+        "color2": (0.2, 0.2, 0.2, 1.0),
+        "mortar": (0.0, 0.0, 0.0, 1.0),
+        "scale": 5.0,
+        "mortar_size": 0.02,
+        "mortar_smooth": 0.1,
+        "bias": 0.0,
+        "brick_width": 0.5,
+        "row_height": 0.25,
+        "offset": 0.5,
+        "offset_frequency": 2,
+        "squash": 1.0,
+        "squash_frequency": 2,
+    },
+    "checker_tex": {"color1": (0.8, 0.8, 0.8, 1.0), "color2": (0.2, 0.2, 0.2, 1.0), "scale": 5.0},
+    "magic_tex": {"scale": 5.0, "distortion": 1.0, "depth": 2},
+    "musgrave_tex": {"w": 0.0, "scale": 5.0, "detail": 2.0, "lacunarity": 2.0, "offset": 0.0, "gain": 1.0},
+    "noise_tex": {"w": 0.0, "scale": 5.0, "detail": 2.0, "roughness": 0.5, "distortion": 0.0},
+    "voronoi_tex": {"w": 0.0, "scale": 5.0, "smoothness": 1.0, "exponent": 0.5, "randomness": 1.0},
+    "wave_tex": {"scale": 5.0, "distortion": 0.0, "detail": 2.0, "detail_scale": 1.0, "detail_roughness": 0.5, "phase": 0.0},
+    # Vector
+    "bump": {"strength": 1.0, "distance": 1.0, "invert": 0},
+    "displacement": {"height": 0.0, "midlevel": 0.5, "scale": 1.0},
+    "mapping": {"vector": (0.0, 0.0, 0.0), "location": (0.0, 0.0, 0.0), "rotation": (0.0, 0.0, 0.0), "scale": (1.0, 1.0, 1.0)},
+    "normal_map": {"strength": 1.0, "color": (0.5, 0.5, 1.0, 1.0)},
+    "vector_transform": {"vector": (0.5, 0.5, 0.5)},
+}
@@ -0,0 +1,512 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Live updates over a localhost TCP connection, used by the watch mode of io_cyclesmax_shader.py.
+# The first message for a material carries the whole .shader text, later messages only the nodes,
+# parameters and links that changed since the last message to that client. This module does not use bpy.
+#
+# Every message is a 4-byte big-endian length followed by that many bytes of UTF-8 JSON.
+# Server to client:
+#   {"type": "graph", "seq": 1, "material": "Name", "shader": "cycles_shader|1|section_nodes|..."}
+#   {"type": "delta", "seq": 2, "material": "Name", "header": [...], "nodes_removed": [...], "nodes_added": [...],
+#     "order": [...], "nodes_changed": {...}, "links_removed": [...], "links_added": [...]}
+# Client to server:
+#   {"type": "ack", "seq": 2}                after applying a message
+#   {"type": "resync", "material": "Name"}   to be sent the whole graph again
+#
+# Deltas are applied in the order of the keys above. The header is the version and then every header field
+# name and value, it is only sent when it changed and replaces the old one. Added nodes are [type, name, x, y, {parameter: value}],
+# changed nodes map a node name to {"position": [x, y], "set": {parameter: value}, "unset": [parameter]}
+# and links are [source node, source socket, destination node, destination socket]. Values are the
+# text the .shader format uses for them, so a client can reuse its .shader parser. Sparse exports leave
+# out parameters at their default, so there an unset parameter goes back to its default. Added nodes go
+# after the others, when that is not where they belong the order is the name of every node in file order.
+# Topologically ordered exports refer to nodes by their index in that order in links, so a client has to
+# keep it and inserting a node changes many links.
+#
+# Run this module as a stand-in client that applies every update and prints its size:
+#
+#   python cyclesmax_live.py --port 5858
+
+import argparse
+import gc
+import json
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+import cyclesmax_reader
+
+DEFAULT_PORT = 5858
+LENGTH_STRUCT = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 1 << 30
+# A client that has not taken a message within this many seconds is dropped, so it can not stall the others
+SEND_TIMEOUT = 2.0
+
+def encode_message(message):
+    data = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    return LENGTH_STRUCT.pack(len(data)) + data
+
+def set_send_timeout(connection, seconds):
+    # Only for sends, settimeout() would also time out the reader thread waiting for the next message
+    if sys.platform == "win32":
+        value = struct.pack("I", int(seconds * 1000.0))
+    else:
+        value = struct.pack("ll", int(seconds), int((seconds - int(seconds)) * 1000000.0))
+    connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, value)
+
+def receive_exact(connection, size):
+    # Returns None if the connection closes first
+    chunks = list()
+    remaining = size
+    while remaining > 0:
+        chunk = connection.recv(min(remaining, 1 << 16))
+        if len(chunk) == 0:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+def receive_message(connection):
+    # Returns (message, size in bytes) or None once the other side has closed the connection
+    header = receive_exact(connection, LENGTH_STRUCT.size)
+    if header is None:
+        return None
+    (size,) = LENGTH_STRUCT.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise cyclesmax_reader.ShaderFormatError("Message of {0} bytes is too large".format(size))
+    data = receive_exact(connection, size)
+    if data is None:
+        return None
+    return (json.loads(data.decode("utf-8")), LENGTH_STRUCT.size + size)
+
+class GraphSnapshot:
+    # Nodes and links of a .shader graph, with every value kept as the text it is written as
+    def __init__(self):
+        # Node name -> [node type, x, y, {parameter name: value}]
+        self.nodes = dict()
+        self.version = "1"
+        self.header_fields = dict()
+        # (source node, source socket, destination node, destination socket)
+        self.links = set()
+
+    def to_shader_string(self):
+        tokens = self.get_header_tokens()
+        tokens.append("section_nodes")
+        for name, (node_type, x, y, parameters) in self.nodes.items():
+            tokens.extend((node_type, name, x, y))
+            for parameter_name, value in parameters.items():
+                tokens.append(parameter_name)
+                tokens.append(value)
+            tokens.append("node_end")
+        tokens.append("section_connections")
+        for this_link in sorted(self.links):
+            tokens.extend(this_link)
+        tokens.append("")
+        return cyclesmax_reader.SEPARATOR.join(tokens)
+
+    def get_header_tokens(self):
+        tokens = [cyclesmax_reader.MAGIC]
+        tokens.extend(self.get_header())
+        return tokens
+
+    def get_header(self):
+        header = [self.version]
+        for name, value in self.header_fields.items():
+            header.append(name)
+            header.append(value)
+        return header
+
+    def set_header(self, header):
+        self.version = header[0]
+        self.header_fields = dict(zip(header[1::2], header[2::2]))
+
+def split_shader_string(shader_string):
+    # Values are kept as text, only the structure is checked
+    tokens = cyclesmax_reader.split_string(shader_string)
+    snapshot = GraphSnapshot()
+    snapshot.version, snapshot.header_fields = cyclesmax_reader.read_header_fields(iter(tokens))
+    index = 3 + 2 * len(snapshot.header_fields)
+    # Same as in cyclesmax_reader.build_graph, none of this forms reference cycles
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while tokens[index] != "section_connections":
+            end_index = tokens.index("node_end", index + 4)
+            parameter_tokens = tokens[index + 4:end_index]
+            if len(parameter_tokens) % 2 != 0:
+                raise cyclesmax_reader.ShaderFormatError("Parameter without a value in node '{0}'".format(tokens[index + 1]))
+            snapshot.nodes[tokens[index + 1]] = [tokens[index], tokens[index + 2], tokens[index + 3], dict(zip(parameter_tokens[0::2], parameter_tokens[1::2]))]
+            index = end_index + 1
+    except (IndexError, ValueError):
+        raise cyclesmax_reader.ShaderFormatError("Unexpected end of file, expected section_connections")
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    link_tokens = tokens[index + 1:]
+    if len(link_tokens) % 4 != 0:
+        raise cyclesmax_reader.ShaderFormatError("Unexpected end of file, expected destination socket")
+    snapshot.links.update(zip(link_tokens[0::4], link_tokens[1::4], link_tokens[2::4], link_tokens[3::4]))
+    return snapshot
+
+def get_delta(old_snapshot, new_snapshot):
+    # Returns the delta message fields that turn old_snapshot into new_snapshot, empty if they are the same
+    output = dict()
+    header = new_snapshot.get_header()
+    if header != old_snapshot.get_header():
+        output["header"] = header
+    nodes_removed = [x for x in old_snapshot.nodes if x not in new_snapshot.nodes]
+    nodes_added = list()
+    nodes_changed = dict()
+    for name, (node_type, x, y, parameters) in new_snapshot.nodes.items():
+        old_node = old_snapshot.nodes.get(name)
+        if old_node == [node_type, x, y, parameters]:
+            continue
+        if old_node is None or old_node[0] != node_type:
+            if old_node is not None:
+                nodes_removed.append(name)
+            nodes_added.append([node_type, name, x, y, parameters])
+            continue
+        change = dict()
+        if old_node[1] != x or old_node[2] != y:
+            change["position"] = [x, y]
+        old_parameters = old_node[3]
+        set_parameters = {key: value for key, value in parameters.items() if old_parameters.get(key) != value}
+        if len(set_parameters) > 0:
+            change["set"] = set_parameters
+        unset_parameters = [key for key in old_parameters if key not in parameters]
+        if len(unset_parameters) > 0:
+            change["unset"] = unset_parameters
+        if len(change) > 0:
+            nodes_changed[name] = change
+    if len(nodes_removed) > 0:
+        output["nodes_removed"] = nodes_removed
+    if len(nodes_added) > 0:
+        output["nodes_added"] = nodes_added
+    # The order apply_delta leaves the nodes in without being told
+    removed_names = set(nodes_removed)
+    applied_order = [x for x in old_snapshot.nodes if x not in removed_names]
+    applied_order.extend(x[1] for x in nodes_added)
+    order = list(new_snapshot.nodes)
+    if order != applied_order:
+        output["order"] = order
+    if len(nodes_changed) > 0:
+        output["nodes_changed"] = nodes_changed
+    links_removed = old_snapshot.links - new_snapshot.links
+    if len(links_removed) > 0:
+        output["links_removed"] = sorted(links_removed)
+    links_added = new_snapshot.links - old_snapshot.links
+    if len(links_added) > 0:
+        output["links_added"] = sorted(links_added)
+    return output
+
+def apply_delta(snapshot, delta):
+    if "header" in delta:
+        snapshot.set_header(delta["header"])
+    for name in delta.get("nodes_removed", ()):
+        del snapshot.nodes[name]
+    for node_type, name, x, y, parameters in delta.get("nodes_added", ()):
+        snapshot.nodes[name] = [node_type, x, y, dict(parameters)]
+    if "order" in delta:
+        snapshot.nodes = {name: snapshot.nodes[name] for name in delta["order"]}
+    for name, change in delta.get("nodes_changed", dict()).items():
+        node = snapshot.nodes[name]
+        if "position" in change:
+            node[1], node[2] = change["position"]
+        node[3].update(change.get("set", dict()))
+        for parameter_name in change.get("unset", ()):
+            del node[3][parameter_name]
+    for this_link in delta.get("links_removed", ()):
+        snapshot.links.discard(tuple(this_link))
+    for this_link in delta.get("links_added", ()):
+        snapshot.links.add(tuple(this_link))
+
+class LiveConnection:
+    # Server side of one client, snapshots are what this client was last sent for each material
+    def __init__(self, connection, address):
+        self.connection = connection
+        self.address = address
+        self.snapshots = dict()
+        self.reader_thread = None
+
+class LiveServer:
+    # Streams pushed graphs to every connected client. push() only queues the graph, a sender thread
+    # computes the deltas and does all socket writes, so a slow client never blocks the caller.
+    # Pushes that queue up for the same material are collapsed into the latest one.
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(4)
+        self.port = self.listener.getsockname()[1]
+        self.connections = list()
+        # Material name -> the last pushed shader string, sent whole to clients that connect later
+        self.latest = dict()
+        self.events = queue.Queue()
+        self.lock = threading.Condition()
+        self.next_seq = 1
+        self.pending_pushes = 0
+        # Message seq -> (time sent, connection), until the client acknowledges it
+        self.sent_times = dict()
+        self.graph_count = 0
+        self.delta_count = 0
+        self.graph_bytes = 0
+        self.delta_bytes = 0
+        self.latencies = list()
+        self.accept_thread = threading.Thread(target=self.accept_loop, name="cyclesmax_live accept", daemon=True)
+        self.sender_thread = threading.Thread(target=self.send_loop, name="cyclesmax_live sender", daemon=True)
+        self.accept_thread.start()
+        self.sender_thread.start()
+
+    def push(self, material_name, shader_string):
+        with self.lock:
+            self.pending_pushes += 1
+        self.events.put(("push", material_name, shader_string))
+
+    def accept_loop(self):
+        while True:
+            try:
+                connection, address = self.listener.accept()
+            except OSError:
+                # The listener was closed
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            set_send_timeout(connection, SEND_TIMEOUT)
+            live_connection = LiveConnection(connection, address)
+            live_connection.reader_thread = threading.Thread(target=self.read_loop, args=(live_connection,), name="cyclesmax_live reader", daemon=True)
+            live_connection.reader_thread.start()
+            self.events.put(("connect", live_connection))
+
+    def read_loop(self, live_connection):
+        while True:
+            try:
+                received = receive_message(live_connection.connection)
+            except (OSError, ValueError, cyclesmax_reader.ShaderFormatError):
+                received = None
+            if received is None:
+                self.events.put(("disconnect", live_connection))
+                return
+            message = received[0]
+            if message.get("type") == "ack":
+                with self.lock:
+                    sent = self.sent_times.pop(message.get("seq"), None)
+                    if sent is not None:
+                        self.latencies.append(time.perf_counter() - sent[0])
+                    self.lock.notify_all()
+            elif message.get("type") == "resync":
+                self.events.put(("resync", live_connection, message.get("material")))
+
+    def send_loop(self):
+        while True:
+            events = [self.events.get()]
+            # Collapse everything that is already waiting, a burst of pushes for one material only sends the last
+            while True:
+                try:
+                    events.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+            pushed = dict()
+            is_closing = None in events
+            if is_closing:
+                # Pushes queued before close() are still sent, nothing after it is
+                events = events[:events.index(None)]
+            for this_event in events:
+                if this_event[0] == "push":
+                    pushed[this_event[1]] = this_event[2]
+                elif this_event[0] == "connect":
+                    self.connections.append(this_event[1])
+                    for material_name, shader_string in self.latest.items():
+                        self.send_update(this_event[1], material_name, shader_string, split_shader_string(shader_string))
+                elif this_event[0] == "disconnect":
+                    self.drop_connection(this_event[1])
+                elif this_event[0] == "resync":
+                    live_connection = this_event[1]
+                    live_connection.snapshots.pop(this_event[2], None)
+                    if this_event[2] in self.latest:
+                        self.send_update(live_connection, this_event[2], self.latest[this_event[2]], split_shader_string(self.latest[this_event[2]]))
+            for material_name, shader_string in pushed.items():
+                self.latest[material_name] = shader_string
+                snapshot = split_shader_string(shader_string)
+                for this_connection in list(self.connections):
+                    self.send_update(this_connection, material_name, shader_string, snapshot)
+            with self.lock:
+                self.pending_pushes -= sum(1 for x in events if x[0] == "push")
+                self.lock.notify_all()
+            if is_closing:
+                return
+
+    def send_update(self, live_connection, material_name, shader_string, snapshot):
+        old_snapshot = live_connection.snapshots.get(material_name)
+        if old_snapshot is None:
+            message = {"type": "graph", "material": material_name, "shader": shader_string}
+        else:
+            message = get_delta(old_snapshot, snapshot)
+            if len(message) == 0:
+                return
+            message["type"] = "delta"
+            message["material"] = material_name
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            message["seq"] = seq
+            data = encode_message(message)
+            self.sent_times[seq] = (time.perf_counter(), live_connection)
+            if old_snapshot is None:
+                self.graph_count += 1
+                self.graph_bytes += len(data)
+            else:
+                self.delta_count += 1
+                self.delta_bytes += len(data)
+        try:
+            live_connection.connection.sendall(data)
+        except OSError:
+            # Also when the send timed out, the client would be sent the rest of a message it may not read
+            self.drop_connection(live_connection)
+            return
+        live_connection.snapshots[material_name] = snapshot
+
+    def drop_connection(self, live_connection):
+        # Under the lock, close() drops the connections while a sender thread that did not stop in time may still be at it
+        with self.lock:
+            if live_connection in self.connections:
+                self.connections.remove(live_connection)
+            for seq in [x for x, (_, connection) in self.sent_times.items() if connection is live_connection]:
+                del self.sent_times[seq]
+            self.lock.notify_all()
+        try:
+            # Wakes a send or receive that is blocked on it, closing alone does not
+            live_connection.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        live_connection.connection.close()
+
+    def wait_until_acknowledged(self, timeout=5.0):
+        # Waits until everything pushed so far has been sent and every client acknowledged it, for measurements
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while self.pending_pushes > 0 or len(self.sent_times) > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0.0:
+                    return False
+                self.lock.wait(min(remaining, 0.05))
+        return True
+
+    def get_summary_line(self):
+        line = "Streamed {0} full graphs ({1} bytes) and {2} updates ({3} bytes".format(self.graph_count, self.graph_bytes, self.delta_count, self.delta_bytes)
+        if self.delta_count > 0:
+            line += ", {0:.0f} bytes per update".format(self.delta_bytes / self.delta_count)
+        line += ")"
+        if len(self.latencies) > 0:
+            latencies = sorted(self.latencies)
+            line += ", median round trip {0:.2f} ms".format(1000.0 * latencies[len(latencies) // 2])
+        return line
+
+    def close(self):
+        self.events.put(None)
+        # Closing alone does not wake a thread blocked in accept() on Linux
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.listener.close()
+        # close() runs on Blender's main thread, every send gives up after SEND_TIMEOUT so this does not wait long
+        self.sender_thread.join(2.0 * SEND_TIMEOUT)
+        self.accept_thread.join(SEND_TIMEOUT)
+        for this_connection in list(self.connections):
+            self.drop_connection(this_connection)
+
+class LiveClient:
+    # Stand-in for the Cycles for Max side, keeps a snapshot per material up to date and acknowledges every message
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=None):
+        self.connection = socket.create_connection((host, port), timeout=timeout)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.snapshots = dict()
+        self.message_count = 0
+        self.received_bytes = 0
+
+    def receive(self):
+        # Applies the next message and returns (message, size in bytes), or None once the server has closed the connection
+        received = receive_message(self.connection)
+        if received is None:
+            return None
+        message, size = received
+        material_name = message["material"]
+        if message["type"] == "graph":
+            self.snapshots[material_name] = split_shader_string(message["shader"])
+        elif message["type"] == "delta":
+            if material_name not in self.snapshots:
+                self.request_resync(material_name)
+                return received
+            apply_delta(self.snapshots[material_name], message)
+        self.message_count += 1
+        self.received_bytes += size
+        self.connection.sendall(encode_message({"type": "ack", "seq": message["seq"]}))
+        return received
+
+    def request_resync(self, material_name):
+        self.connection.sendall(encode_message({"type": "resync", "material": material_name}))
+
+    def close(self):
+        self.connection.close()
+
+def describe_message(message):
+    if message["type"] == "graph":
+        snapshot = split_shader_string(message["shader"])
+        return "{0} nodes and {1} links".format(len(snapshot.nodes), len(snapshot.links))
+    parts = list()
+    if "header" in message:
+        parts.append("new header")
+    if "order" in message:
+        parts.append("new order")
+    for key in ("nodes_removed", "nodes_added", "nodes_changed", "links_removed", "links_added"):
+        if key in message:
+            parts.append("{0} {1}".format(len(message[key]), key.replace("_", " ")))
+    return ", ".join(parts)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in client for the live updates of the Cycles for Max shader exporter.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+
+    try:
+        client = LiveClient(args.host, args.port)
+    except OSError as error:
+        print("Could not connect to {0}:{1}: {2}".format(args.host, args.port, error))
+        return 1
+    try:
+        while True:
+            start_time = time.perf_counter()
+            received = client.receive()
+            if received is None:
+                break
+            message, size = received
+            print("{0} '{1}' #{2}: {3} bytes, {4}, applied in {5:.2f} ms".format(
+                message["type"], message["material"], message["seq"], size, describe_message(message), 1000.0 * (time.perf_counter() - start_time)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+    print("Received {0} messages, {1} bytes".format(client.message_count, client.received_bytes))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Reader for the .shader files written by io_cyclesmax_shader.py
+# This module does not use bpy, so it can be used by tools running outside of Blender. It needs
+# cyclesmax_defaults.py next to it to fill in the values sparse files leave out.
+#
+#   python cyclesmax_reader.py file.shader [file.shader ...]
+
+import gc
+import sys
+
+from cyclesmax_defaults import DEFAULT_VALUES, DEFAULTS_VERSION
+
+SEPARATOR = "|"
+MAGIC = "cycles_shader"
+# Version 2 adds name|value header fields between the version and section_nodes
+SUPPORTED_VERSIONS = ("1", "2")
+# defaults: the version of DEFAULT_VALUES the file leaves out
+# order: topological when every node comes after the nodes linked into it, connections then refer to
+#   nodes by their index in the file instead of their name
+# nodes, connections, strings: how many of each the file holds, strings counts everything after section_nodes
+# Each of these changes how the rest of the file is read, so unknown fields are an error
+HEADER_FIELDS = frozenset(["defaults", "order", "nodes", "connections", "strings"])
+COUNT_HEADER_FIELDS = ("nodes", "connections", "strings")
+
+NON_FINITE_FLOATS = frozenset(["nan", "inf", "-inf"])
+
+# Vector values are written with three components whether they came from a float3 or a float4.
+# Parameters in DEFAULT_VALUES go by the length of their default, these names decide for the rest.
+FLOAT4_NAMES = frozenset([
+    "absorption_color",
+    "base_color",
+    "blackbody_tint",
+    "color",
+    "color1",
+    "color2",
+    "emission",
+    "emission_color",
+    "image",
+    "mortar",
+    "subsurface_color",
+    "tint",
+    "value",
+])
+# Node types missing from DEFAULT_VALUES
+EMPTY_DEFAULTS = dict()
+
+class ShaderFormatError(Exception):
+    pass
+
+class ShaderNodeRecord:
+    def __init__(self):
+        self.node_type = ""
+        self.name = ""
+        self.position = (0.0, 0.0)
+        self.float_values = dict()
+        self.float3_values = dict()
+        self.float4_values = dict()
+        self.string_values = dict()
+        self.int_values = dict()
+
+    def to_dict(self):
+        output = dict()
+        output["node_type"] = self.node_type
+        output["name"] = self.name
+        output["position"] = self.position
+        output["float_values"] = self.float_values
+        output["float3_values"] = self.float3_values
+        output["float4_values"] = self.float4_values
+        output["string_values"] = self.string_values
+        output["int_values"] = self.int_values
+        return output
+
+class ShaderConnectionRecord:
+    def __init__(self, source_node, source_socket, dest_node, dest_socket):
+        self.source_node = source_node
+        self.source_socket = source_socket
+        self.dest_node = dest_node
+        self.dest_socket = dest_socket
+
+    def to_tuple(self):
+        return (self.source_node, self.source_socket, self.dest_node, self.dest_socket)
+
+class ShaderGraph:
+    def __init__(self):
+        self.version = ""
+        # Header fields of version 2 files, in file order
+        self.header_fields = dict()
+        self.nodes = list()
+        self.connections = list()
+
+    def get_nodes_by_name(self):
+        output = dict()
+        for this_node in self.nodes:
+            output[this_node.name] = this_node
+        return output
+
+def add_value(record, name, value):
+    # Floats are always written with a decimal point and ints never are, so the cheap
+    # conversions below are enough to tell the types apart without regular expressions
+    try:
+        if "," in value:
+            components = value.split(",")
+            if len(components) != 3:
+                record.string_values[name] = value
+                return
+            vector = (float(components[0]), float(components[1]), float(components[2]))
+            default = DEFAULT_VALUES.get(record.node_type, EMPTY_DEFAULTS).get(name)
+            if isinstance(default, tuple):
+                is_float4 = len(default) == 4
+            else:
+                is_float4 = name in FLOAT4_NAMES
+            if is_float4:
+                # The alpha component is not written to the file, so it is filled in as 1.0
+                record.float4_values[name] = vector + (1.0,)
+            else:
+                record.float3_values[name] = vector
+        elif "." in value or value in NON_FINITE_FLOATS:
+            record.float_values[name] = float(value)
+        else:
+            record.int_values[name] = int(value)
+    except ValueError:
+        record.string_values[name] = value
+
+def next_token(tokens, expected):
+    token = next(tokens, None)
+    if token is None:
+        raise ShaderFormatError("Unexpected end of file, expected " + expected)
+    return token
+
+def read_header_fields(tokens):
+    # Returns the version and a dict of the header fields
+    magic = next_token(tokens, "header")
+    if magic != MAGIC:
+        raise ShaderFormatError("Not a .shader file, found '{0}' instead of '{1}'".format(magic[:32], MAGIC))
+    version = next_token(tokens, "version")
+    if version not in SUPPORTED_VERSIONS:
+        raise ShaderFormatError("Unsupported .shader version '{0}'".format(version))
+    fields = dict()
+    while True:
+        section = next_token(tokens, "section_nodes")
+        if section == "section_nodes":
+            break
+        if version == "1" or section in fields:
+            raise ShaderFormatError("Expected section_nodes, found '{0}'".format(section))
+        if section not in HEADER_FIELDS:
+            raise ShaderFormatError("Unsupported header field '{0}'".format(section[:32]))
+        fields[section] = next_token(tokens, "header field value")
+    if fields.get("order", "topological") != "topological":
+        raise ShaderFormatError("Unsupported node order '{0}'".format(fields["order"]))
+    return (version, fields)
+
+def get_header_count(header_fields, name):
+    # Returns the declared count, None if the file does not declare it
+    if name not in header_fields:
+        return None
+    try:
+        return int(header_fields[name])
+    except ValueError:
+        raise ShaderFormatError("Invalid {0} count '{1}'".format(name, header_fields[name]))
+
+def check_header_count(header_fields, name, count):
+    expected_count = get_header_count(header_fields, name)
+    if expected_count is not None and expected_count != count:
+        raise ShaderFormatError("Header declares {0} {1}, found {2}".format(expected_count, name, count))
+
+def read_header(tokens):
+    return read_header_fields(tokens)[0]
+
+def get_default_values(header_fields):
+    # Returns the table of values left out of a sparse file, None if the file is not sparse
+    defaults_version = header_fields.get("defaults")
+    if defaults_version is None:
+        return None
+    if defaults_version != DEFAULTS_VERSION:
+        raise ShaderFormatError("Unsupported defaults table '{0}'".format(defaults_version))
+    return DEFAULT_VALUES
+
+def fill_default_values(record, default_values):
+    # Adds every default of the record's node type that the file left out
+    for name, value in default_values.get(record.node_type, dict()).items():
+        if isinstance(value, tuple):
+            values = record.float4_values if len(value) == 4 else record.float3_values
+        elif isinstance(value, float):
+            values = record.float_values
+        else:
+            values = record.int_values
+        if name not in values:
+            values[name] = value
+
+def get_node_name(node_names, token):
+    try:
+        return node_names[int(token)]
+    except (ValueError, IndexError):
+        raise ShaderFormatError("Connection to unknown node index '{0}'".format(token[:32]))
+
+def iter_records(tokens, header_fields=None):
+    # Yields a ShaderNodeRecord for each node, then a ShaderConnectionRecord for each connection
+    # The header must already have been consumed with read_header_fields, header_fields is what it returned
+    if header_fields is None:
+        header_fields = dict()
+    default_values = get_default_values(header_fields)
+    # Node names by index, connections of topologically ordered files refer to nodes by index
+    node_names = list() if header_fields.get("order") == "topological" else None
+    node_count = 0
+    for token in tokens:
+        if token == "section_connections":
+            break
+        record = ShaderNodeRecord()
+        record.node_type = token
+        record.name = next_token(tokens, "node name")
+        try:
+            record.position = (float(next_token(tokens, "node position")), float(next_token(tokens, "node position")))
+        except ValueError:
+            raise ShaderFormatError("Invalid position for node '{0}'".format(record.name))
+        while True:
+            name = next_token(tokens, "node_end")
+            if name == "node_end":
+                break
+            add_value(record, name, next_token(tokens, "parameter value"))
+        if default_values is not None:
+            fill_default_values(record, default_values)
+        if node_names is not None:
+            node_names.append(record.name)
+        node_count += 1
+        yield record
+    else:
+        raise ShaderFormatError("Unexpected end of file, expected section_connections")
+    check_header_count(header_fields, "nodes", node_count)
+
+    connection_count = 0
+    for token in tokens:
+        record = ShaderConnectionRecord(token, next_token(tokens, "source socket"), next_token(tokens, "destination node"), next_token(tokens, "destination socket"))
+        if node_names is not None:
+            record.source_node = get_node_name(node_names, record.source_node)
+            record.dest_node = get_node_name(node_names, record.dest_node)
+        connection_count += 1
+        yield record
+    check_header_count(header_fields, "connections", connection_count)
+
+def split_string(shader_string):
+    if not shader_string.endswith(SEPARATOR):
+        raise ShaderFormatError("File is truncated, it does not end with '{0}'".format(SEPARATOR))
+    tokens = shader_string.split(SEPARATOR)
+    tokens.pop()
+    return tokens
+
+def iter_file_tokens(input_file, chunk_size=1 << 16):
+    remainder = ""
+    while True:
+        chunk = input_file.read(chunk_size)
+        if len(chunk) == 0:
+            break
+        tokens = (remainder + chunk).split(SEPARATOR)
+        remainder = tokens.pop()
+        yield from tokens
+    if len(remainder) > 0:
+        raise ShaderFormatError("File is truncated, it does not end with '{0}'".format(SEPARATOR))
+
+def build_graph(tokens):
+    graph = ShaderGraph()
+    token_count = len(tokens)
+    tokens = iter(tokens)
+    graph.version, graph.header_fields = read_header_fields(tokens)
+    check_header_count(graph.header_fields, "strings", token_count - 3 - 2 * len(graph.header_fields))
+    # None of the records form reference cycles, so pausing the cyclic collector while
+    # hundreds of thousands of them are created saves a lot of pointless collections
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for this_record in iter_records(tokens, graph.header_fields):
+            if isinstance(this_record, ShaderNodeRecord):
+                graph.nodes.append(this_record)
+            else:
+                graph.connections.append(this_record)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return graph
+
+def parse_shader_string(shader_string):
+    return build_graph(split_string(shader_string))
+
+def read_shader(filepath):
+    with open(filepath, "r") as input_file:
+        return parse_shader_string(input_file.read())
+
+def iter_shader_records(filepath, chunk_size=1 << 16):
+    # Lazy mode, only one chunk of the file and one record are held in memory at a time
+    with open(filepath, "r") as input_file:
+        tokens = iter_file_tokens(input_file, chunk_size)
+        version, header_fields = read_header_fields(tokens)
+        yield from iter_records(tokens, header_fields)
+
+def validate_graph(graph):
+    problems = list()
+    node_names = set()
+    for this_node in graph.nodes:
+        if this_node.name in node_names:
+            problems.append("Duplicate node name '{0}'".format(this_node.name))
+        node_names.add(this_node.name)
+    for this_connection in graph.connections:
+        if this_connection.source_node not in node_names:
+            problems.append("Connection from unknown node '{0}'".format(this_connection.source_node))
+        if this_connection.dest_node not in node_names:
+            problems.append("Connection to unknown node '{0}'".format(this_connection.dest_node))
+    if graph.header_fields.get("order") == "topological":
+        index_by_name = dict((x.name, index) for index, x in enumerate(graph.nodes))
+        for this_connection in graph.connections:
+            if index_by_name.get(this_connection.source_node, -1) >= index_by_name.get(this_connection.dest_node, -1):
+                problems.append("Connection from '{0}' to '{1}' does not follow the node order".format(this_connection.source_node, this_connection.dest_node))
+    return problems
+
+def main(argv):
+    failed = False
+    for this_path in argv:
+        try:
+            graph = read_shader(this_path)
+        except (OSError, ShaderFormatError) as error:
+            print("{0}: {1}".format(this_path, error))
+            failed = True
+            continue
+        problems = validate_graph(graph)
+        print("{0}: {1} nodes, {2} connections".format(this_path, len(graph.nodes), len(graph.connections)))
+        for this_problem in problems:
+            print("  " + this_problem)
+        if len(problems) > 0:
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
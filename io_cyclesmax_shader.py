@@ -26,12 +26,32 @@ bl_info = {
     "category": "Import-Export",
 }
 
+import argparse
+import hashlib
+import json
+import math
+import os
+import stat
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from enum import Enum
+from functools import lru_cache
+from heapq import heapify, heappop, heappush
 from math import floor
+from types import MappingProxyType
 
-import bpy
-from bpy.props import StringProperty
-from bpy_extras.io_utils import ExportHelper
+try:
+    import bpy
+    from bpy.props import BoolProperty, EnumProperty, FloatProperty, IntProperty, StringProperty
+    from bpy_extras.io_utils import ExportHelper
+except ImportError:
+    # Tools can import this file without Blender to optimize and write graphs, see graph_from_shader_graph.
+    # Reading node trees, watch mode and the operators need bpy and are not available then.
+    bpy = None
 
 class NodeType(Enum):
     INVALID = "invalid"
@@ -193,10 +213,21 @@ def get_type_by_idname_dict():
     return output
 
 class MaxTexManager:
-    def __init__(self):
+    def __init__(self, texture_hasher=None):
         self.slots_by_filename = dict()
         self.next_unassigned_slot = 1
+        # Images behind each filename, described in TextureFile when a texture manifest is written
+        self.images_by_filename = dict()
+        self.texture_hasher = texture_hasher
+        self.textures_by_filename = dict()
     
+    def add_image(self, filename, image):
+        if filename is None or filename in self.images_by_filename:
+            return
+        self.images_by_filename[filename] = image
+        if self.texture_hasher is not None:
+            self.textures_by_filename[filename] = TextureFile(filename, image, self.texture_hasher)
+
     def get_empty_slot(self):
         return self.get_slot_from_filename("ThisIsABigUniqueStringThatIReallyHopeWontOverlapAnyRealFilePaths-IThinkMyOddsArePrettyGood")
 
@@ -208,39 +239,228 @@ class MaxTexManager:
             self.next_unassigned_slot += 1
             return self.slots_by_filename[filename]
 
+def get_file_hash(filepath):
+    hasher = hashlib.sha1()
+    with open(filepath, "rb") as input_file:
+        while True:
+            chunk = input_file.read(1024 * 1024)
+            if len(chunk) == 0:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def get_data_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+class TextureHasher:
+    # Hashes texture contents on a thread pool so reading large textures overlaps with the rest of the export.
+    # Hashes are kept by (path, mtime, size) for as long as the hasher lives, usually one export.
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.executor = None
+        self.futures = dict()
+
+    def submit(self, key, function, argument):
+        if key not in self.futures:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self.futures[key] = self.executor.submit(function, argument)
+        return key
+
+    def submit_file(self, filepath, file_stat):
+        return self.submit((filepath, file_stat.st_mtime_ns, file_stat.st_size), get_file_hash, filepath)
+
+    def submit_data(self, name, data):
+        return self.submit(("packed", name, len(data)), get_data_hash, data)
+
+    def get_hash(self, key):
+        # Returns None if the file could not be read
+        try:
+            return self.futures[key].result()
+        except OSError:
+            return None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+class TextureFile:
+    # What the texture manifest records about one image, the content hash is computed by a TextureHasher
+    def __init__(self, filepath, image, texture_hasher):
+        self.filepath = filepath
+        self.source = str(image.source)
+        self.colorspace = str(image.colorspace_settings.name)
+        self.packed = image.packed_file is not None
+        self.resolved_path = None
+        self.file_size = None
+        self.hash_key = None
+        self.texture_hasher = texture_hasher
+        if self.packed:
+            data = image.packed_file.data
+            self.file_size = len(data)
+            self.hash_key = texture_hasher.submit_data(filepath, data)
+            return
+        if filepath == "":
+            # Generated and unsaved images have no file, resolving "" would give the working directory
+            return
+        # Relative paths are relative to the .blend the image comes from, which may be a linked library
+        self.resolved_path = os.path.normcase(os.path.realpath(bpy.path.abspath(filepath, library=image.library)))
+        try:
+            file_stat = os.stat(self.resolved_path)
+        except OSError:
+            return
+        if not stat.S_ISREG(file_stat.st_mode):
+            # A directory or device is not the image, and could be shared by unrelated images
+            self.resolved_path = None
+            return
+        self.file_size = file_stat.st_size
+        self.hash_key = texture_hasher.submit_file(self.resolved_path, file_stat)
+
+    def get_hash(self):
+        if self.hash_key is None:
+            return None
+        return self.texture_hasher.get_hash(self.hash_key)
+
+    def get_identities(self):
+        # Images with any identity in common are the same texture
+        output = list()
+        if self.resolved_path is not None:
+            output.append(("path", self.resolved_path))
+        content_hash = self.get_hash()
+        if content_hash is not None:
+            output.append(("hash", content_hash))
+        if len(output) == 0:
+            output.append(("filename", self.filepath))
+        return output
+
+    def to_dict(self):
+        output = dict()
+        output["path"] = self.resolved_path
+        output["packed"] = self.packed
+        output["source"] = self.source
+        output["colorspace"] = self.colorspace
+        output["file_size"] = self.file_size
+        output["hash"] = self.get_hash()
+        return output
+
+def merge_texture_slots(graph, max_tex_manager):
+    # Gives images that resolve to the same file or have the same content a single slot and numbers
+    # the slots from 1 again. Returns the texture manifest entries in slot order.
+    slot_by_identity = dict()
+    new_slot_by_slot = dict()
+    entries = list()
+    for filename, slot in sorted(max_tex_manager.slots_by_filename.items(), key=lambda x: x[1]):
+        texture = max_tex_manager.textures_by_filename.get(filename)
+        if texture is None:
+            # Image nodes without an image each keep a slot of their own
+            identities = [("filename", filename)]
+        else:
+            identities = texture.get_identities()
+        new_slot = None
+        for this_identity in identities:
+            if this_identity in slot_by_identity:
+                new_slot = slot_by_identity[this_identity]
+                break
+        if new_slot is None:
+            new_slot = len(entries) + 1
+            entry = dict()
+            entry["slot"] = new_slot
+            entry["path"] = None
+            if texture is not None:
+                entry.update(texture.to_dict())
+            entry["filepaths"] = list()
+            entries.append(entry)
+        if texture is not None:
+            entries[new_slot - 1]["filepaths"].append(filename)
+        for this_identity in identities:
+            slot_by_identity.setdefault(this_identity, new_slot)
+        new_slot_by_slot[slot] = new_slot
+    for this_node in graph.nodes:
+        if this_node.node_type == NodeType.MAX_TEX:
+            this_node.int_values['slot'] = new_slot_by_slot[this_node.int_values['slot']]
+    graph.merged_texture_count = len(new_slot_by_slot) - len(entries)
+    return entries
+
 class CyclesNode:
+    # Exports can hold hundreds of thousands of these at once, slots leave out the per-instance __dict__
+    __slots__ = ("name", "node_type", "position", "float_values", "float3_values", "float4_values", "string_values", "int_values")
+
     def __init__(self):
+        self.name = "unnamed"
+        self.node_type = NodeType.INVALID
+        self.position = (0.0, 0.0)
         self.float_values = dict()
         self.float3_values = dict()
         self.float4_values = dict()
         self.string_values = dict()
         self.int_values = dict()
 
-    name = "unnamed"
-    node_type = NodeType.INVALID
-    position = (0.0, 0.0)
+# Shared by every node that has no values of a kind, read-only so a write to it fails instead of reaching every node
+EMPTY_VALUES = MappingProxyType(dict())
 
-def add_node_strings(string_list, cycles_node):
-    string_list.append(cycles_node.node_type.value)
-    string_list.append(cycles_node.name)
-    string_list.append(str(cycles_node.position[0]))
-    string_list.append(str(cycles_node.position[1]))
-    for name, value in cycles_node.float_values.items():
-        string_list.append(name)
-        string_list.append("{0:.4f}".format(value))
-    for name, value in cycles_node.float3_values.items():
-        string_list.append(name)
-        string_list.append("{0:.4f},{1:.4f},{2:.4f}".format(value[0], value[1], value[2]))
-    for name, value in cycles_node.float4_values.items():
-        string_list.append(name)
-        string_list.append("{0:.4f},{1:.4f},{2:.4f}".format(value[0], value[1], value[2]))
+def compact_cycles_node(cycles_node):
+    # Most nodes only use one or two of the value dicts, the empty ones are swapped for EMPTY_VALUES once the node is complete
+    if len(cycles_node.float_values) == 0:
+        cycles_node.float_values = EMPTY_VALUES
+    if len(cycles_node.float3_values) == 0:
+        cycles_node.float3_values = EMPTY_VALUES
+    if len(cycles_node.float4_values) == 0:
+        cycles_node.float4_values = EMPTY_VALUES
+    if len(cycles_node.string_values) == 0:
+        cycles_node.string_values = EMPTY_VALUES
+    if len(cycles_node.int_values) == 0:
+        cycles_node.int_values = EMPTY_VALUES
+
+def get_float_values_format(float_names, float3_names, float4_names):
+    parts = list()
+    for name in float_names:
+        parts.append(name.replace("%", "%%"))
+        parts.append("%.4f")
+    # Only the first three components of float4 values are written
+    for name in float3_names + float4_names:
+        parts.append(name.replace("%", "%%"))
+        parts.append("%.4f,%.4f,%.4f")
+    return "|".join(parts)
+
+# Format strings by the names of a node's float values, nodes of one type almost always share them
+FLOAT_VALUES_FORMATS = dict()
+
+def get_float_values_string(cycles_node):
+    # Formats all float values of a node with a single % operation, the result is already joined with |
+    # %.4f produces the same text as "{0:.4f}".format() for every float
+    float_names = tuple(cycles_node.float_values)
+    float3_names = tuple(cycles_node.float3_values)
+    float4_names = tuple(cycles_node.float4_values)
+    key = (float_names, float3_names, float4_names)
+    values_format = FLOAT_VALUES_FORMATS.get(key)
+    if values_format is None:
+        values_format = get_float_values_format(float_names, float3_names, float4_names)
+        FLOAT_VALUES_FORMATS[key] = values_format
+    values = list(cycles_node.float_values.values())
+    for value in cycles_node.float3_values.values():
+        values.extend(value[:3])
+    for value in cycles_node.float4_values.values():
+        values.extend(value[:3])
+    return values_format % tuple(values)
+
+def iter_node_strings(cycles_node):
+    yield cycles_node.node_type.value
+    yield cycles_node.name
+    yield str(cycles_node.position[0])
+    yield str(cycles_node.position[1])
+    if len(cycles_node.float_values) + len(cycles_node.float3_values) + len(cycles_node.float4_values) > 0:
+        yield get_float_values_string(cycles_node)
     for name, value in cycles_node.string_values.items():
-        string_list.append(name)
-        string_list.append(value)
+        yield name
+        yield value
     for name, value in cycles_node.int_values.items():
-        string_list.append(name)
-        string_list.append(str(value))
-    string_list.append("node_end")
+        yield name
+        yield str(value)
+    yield "node_end"
+
+def add_node_strings(string_list, cycles_node):
+    string_list.extend(iter_node_strings(cycles_node))
 
 def get_single_curve_string(curve):
     output_list = list()
@@ -256,16 +476,19 @@ def get_single_curve_string(curve):
             output_list.append('h')
     return ",".join(output_list)
 
-def get_rgb_curve_string(r_curve, g_curve, b_curve, c_curve):
+def join_rgb_curve_strings(c_string, r_string, g_string, b_string):
     output_list = list()
     output_list.append("curve_rgb_00")
     output_list.append("00")
-    output_list.append(get_single_curve_string(c_curve))
-    output_list.append(get_single_curve_string(r_curve))
-    output_list.append(get_single_curve_string(g_curve))
-    output_list.append(get_single_curve_string(b_curve))
+    output_list.append(c_string)
+    output_list.append(r_string)
+    output_list.append(g_string)
+    output_list.append(b_string)
     return "/".join(output_list)
 
+def get_rgb_curve_string(r_curve, g_curve, b_curve, c_curve):
+    return join_rgb_curve_strings(get_single_curve_string(c_curve), get_single_curve_string(r_curve), get_single_curve_string(g_curve), get_single_curve_string(b_curve))
+
 def get_ramp_string(ramp):
     output_list = list()
     output_list.append("ramp00")
@@ -277,586 +500,2893 @@ def get_ramp_string(ramp):
         output_list.append(str(this_element.alpha))
     return ",".join(output_list)
 
-def get_cycles_node(type_by_idname, name, node, max_tex_manager):
-    output = CyclesNode()
-    location = node.location
-    output.position = (floor(location[0]), -1.0 * floor(location[1]))
-    output.name = name
-    if node.bl_idname in type_by_idname:
-        output.node_type = type_by_idname[node.bl_idname]
-    elif node.bl_idname == "ShaderNodeTexImage":
-        # Special case here because we convert image textures to max textures
-        output.node_type = NodeType.MAX_TEX
-        if node.image is None or node.image.filepath is None:
-            output.int_values['slot'] = max_tex_manager.get_empty_slot()
+# How curves and color ramps are written, see CurveBaker
+CURVE_MODE_POINTS = "points"
+CURVE_MODE_LUT = "lut"
+CURVE_MODE_DECIMATE = "decimate"
+CURVE_MODES = (CURVE_MODE_POINTS, CURVE_MODE_LUT, CURVE_MODE_DECIMATE)
+# Baked curves and ramps are compared against this many evenly spaced samples of the original
+CURVE_REFERENCE_SAMPLE_COUNT = 256
+
+def get_sample_positions(count):
+    return [index / (count - 1) for index in range(count)]
+
+def format_baked_value(value):
+    return "{0:.6g}".format(value)
+
+def get_max_deviation(positions, samples, baked_positions, baked_samples):
+    # Largest difference between the reference samples and straight lines through the baked samples
+    max_deviation = 0.0
+    segment = 0
+    for position, sample in zip(positions, samples):
+        while segment < len(baked_positions) - 2 and baked_positions[segment + 1] < position:
+            segment += 1
+        start_position = baked_positions[segment]
+        end_position = baked_positions[segment + 1]
+        t = (position - start_position) / (end_position - start_position)
+        for channel in range(len(sample)):
+            start_value = baked_samples[segment][channel]
+            value = start_value + t * (baked_samples[segment + 1][channel] - start_value)
+            max_deviation = max(max_deviation, abs(sample[channel] - value))
+    return max_deviation
+
+def decimate_samples(positions, samples, tolerance):
+    # Douglas-Peucker with the error measured along the value axis, returns the indices of the samples to keep
+    keep = [False] * len(positions)
+    keep[0] = True
+    keep[-1] = True
+    ranges = [(0, len(positions) - 1)]
+    while len(ranges) > 0:
+        first, last = ranges.pop()
+        worst_index = None
+        worst_deviation = tolerance
+        for index in range(first + 1, last):
+            t = (positions[index] - positions[first]) / (positions[last] - positions[first])
+            for channel in range(len(samples[index])):
+                start_value = samples[first][channel]
+                deviation = abs(samples[index][channel] - (start_value + t * (samples[last][channel] - start_value)))
+                if deviation > worst_deviation:
+                    worst_index = index
+                    worst_deviation = deviation
+        if worst_index is not None:
+            keep[worst_index] = True
+            ranges.append((first, worst_index))
+            ranges.append((worst_index, last))
+    return [index for index in range(len(positions)) if keep[index]]
+
+class CurveBaker:
+    # Replaces the control points of curves and color ramps with straight segments through values sampled
+    # by Blender, either a fixed number of evenly spaced samples or as few samples as keep within the tolerance.
+    # Curves and ramps that already have fewer points than that are left as they are.
+    def __init__(self, mode, lut_size, tolerance):
+        self.mode = mode
+        self.lut_size = lut_size
+        self.tolerance = tolerance
+
+    def bake_samples(self, evaluate, point_count):
+        # Returns (positions, samples, max deviation) or None to keep the original points
+        if self.mode == CURVE_MODE_LUT and point_count <= self.lut_size:
+            return None
+        if point_count <= 2:
+            return None
+        positions = get_sample_positions(CURVE_REFERENCE_SAMPLE_COUNT)
+        samples = [evaluate(x) for x in positions]
+        if self.mode == CURVE_MODE_LUT:
+            baked_positions = get_sample_positions(self.lut_size)
+            baked_samples = [evaluate(x) for x in baked_positions]
         else:
-            output.int_values['slot'] = max_tex_manager.get_slot_from_filename(node.image.filepath)
-        return output
+            kept_indices = decimate_samples(positions, samples, self.tolerance)
+            if len(kept_indices) >= point_count:
+                return None
+            baked_positions = [positions[x] for x in kept_indices]
+            baked_samples = [samples[x] for x in kept_indices]
+        return (baked_positions, baked_samples, get_max_deviation(positions, samples, baked_positions, baked_samples))
+
+    def bake_rgb_curves(self, node):
+        mapping = node.mapping
+        if len(mapping.curves) != 4:
+            return None
+        # evaluate() reads tables that are only built by initialize()
+        mapping.initialize()
+        curve_strings = list()
+        max_deviation = None
+        for this_curve in (mapping.curves[3], mapping.curves[0], mapping.curves[1], mapping.curves[2]):
+            baked = self.bake_samples(lambda x: (mapping.evaluate(this_curve, x),), len(this_curve.points))
+            if baked is None:
+                curve_strings.append(get_single_curve_string(this_curve))
+                continue
+            positions, samples, deviation = baked
+            output_list = list()
+            for position, sample in zip(positions, samples):
+                output_list.append(format_baked_value(position))
+                output_list.append(format_baked_value(sample[0]))
+                output_list.append('l')
+            curve_strings.append(",".join(output_list))
+            max_deviation = deviation if max_deviation is None else max(max_deviation, deviation)
+        if max_deviation is None:
+            return None
+        return (join_rgb_curve_strings(*curve_strings), max_deviation)
+
+    def bake_color_ramp(self, node):
+        ramp = node.color_ramp
+        baked = self.bake_samples(lambda x: tuple(ramp.evaluate(x)), len(ramp.elements))
+        if baked is None:
+            return None
+        positions, samples, deviation = baked
+        output_list = list()
+        output_list.append("ramp00")
+        for position, sample in zip(positions, samples):
+            output_list.append(format_baked_value(position))
+            output_list.extend(format_baked_value(x) for x in sample[:4])
+        return (",".join(output_list), deviation)
+
+    def bake(self, node, cycles_node):
+        # Returns the largest deviation introduced, or None if the node was not changed
+        if cycles_node.node_type == NodeType.RGB_CURVES:
+            export_name = 'curves'
+            baked = self.bake_rgb_curves(node)
+        elif cycles_node.node_type == NodeType.COLOR_RAMP:
+            export_name = 'ramp'
+            baked = self.bake_color_ramp(node)
+        else:
+            return None
+        if baked is None:
+            return None
+        cycles_node.string_values[export_name] = baked[0]
+        return baked[1]
+
+def get_curve_baker(options):
+    if options.curve_mode == CURVE_MODE_POINTS:
+        return None
+    return CurveBaker(options.curve_mode, options.curve_lut_size, options.curve_tolerance)
+
+# Property extractors read a single non-socket property from a Blender node and store it on the CyclesNode
+def enum_property(attribute, export_name):
+    def extract(node, output):
+        output.string_values[export_name] = str(getattr(node, attribute)).lower()
+    return extract
+
+def string_property(attribute, export_name):
+    def extract(node, output):
+        output.string_values[export_name] = str(getattr(node, attribute))
+    return extract
+
+def int_property(attribute, export_name):
+    def extract(node, output):
+        output.int_values[export_name] = int(getattr(node, attribute))
+    return extract
+
+def float_property(attribute, export_name):
+    def extract(node, output):
+        output.float_values[export_name] = getattr(node, attribute)
+    return extract
+
+def extract_rgb_curves(node, output):
+    if len(node.mapping.curves) == 4:
+        curve_r = node.mapping.curves[0]
+        curve_g = node.mapping.curves[1]
+        curve_b = node.mapping.curves[2]
+        curve_c = node.mapping.curves[3]
+        output.string_values['curves'] = get_rgb_curve_string(curve_r, curve_g, curve_b, curve_c)
     else:
-        output.node_type = NodeType.INVALID
-        return output
+        # Ignore curves if there aren't exactly 4
+        pass
+
+def extract_color_ramp(node, output):
+    output.string_values['ramp'] = get_ramp_string(node.color_ramp)
+
+def extract_rgb_output(node, output):
+    value = node.outputs[0].default_value
+    output.float4_values['value'] = (value[0], value[1], value[2], value[3])
+
+def extract_value_output(node, output):
+    output.float_values['value'] = node.outputs[0].default_value
+
+def extract_wave_direction(node, output):
+    if (output.string_values['wave_type'] == "bands"):
+        output.string_values['direction'] = str(node.bands_direction).lower()
+    else:
+        output.string_values['direction'] = str(node.rings_direction).lower()
 
-    # Determine which sockets to copy based on node type
-    copy_sockets = dict()
+def extract_normal_map_space(node, output):
+    if node.space == 'BLENDER_OBJECT':
+        output.string_values['space'] = 'object'
+    elif node.space == 'BLENDER_WORLD':
+        output.string_values['space'] = 'world'
+    else:
+        output.string_values['space'] = str(node.space).lower()
+
+def get_numbered_identifiers(base_identifier, index):
+    # Repeated sockets are named Value, Value_001, Value_002... Files saved by older versions use Value.001
+    if index == 0:
+        return (base_identifier,)
+    return ("{0}_{1:03d}".format(base_identifier, index), "{0}.{1:03d}".format(base_identifier, index))
+
+def numbered_sockets(base_identifier, names):
+    # Maps each identifier of a run of repeated sockets to the name at the same position in names
+    output = dict()
+    for index, name in enumerate(names):
+        for identifier in get_numbered_identifiers(base_identifier, index):
+            output[identifier] = name
+    return output
+
+class NodeSchema:
+    def __init__(self, sockets=None, properties=None):
+        # Maps Blender socket identifier to the Cycles socket name
+        self.sockets = dict() if sockets is None else sockets
+        # Property extractors, run in order before sockets are copied
+        self.properties = list() if properties is None else properties
+
+def get_schema_by_type_dict():
+    output = dict()
     # Color
-    if output.node_type == NodeType.BRIGHT_CONTRAST:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Bright"] = "bright"
-        copy_sockets["Contrast"] = "contrast"
-    elif output.node_type == NodeType.GAMMA:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Gamma"] = "gamma"
-    elif output.node_type == NodeType.HSV:
-        copy_sockets["Hue"] = "hue"
-        copy_sockets["Saturation"] = "saturation"
-        copy_sockets["Value"] = "value"
-        copy_sockets["Fac"] = "fac"
-        copy_sockets["Color"] = "color"
-    elif output.node_type == NodeType.INVERT:
-        copy_sockets["Fac"] = "fac"
-        copy_sockets["Color"] = "color"
-    elif output.node_type == NodeType.LIGHT_FALLOFF:
-        copy_sockets["Strength"] = "strength"
-        copy_sockets["Smooth"] = "smooth"
-    elif output.node_type == NodeType.MIX_RGB:
-        copy_sockets["Fac"] = "fac"
-        copy_sockets["Color1"] = "color1"
-        copy_sockets["Color2"] = "color2"
-        #
-        output.string_values['mix_type'] = str(node.blend_type).lower()
-        output.int_values['use_clamp'] = int(node.use_clamp)
-    elif output.node_type == NodeType.RGB_CURVES:
-        copy_sockets["Fac"] = "fac"
-        copy_sockets["Color"] = "color"
-        #
-        if len(node.mapping.curves) == 4:
-            curve_r = node.mapping.curves[0]
-            curve_g = node.mapping.curves[1]
-            curve_b = node.mapping.curves[2]
-            curve_c = node.mapping.curves[3]
-            output.string_values['curves'] = get_rgb_curve_string(curve_r, curve_g, curve_b, curve_c)
-        else:
-            # Ignore curves if there aren't exactly 4
-            pass
+    output[NodeType.BRIGHT_CONTRAST] = NodeSchema(
+        sockets={"Color": "color", "Bright": "bright", "Contrast": "contrast"})
+    output[NodeType.GAMMA] = NodeSchema(
+        sockets={"Color": "color", "Gamma": "gamma"})
+    output[NodeType.HSV] = NodeSchema(
+        sockets={"Hue": "hue", "Saturation": "saturation", "Value": "value", "Fac": "fac", "Color": "color"})
+    output[NodeType.INVERT] = NodeSchema(
+        sockets={"Fac": "fac", "Color": "color"})
+    output[NodeType.LIGHT_FALLOFF] = NodeSchema(
+        sockets={"Strength": "strength", "Smooth": "smooth"})
+    output[NodeType.MIX_RGB] = NodeSchema(
+        sockets={"Fac": "fac", "Color1": "color1", "Color2": "color2"},
+        properties=[enum_property("blend_type", "mix_type"), int_property("use_clamp", "use_clamp")])
+    output[NodeType.RGB_CURVES] = NodeSchema(
+        sockets={"Fac": "fac", "Color": "color"},
+        properties=[extract_rgb_curves])
     # Converter
-    elif output.node_type == NodeType.BLACKBODY:
-        copy_sockets["Temperature"] = "temperature"
-    elif output.node_type == NodeType.CLAMP:
-        copy_sockets["Value"] = "value"
-        copy_sockets["Min"] = "min"
-        copy_sockets["Max"] = "max"
-        #
-        output.string_values['type'] = str(node.clamp_type).lower()
-    elif output.node_type == NodeType.COLOR_RAMP:
-        copy_sockets["Fac"] = "fac"
-        #
-        output.string_values['ramp'] = get_ramp_string(node.color_ramp)
-    elif output.node_type == NodeType.COMBINE_HSV:
-        copy_sockets["H"] = "h"
-        copy_sockets["S"] = "s"
-        copy_sockets["V"] = "v"
-    elif output.node_type == NodeType.COMBINE_RGB:
-        copy_sockets["R"] = "r"
-        copy_sockets["G"] = "g"
-        copy_sockets["B"] = "b"
-    elif output.node_type == NodeType.COMBINE_XYZ:
-        copy_sockets["X"] = "x"
-        copy_sockets["Y"] = "y"
-        copy_sockets["Z"] = "z"
-    elif output.node_type == NodeType.MAP_RANGE:
-        copy_sockets["Value"] = "value"
-        copy_sockets["From Min"] = "from_min"
-        copy_sockets["From Max"] = "from_max"
-        copy_sockets["To Min"] = "to_min"
-        copy_sockets["To Max"] = "to_max"
-        copy_sockets["Steps"] = "steps"
-        #
-        output.string_values['range_type'] = str(node.interpolation_type).lower()
-        output.int_values["clamp"] = int(node.clamp)
-    elif output.node_type == NodeType.MATH:
-        copy_sockets["Value"] = "value1"
-        copy_sockets["Value_001"] = "value2"
-        copy_sockets["Value.001"] = "value2"
-        copy_sockets["Value_002"] = "value3"
-        copy_sockets["Value.002"] = "value3"
-        #
-        output.string_values['math_type'] = str(node.operation).lower()
-        output.int_values['use_clamp'] = int(node.use_clamp)
-    elif output.node_type == NodeType.RGB_TO_BW:
-        copy_sockets["Color"] = "color"
-    elif output.node_type == NodeType.SEPARATE_HSV:
-        copy_sockets["Color"] = "color"
-    elif output.node_type == NodeType.SEPARATE_RGB:
-        copy_sockets["Image"] = "image"
-    elif output.node_type == NodeType.SEPARATE_XYZ:
-        copy_sockets["Vector"] = "vector"
-    elif output.node_type == NodeType.VECTOR_MATH:
-        copy_sockets["Scale"] = "scale"
-        copy_sockets["Vector"] = "vector1"
-        copy_sockets["Vector_001"] = "vector2"
-        copy_sockets["Vector.001"] = "vector2"
-        copy_sockets["Vector_002"] = "vector3"
-        copy_sockets["Vector.002"] = "vector3"
-        #
-        output.string_values['math_type'] = str(node.operation).lower()
-    elif output.node_type == NodeType.WAVELENGTH:
-        copy_sockets["Wavelength"] = "wavelength"
+    output[NodeType.BLACKBODY] = NodeSchema(
+        sockets={"Temperature": "temperature"})
+    output[NodeType.CLAMP] = NodeSchema(
+        sockets={"Value": "value", "Min": "min", "Max": "max"},
+        properties=[enum_property("clamp_type", "type")])
+    output[NodeType.COLOR_RAMP] = NodeSchema(
+        sockets={"Fac": "fac"},
+        properties=[extract_color_ramp])
+    output[NodeType.COMBINE_HSV] = NodeSchema(
+        sockets={"H": "h", "S": "s", "V": "v"})
+    output[NodeType.COMBINE_RGB] = NodeSchema(
+        sockets={"R": "r", "G": "g", "B": "b"})
+    output[NodeType.COMBINE_XYZ] = NodeSchema(
+        sockets={"X": "x", "Y": "y", "Z": "z"})
+    output[NodeType.MAP_RANGE] = NodeSchema(
+        sockets={"Value": "value", "From Min": "from_min", "From Max": "from_max", "To Min": "to_min", "To Max": "to_max", "Steps": "steps"},
+        properties=[enum_property("interpolation_type", "range_type"), int_property("clamp", "clamp")])
+    output[NodeType.MATH] = NodeSchema(
+        sockets=numbered_sockets("Value", ["value1", "value2", "value3"]),
+        properties=[enum_property("operation", "math_type"), int_property("use_clamp", "use_clamp")])
+    output[NodeType.RGB_TO_BW] = NodeSchema(
+        sockets={"Color": "color"})
+    output[NodeType.SEPARATE_HSV] = NodeSchema(
+        sockets={"Color": "color"})
+    output[NodeType.SEPARATE_RGB] = NodeSchema(
+        sockets={"Image": "image"})
+    output[NodeType.SEPARATE_XYZ] = NodeSchema(
+        sockets={"Vector": "vector"})
+    output[NodeType.VECTOR_MATH] = NodeSchema(
+        sockets=dict(numbered_sockets("Vector", ["vector1", "vector2", "vector3"]), Scale="scale"),
+        properties=[enum_property("operation", "math_type")])
+    output[NodeType.WAVELENGTH] = NodeSchema(
+        sockets={"Wavelength": "wavelength"})
     # Input
-    elif output.node_type == NodeType.AMBIENT_OCCLUSION:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Distance"] = "distance"
-        #
-        output.int_values["samples"] = node.samples
-        output.int_values["inside"] = int(node.inside)
-        output.int_values["only_local"] = int(node.only_local)
-    elif output.node_type == NodeType.BEVEL:
-        copy_sockets["Radius"] = "radius"
-        #
-        output.int_values['samples'] = node.samples
-    elif output.node_type == NodeType.FRESNEL:
-        copy_sockets["IOR"] = "IOR"
-    elif output.node_type == NodeType.LAYER_WEIGHT:
-        copy_sockets["Blend"] = "blend"
-    elif output.node_type == NodeType.RGB:
-        #
-        value = node.outputs[0].default_value
-        output.float4_values['value'] = (value[0], value[1], value[2], value[3])
-    elif output.node_type == NodeType.TANGENT:
-        #
-        output.string_values['direction'] = str(node.direction_type).lower()
-        output.string_values['axis'] = str(node.axis).lower()
-    elif output.node_type == NodeType.VALUE:
-        #
-        output.float_values['value'] = node.outputs[0].default_value
-    elif output.node_type == NodeType.WIREFRAME:
-        copy_sockets["Size"] = "size"
-        #
-        if node.use_pixel_size:
-            output.int_values['use_pixel_size'] = 1
-        else:
-            output.int_values['use_pixel_size'] = 0
+    output[NodeType.AMBIENT_OCCLUSION] = NodeSchema(
+        sockets={"Color": "color", "Distance": "distance"},
+        properties=[int_property("samples", "samples"), int_property("inside", "inside"), int_property("only_local", "only_local")])
+    output[NodeType.BEVEL] = NodeSchema(
+        sockets={"Radius": "radius"},
+        properties=[int_property("samples", "samples")])
+    output[NodeType.FRESNEL] = NodeSchema(
+        sockets={"IOR": "IOR"})
+    output[NodeType.LAYER_WEIGHT] = NodeSchema(
+        sockets={"Blend": "blend"})
+    output[NodeType.RGB] = NodeSchema(
+        properties=[extract_rgb_output])
+    output[NodeType.TANGENT] = NodeSchema(
+        properties=[enum_property("direction_type", "direction"), enum_property("axis", "axis")])
+    output[NodeType.VALUE] = NodeSchema(
+        properties=[extract_value_output])
+    output[NodeType.WIREFRAME] = NodeSchema(
+        sockets={"Size": "size"},
+        properties=[int_property("use_pixel_size", "use_pixel_size")])
     # Shader
-    elif output.node_type == NodeType.ANISOTROPIC_BSDF:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Roughness"] = "roughness"
-        copy_sockets["Anisotropy"] = "anisotropy"
-        copy_sockets["Rotation"] = "rotation"
-        #
-        output.string_values['distribution'] = str(node.distribution).lower()
-    elif output.node_type == NodeType.DIFFUSE_BSDF:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Roughness"] = "roughness"
-    elif output.node_type == NodeType.EMISSION:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Strength"] = "strength"
-    elif output.node_type == NodeType.GLASS_BSDF:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Roughness"] = "roughness"
-        copy_sockets["IOR"] = "IOR"
-        #
-        output.string_values['distribution'] = str(node.distribution).lower()
-    elif output.node_type == NodeType.GLOSSY_BSDF:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Roughness"] = "roughness"
-        #
-        output.string_values['distribution'] = str(node.distribution).lower()
-    elif output.node_type == NodeType.HAIR_BSDF:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Offset"] = "offset"
-        copy_sockets["RoughnessU"] = "roughness_u"
-        copy_sockets["RoughnessV"] = "roughness_v"
-        #
-        output.string_values['component'] = str(node.component).lower()
-    elif output.node_type == NodeType.MIX_SHADER:
-        copy_sockets["Fac"] = "fac"
-    elif output.node_type == NodeType.PRINCIPLED_BSDF:
-        copy_sockets["Base Color"] = "base_color"
-        copy_sockets["Subsurface"] = "subsurface"
-        copy_sockets["Subsurface Radius"] = "subsurface_radius"
-        copy_sockets["Subsurface Color"] = "subsurface_color"
-        copy_sockets["Metallic"] = "metallic"
-        copy_sockets["Specular"] = "specular"
-        copy_sockets["Specular Tint"] = "specular_tint"
-        copy_sockets["Roughness"] = "roughness"
-        copy_sockets["Anisotropic"] = "anisotropic"
-        copy_sockets["Anisotropic Rotation"] = "anisotropic_rotation"
-        copy_sockets["Sheen"] = "sheen"
-        copy_sockets["Sheen Tint"] = "sheen_tint"
-        copy_sockets["Clearcoat"] = "clearcoat"
-        copy_sockets["Clearcoat Roughness"] = "clearcoat_roughness"
-        copy_sockets["IOR"] = "ior"
-        copy_sockets["Transmission"] = "transmission"
-        copy_sockets["Emission"] = "emission"
-        copy_sockets["Emission Strength"] = "emission_strength"
-        copy_sockets["Alpha"] = "alpha"
-        #
-        output.string_values['distribution'] = str(node.distribution).lower()
-        output.string_values['subsurface_method'] = str(node.subsurface_method).lower()
-    elif output.node_type == NodeType.PRINCIPLED_HAIR:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Melanin"] = "melanin"
-        copy_sockets["Melanin Redness"] = "melanin_redness"
-        copy_sockets["Tint"] = "tint"
-        copy_sockets["Absorption Coefficient"] = "absorption_coefficient"
-        copy_sockets["Roughness"] = "roughness"
-        copy_sockets["Radial Roughness"] = "radial_roughness"
-        copy_sockets["Coat"] = "coat"
-        copy_sockets["IOR"] = "ior"
-        copy_sockets["Random Roughness"] = "random_roughness"
-        copy_sockets["Random Color"] = "random_color"
-        copy_sockets["Random"] = "random"
-        #
-        output.string_values['coloring'] = str(node.parametrization).lower()
-    elif output.node_type == NodeType.PRINCIPLED_VOLUME:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Density"] = "density"
-        copy_sockets["Anisotropy"] = "anisotropy"
-        copy_sockets["Absorption Color"] = "absorption_color"
-        copy_sockets["Emission Strength"] = "emission_strength"
-        copy_sockets["Emission Color"] = "emission_color"
-        copy_sockets["Blackbody Intensity"] = "blackbody_intensity"
-        copy_sockets["Blackbody Tint"] = "blackbody_tint"
-        copy_sockets["Temperature"] = "temperature"
-    elif output.node_type == NodeType.REFRACTION_BSDF:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Roughness"] = "roughness"
-        copy_sockets["IOR"] = "IOR"
-        #
-        output.string_values['distribution'] = str(node.distribution).lower()
-    elif output.node_type == NodeType.SUBSURFACE_SCATTER:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Scale"] = "scale"
-        copy_sockets["Radius"] = "radius"
-        copy_sockets["Texture Blur"] = "texture_blur"
-        #
-        output.string_values['falloff'] = str(node.falloff).lower()
-    elif output.node_type == NodeType.TOON_BSDF:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Size"] = "size"
-        copy_sockets["Smooth"] = "smooth"
-        #
-        output.string_values['component'] = str(node.component).lower()
-    elif output.node_type == NodeType.TRANSLUCENT_BSDF:
-        copy_sockets["Color"] = "color"
-    elif output.node_type == NodeType.TRANSPARENT_BSDF:
-        copy_sockets["Color"] = "color"
-    elif output.node_type == NodeType.VELVET_BSDF:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Sigma"] = "sigma"
-    elif output.node_type == NodeType.VOL_ABSORB:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Density"] = "density"
-    elif output.node_type == NodeType.VOL_SCATTER:
-        copy_sockets["Color"] = "color"
-        copy_sockets["Density"] = "density"
-        copy_sockets["Anisotropy"] = "anisotropy"
+    output[NodeType.ANISOTROPIC_BSDF] = NodeSchema(
+        sockets={"Color": "color", "Roughness": "roughness", "Anisotropy": "anisotropy", "Rotation": "rotation"},
+        properties=[enum_property("distribution", "distribution")])
+    output[NodeType.DIFFUSE_BSDF] = NodeSchema(
+        sockets={"Color": "color", "Roughness": "roughness"})
+    output[NodeType.EMISSION] = NodeSchema(
+        sockets={"Color": "color", "Strength": "strength"})
+    output[NodeType.GLASS_BSDF] = NodeSchema(
+        sockets={"Color": "color", "Roughness": "roughness", "IOR": "IOR"},
+        properties=[enum_property("distribution", "distribution")])
+    output[NodeType.GLOSSY_BSDF] = NodeSchema(
+        sockets={"Color": "color", "Roughness": "roughness"},
+        properties=[enum_property("distribution", "distribution")])
+    output[NodeType.HAIR_BSDF] = NodeSchema(
+        sockets={"Color": "color", "Offset": "offset", "RoughnessU": "roughness_u", "RoughnessV": "roughness_v"},
+        properties=[enum_property("component", "component")])
+    output[NodeType.MIX_SHADER] = NodeSchema(
+        sockets={"Fac": "fac"})
+    output[NodeType.PRINCIPLED_BSDF] = NodeSchema(
+        sockets={
+            "Base Color": "base_color",
+            "Subsurface": "subsurface",
+            "Subsurface Radius": "subsurface_radius",
+            "Subsurface Color": "subsurface_color",
+            "Metallic": "metallic",
+            "Specular": "specular",
+            "Specular Tint": "specular_tint",
+            "Roughness": "roughness",
+            "Anisotropic": "anisotropic",
+            "Anisotropic Rotation": "anisotropic_rotation",
+            "Sheen": "sheen",
+            "Sheen Tint": "sheen_tint",
+            "Clearcoat": "clearcoat",
+            "Clearcoat Roughness": "clearcoat_roughness",
+            "IOR": "ior",
+            "Transmission": "transmission",
+            "Emission": "emission",
+            "Emission Strength": "emission_strength",
+            "Alpha": "alpha",
+        },
+        properties=[enum_property("distribution", "distribution"), enum_property("subsurface_method", "subsurface_method")])
+    output[NodeType.PRINCIPLED_HAIR] = NodeSchema(
+        sockets={
+            "Color": "color",
+            "Melanin": "melanin",
+            "Melanin Redness": "melanin_redness",
+            "Tint": "tint",
+            "Absorption Coefficient": "absorption_coefficient",
+            "Roughness": "roughness",
+            "Radial Roughness": "radial_roughness",
+            "Coat": "coat",
+            "IOR": "ior",
+            "Random Roughness": "random_roughness",
+            "Random Color": "random_color",
+            "Random": "random",
+        },
+        properties=[enum_property("parametrization", "coloring")])
+    output[NodeType.PRINCIPLED_VOLUME] = NodeSchema(
+        sockets={
+            "Color": "color",
+            "Density": "density",
+            "Anisotropy": "anisotropy",
+            "Absorption Color": "absorption_color",
+            "Emission Strength": "emission_strength",
+            "Emission Color": "emission_color",
+            "Blackbody Intensity": "blackbody_intensity",
+            "Blackbody Tint": "blackbody_tint",
+            "Temperature": "temperature",
+        })
+    output[NodeType.REFRACTION_BSDF] = NodeSchema(
+        sockets={"Color": "color", "Roughness": "roughness", "IOR": "IOR"},
+        properties=[enum_property("distribution", "distribution")])
+    output[NodeType.SUBSURFACE_SCATTER] = NodeSchema(
+        sockets={"Color": "color", "Scale": "scale", "Radius": "radius", "Texture Blur": "texture_blur"},
+        properties=[enum_property("falloff", "falloff")])
+    output[NodeType.TOON_BSDF] = NodeSchema(
+        sockets={"Color": "color", "Size": "size", "Smooth": "smooth"},
+        properties=[enum_property("component", "component")])
+    output[NodeType.TRANSLUCENT_BSDF] = NodeSchema(
+        sockets={"Color": "color"})
+    output[NodeType.TRANSPARENT_BSDF] = NodeSchema(
+        sockets={"Color": "color"})
+    output[NodeType.VELVET_BSDF] = NodeSchema(
+        sockets={"Color": "color", "Sigma": "sigma"})
+    output[NodeType.VOL_ABSORB] = NodeSchema(
+        sockets={"Color": "color", "Density": "density"})
+    output[NodeType.VOL_SCATTER] = NodeSchema(
+        sockets={"Color": "color", "Density": "density", "Anisotropy": "anisotropy"})
     # Texture
-    elif output.node_type == NodeType.BRICK_TEX:
-        copy_sockets["Color1"] = "color1"
-        copy_sockets["Color2"] = "color2"
-        copy_sockets["Mortar"] = "mortar"
-        copy_sockets["Scale"] = "scale"
-        copy_sockets["Mortar Size"] = "mortar_size"
-        copy_sockets["Mortar Smooth"] = "mortar_smooth"
-        copy_sockets["Bias"] = "bias"
-        copy_sockets["Brick Width"] = "brick_width"
-        copy_sockets["Row Height"] = "row_height"
-        #
-        output.float_values['offset'] = node.offset
-        output.int_values['offset_frequency'] = node.offset_frequency
-        output.float_values['squash'] = node.squash
-        output.int_values['squash_frequency'] = node.squash_frequency
-    elif output.node_type == NodeType.CHECKER_TEX:
-        copy_sockets["Color1"] = "color1"
-        copy_sockets["Color2"] = "color2"
-        copy_sockets["Scale"] = "scale"
-    elif output.node_type == NodeType.GRADIENT_TEX:
-        #
-        output.string_values['gradient_type'] = str(node.gradient_type).lower()
-    elif output.node_type == NodeType.MAGIC_TEX:
-        copy_sockets["Scale"] = "scale"
-        copy_sockets["Distortion"] = "distortion"
-        #
-        output.int_values['depth'] = node.turbulence_depth 
-    elif output.node_type == NodeType.MUSGRAVE_TEX:
-        copy_sockets["W"] = "w"
-        copy_sockets["Scale"] = "scale"
-        copy_sockets["Detail"] = "detail"
-        copy_sockets["Lacunarity"] = "lacunarity"
-        copy_sockets["Offset"] = "offset"
-        copy_sockets["Gain"] = "gain"
-        #
-        output.string_values['musgrave_type'] = str(node.musgrave_type).lower()
-        output.string_values['dimensions'] = str(node.musgrave_dimensions)
-    elif output.node_type == NodeType.NOISE_TEX:
-        copy_sockets["W"] = "w"
-        copy_sockets["Scale"] = "scale"
-        copy_sockets["Detail"] = "detail"
-        copy_sockets["Roughness"] = "roughness"
-        copy_sockets["Distortion"] = "distortion"
-        #
-        output.string_values['dimensions'] = str(node.noise_dimensions)
-    elif output.node_type == NodeType.VORONOI_TEX:
-        copy_sockets["W"] = "w"
-        copy_sockets["Scale"] = "scale"
-        copy_sockets["Smoothness"] = "smoothness"
-        copy_sockets["Exponent"] = "exponent"
-        copy_sockets["Randomness"] = "randomness"
-        #
-        output.string_values['dimensions'] = str(node.voronoi_dimensions)
-        output.string_values['feature'] = str(node.feature).lower()
-        output.string_values['metric'] = str(node.distance).lower()
-    elif output.node_type == NodeType.WAVE_TEX:
-        copy_sockets["Scale"] = "scale"
-        copy_sockets["Distortion"] = "distortion"
-        copy_sockets["Detail"] = "detail"
-        copy_sockets["Detail Scale"] = "detail_scale"
-        copy_sockets["Detail Roughness"] = "detail_roughness"
-        copy_sockets["Phase Offset"] = "phase"
-        #
-        output.string_values['wave_type'] = str(node.wave_type).lower()
-        output.string_values['profile'] = str(node.wave_profile).lower()
-        if (output.string_values['wave_type'] == "bands"):
-            output.string_values['direction'] = str(node.bands_direction).lower()
-        else:
-            output.string_values['direction'] = str(node.rings_direction).lower()
+    output[NodeType.BRICK_TEX] = NodeSchema(
+        sockets={
+            "Color1": "color1",
+            "Color2": "color2",
+            "Mortar": "mortar",
+            "Scale": "scale",
+            "Mortar Size": "mortar_size",
+            "Mortar Smooth": "mortar_smooth",
+            "Bias": "bias",
+            "Brick Width": "brick_width",
+            "Row Height": "row_height",
+        },
+        properties=[
+            float_property("offset", "offset"),
+            int_property("offset_frequency", "offset_frequency"),
+            float_property("squash", "squash"),
+            int_property("squash_frequency", "squash_frequency"),
+        ])
+    output[NodeType.CHECKER_TEX] = NodeSchema(
+        sockets={"Color1": "color1", "Color2": "color2", "Scale": "scale"})
+    output[NodeType.GRADIENT_TEX] = NodeSchema(
+        properties=[enum_property("gradient_type", "gradient_type")])
+    output[NodeType.MAGIC_TEX] = NodeSchema(
+        sockets={"Scale": "scale", "Distortion": "distortion"},
+        properties=[int_property("turbulence_depth", "depth")])
+    output[NodeType.MUSGRAVE_TEX] = NodeSchema(
+        sockets={"W": "w", "Scale": "scale", "Detail": "detail", "Lacunarity": "lacunarity", "Offset": "offset", "Gain": "gain"},
+        properties=[enum_property("musgrave_type", "musgrave_type"), string_property("musgrave_dimensions", "dimensions")])
+    output[NodeType.NOISE_TEX] = NodeSchema(
+        sockets={"W": "w", "Scale": "scale", "Detail": "detail", "Roughness": "roughness", "Distortion": "distortion"},
+        properties=[string_property("noise_dimensions", "dimensions")])
+    output[NodeType.VORONOI_TEX] = NodeSchema(
+        sockets={"W": "w", "Scale": "scale", "Smoothness": "smoothness", "Exponent": "exponent", "Randomness": "randomness"},
+        properties=[string_property("voronoi_dimensions", "dimensions"), enum_property("feature", "feature"), enum_property("distance", "metric")])
+    output[NodeType.WAVE_TEX] = NodeSchema(
+        sockets={
+            "Scale": "scale",
+            "Distortion": "distortion",
+            "Detail": "detail",
+            "Detail Scale": "detail_scale",
+            "Detail Roughness": "detail_roughness",
+            "Phase Offset": "phase",
+        },
+        properties=[enum_property("wave_type", "wave_type"), enum_property("wave_profile", "profile"), extract_wave_direction])
     # Vector
-    elif output.node_type == NodeType.BUMP:
-        copy_sockets["Strength"] = "strength"
-        copy_sockets["Distance"] = "distance"
-        #
-        output.int_values['invert'] = int(node.invert)
-    elif output.node_type == NodeType.DISPLACEMENT:
-        copy_sockets["Height"] = "height"
-        copy_sockets["Midlevel"] = "midlevel"
-        copy_sockets["Scale"] = "scale"
-        #
-        output.string_values['space'] = str(node.space).lower()
-    elif output.node_type == NodeType.MAPPING:
-        copy_sockets["Vector"] = "vector"
-        copy_sockets["Location"] = "location"
-        copy_sockets["Rotation"] = "rotation"
-        copy_sockets["Scale"] = "scale"
-        #
-        output.string_values['mapping_type'] = str(node.vector_type).lower()
-    elif output.node_type == NodeType.NORMAL_MAP:
-        copy_sockets["Strength"] = "strength"
-        copy_sockets["Color"] = "color"
-        #
-        if node.space == 'BLENDER_OBJECT':
-            output.string_values['space'] = 'object'
-        elif node.space == 'BLENDER_WORLD':
-            output.string_values['space'] = 'world'
+    output[NodeType.BUMP] = NodeSchema(
+        sockets={"Strength": "strength", "Distance": "distance"},
+        properties=[int_property("invert", "invert")])
+    output[NodeType.DISPLACEMENT] = NodeSchema(
+        sockets={"Height": "height", "Midlevel": "midlevel", "Scale": "scale"},
+        properties=[enum_property("space", "space")])
+    output[NodeType.MAPPING] = NodeSchema(
+        sockets={"Vector": "vector", "Location": "location", "Rotation": "rotation", "Scale": "scale"},
+        properties=[enum_property("vector_type", "mapping_type")])
+    output[NodeType.NORMAL_MAP] = NodeSchema(
+        sockets={"Strength": "strength", "Color": "color"},
+        properties=[extract_normal_map_space])
+    output[NodeType.VECTOR_TRANSFORM] = NodeSchema(
+        sockets={"Vector": "vector"},
+        properties=[enum_property("vector_type", "transform_type"), enum_property("convert_from", "convert_from"), enum_property("convert_to", "convert_to")])
+    return output
+
+class NodeConverter:
+    def __init__(self, node_type, schema):
+        self.node_type = node_type
+        self.copy_sockets = schema.sockets
+        self.properties = tuple(schema.properties)
+
+def compile_node_converters(type_by_idname, schema_by_type):
+    output = dict()
+    for idname, node_type in type_by_idname.items():
+        # Types with no schema entry (texture coordinate, output, etc.) have nothing to copy
+        schema = schema_by_type.get(node_type, NodeSchema())
+        output[idname] = NodeConverter(node_type, schema)
+    return output
+
+# Built once at import so converting a node is a single lookup
+TYPE_BY_IDNAME = get_type_by_idname_dict()
+CONVERTER_BY_IDNAME = compile_node_converters(TYPE_BY_IDNAME, get_schema_by_type_dict())
+
+def get_node_position(node):
+    location = node.location
+    return (floor(location[0]), -1.0 * floor(location[1]))
+
+@lru_cache(maxsize=None)
+def get_numpy():
+    # Imported on first use, NumPy takes longer to import than everything else in this file
+    try:
+        import numpy
+    except ImportError:
+        # Blender ships with NumPy, but nothing here requires it
+        return None
+    return numpy
+
+def get_node_positions(nodes):
+    # Reads the location of every node with one foreach_get call instead of two RNA reads per node
+    count = len(nodes)
+    numpy = get_numpy()
+    if numpy is None:
+        locations = [0.0] * (2 * count)
+        nodes.foreach_get("location", locations)
+    else:
+        # A float32 array matches the RNA property, so Blender can copy it without converting each value
+        location_array = numpy.empty(2 * count, dtype=numpy.float32)
+        nodes.foreach_get("location", location_array)
+        locations = location_array.tolist()
+    return [(floor(locations[index]), -1.0 * floor(locations[index + 1])) for index in range(0, 2 * count, 2)]
+
+def get_image_filename(node):
+    if node.image is None or node.image.filepath is None:
+        return None
+    return node.image.filepath
+
+def get_max_tex_slot(max_tex_manager, filename):
+    if filename is None:
+        return max_tex_manager.get_empty_slot()
+    return max_tex_manager.get_slot_from_filename(filename)
+
+def set_socket_value(cycles_node, export_name, socket_type, value):
+    # Slicing a bpy_prop_array reads the whole array in one call, indexing reads one component at a time
+    if socket_type == "VALUE":
+        cycles_node.float_values[export_name] = value
+    elif socket_type == "RGBA":
+        cycles_node.float4_values[export_name] = tuple(value[:4])
+    elif socket_type == "VECTOR":
+        cycles_node.float3_values[export_name] = tuple(value[:3])
+    else:
+        pass
+
+def get_cycles_node(name, node, max_tex_manager, stats=None, position=None):
+    output = CyclesNode()
+    output.position = get_node_position(node) if position is None else position
+    output.name = name
+    converter = CONVERTER_BY_IDNAME.get(node.bl_idname)
+    if converter is None:
+        if node.bl_idname == "ShaderNodeTexImage":
+            # Special case here because we convert image textures to max textures
+            output.node_type = NodeType.MAX_TEX
+            filename = get_image_filename(node)
+            output.int_values['slot'] = get_max_tex_slot(max_tex_manager, filename)
+            max_tex_manager.add_image(filename, node.image)
         else:
-            output.string_values['space'] = str(node.space).lower()
-    elif output.node_type == NodeType.VECTOR_TRANSFORM:
-        copy_sockets["Vector"] = "vector"
-        #
-        output.string_values['transform_type'] = str(node.vector_type).lower()
-        output.string_values['convert_from'] = str(node.convert_from).lower()
-        output.string_values['convert_to'] = str(node.convert_to).lower()
+            output.node_type = NodeType.INVALID
+        return output
+
+    output.node_type = converter.node_type
+    for extract in converter.properties:
+        extract(node, output)
 
     # Copy all sockets with identifiers in copy_sockets
+    copy_sockets = converter.copy_sockets
     for input_socket in node.inputs:
-        if input_socket.identifier not in copy_sockets:
-            print(input_socket.identifier)
+        export_name = copy_sockets.get(input_socket.identifier)
+        if export_name is None:
+            if stats is not None:
+                stats.add_unmapped_socket(node.bl_idname, input_socket.identifier)
             continue
-        if input_socket.type == "VALUE":
-            output.float_values[copy_sockets[input_socket.identifier]] = input_socket.default_value
-        elif input_socket.type == "RGBA":
-            value = input_socket.default_value
-            output.float4_values[copy_sockets[input_socket.identifier]] = (value[0], value[1], value[2], value[3])
-        elif input_socket.type == "VECTOR":
-            value = input_socket.default_value
-            output.float3_values[copy_sockets[input_socket.identifier]] = (value[0], value[1], value[2])
-        else:
-            pass
+        set_socket_value(output, export_name, input_socket.type, input_socket.default_value)
+
+    return output
 
+# A tuple rather than a class, graphs have more connections than nodes. Passes that reroute a connection replace it with _replace()
+CyclesConnection = namedtuple("CyclesConnection", ("source_node", "source_socket", "dest_node", "dest_socket"), defaults=("", "", "", ""))
+
+SOCKET_INPUT = 0
+SOCKET_OUTPUT = 1
+
+def get_socket_renames_dict():
+    # Some node types do not have matching socket names in the Cycles C++ api and the Blender Python api
+    # Maps (bl_idname, socket identifier, direction) to the C++ name, other sockets keep their Blender name
+    output = dict()
+    for idname in ("ShaderNodeMixShader", "ShaderNodeAddShader"):
+        output[(idname, "Shader", SOCKET_OUTPUT)] = "Closure"
+        for identifier, name in numbered_sockets("Shader", ["Closure1", "Closure2"]).items():
+            output[(idname, identifier, SOCKET_INPUT)] = name
+    for identifier, name in numbered_sockets("Value", ["Value1", "Value2", "Value3"]).items():
+        output[("ShaderNodeMath", identifier, SOCKET_INPUT)] = name
+    for identifier, name in numbered_sockets("Vector", ["Vector1", "Vector2", "Vector3"]).items():
+        output[("ShaderNodeVectorMath", identifier, SOCKET_INPUT)] = name
     return output
 
-class CyclesConnection:
+SOCKET_RENAMES = get_socket_renames_dict()
+
+# Blender returns a new string every time a socket name is read, interning keeps one copy per name for all connections
+def get_source_socket_name(node, socket):
+    name = SOCKET_RENAMES.get((node.bl_idname, socket.identifier, SOCKET_OUTPUT))
+    return sys.intern(socket.name) if name is None else name
+
+def get_dest_socket_name(node, socket):
+    name = SOCKET_RENAMES.get((node.bl_idname, socket.identifier, SOCKET_INPUT))
+    return sys.intern(socket.name) if name is None else name
+
+def get_graph_string_count(cycles_nodes, connections):
+    # Number of strings iter_graph_strings writes after section_nodes
+    count = 1 + 4 * len(connections)
+    for cycles_node in cycles_nodes:
+        value_count = len(cycles_node.float_values) + len(cycles_node.float3_values) + len(cycles_node.float4_values) + len(cycles_node.string_values) + len(cycles_node.int_values)
+        count += 5 + 2 * value_count
+    return count
+
+def iter_graph_strings(cycles_nodes, connections, header_fields=EMPTY_VALUES):
+    yield "cycles_shader"
+    # Header fields need version 2, so loaders that do not know them reject the file instead of misreading it
+    if len(header_fields) == 0:
+        yield "1"
+    else:
+        yield "2"
+        for name, value in header_fields.items():
+            yield name
+            yield value
+
+    node_ids = None
+    if header_fields.get("order") == "topological":
+        # Counted here rather than in order_nodes_topologically so they match whatever ran after it
+        yield "nodes"
+        yield str(len(cycles_nodes))
+        yield "connections"
+        yield str(len(connections))
+        yield "strings"
+        yield str(get_graph_string_count(cycles_nodes, connections))
+        node_ids = dict((x.name, str(index)) for index, x in enumerate(cycles_nodes))
+
+    yield "section_nodes"
+    for cycles_node in cycles_nodes:
+        yield from iter_node_strings(cycles_node)
+
+    yield "section_connections"
+    if node_ids is None:
+        for this_connection in connections:
+            yield this_connection.source_node
+            yield this_connection.source_socket
+            yield this_connection.dest_node
+            yield this_connection.dest_socket
+    else:
+        for this_connection in connections:
+            yield node_ids[this_connection.source_node]
+            yield this_connection.source_socket
+            yield node_ids[this_connection.dest_node]
+            yield this_connection.dest_socket
+
+class ExportOptions:
     def __init__(self):
-        self.source_node = ""
-        self.source_socket = ""
-        self.dest_node = ""
-        self.dest_socket = ""
+        # Drop nodes that do not contribute to the active material output
+        self.prune_unreachable = False
+        # Evaluate math and converter nodes with constant inputs at export time
+        self.fold_constants = False
+        # Merge nodes that have identical parameters and inputs
+        self.merge_duplicates = False
+        # Write the binary encoding from cyclesmax_binary.py instead of text
+        self.binary_format = False
+        # Write curves and color ramps as their control points, as a lookup table or decimated, see CurveBaker
+        self.curve_mode = CURVE_MODE_POINTS
+        self.curve_lut_size = 32
+        self.curve_tolerance = 0.001
+        # Give images of the same file one slot and describe each slot in a .textures.json file
+        self.texture_manifest = False
+        # Leave out values equal to cyclesmax_defaults.DEFAULT_VALUES, text files only
+        self.sparse_defaults = False
+        # Write nodes in dependency order with counts in the header, connections refer to nodes by index
+        self.topological_order = False
+
+    def get_cache_key(self):
+        # Every option that changes the exported file must be part of this
+        curves = self.curve_mode
+        if self.curve_mode == CURVE_MODE_LUT:
+            curves += ":{0}".format(self.curve_lut_size)
+        elif self.curve_mode == CURVE_MODE_DECIMATE:
+            curves += ":{0!r}".format(self.curve_tolerance)
+        return "prune={0},fold={1},merge={2},binary={3},curves={4},textures={5},sparse={6},topological={7}".format(int(self.prune_unreachable), int(self.fold_constants), int(self.merge_duplicates), int(self.binary_format), curves, int(self.texture_manifest), int(self.sparse_defaults), int(self.topological_order))
 
-class GetConnectionResult:
+class SerializedNodeGraph:
     def __init__(self):
-        self.is_valid = False
-        self.connection = CyclesConnection()
+        self.nodes = list()
+        self.connections = list()
+        self.unsupported_types = set()
+        self.incompatible_types = set()
+        # Internal name of the converted active material output, if there is one
+        self.output_node_name = None
+        self.pruned_node_count = 0
+        self.folded_node_count = 0
+        self.merged_node_count = 0
+        self.baked_curve_count = 0
+        self.max_curve_deviation = 0.0
+        # Entries from merge_texture_slots, None unless a texture manifest was requested
+        self.texture_manifest = None
+        self.merged_texture_count = 0
+        # Slots and textures from reading the node tree, only kept until finish_node_graph merges them
+        self.max_tex_manager = None
+        self.omitted_value_count = 0
+        self.dropped_link_count = 0
+        # Written between the version and the nodes, only sparse and topologically ordered graphs have any
+        self.header_fields = dict()
 
-def get_cycles_connection(names_by_bname, link):
-    output = GetConnectionResult()
-    source_node = link.from_node
-    dest_node = link.to_node
-    if source_node.name not in names_by_bname:
+    def iter_strings(self):
+        return iter_graph_strings(self.nodes, self.connections, self.header_fields)
+
+    def get_graph_string(self):
+        return "|".join(self.iter_strings()) + "|"
+
+    def get_graph_bytes(self):
+        # cyclesmax_binary.py is not part of the add-on itself, it must be importable from where this script is run
+        import cyclesmax_binary
+        writer = cyclesmax_binary.BinaryShaderWriter()
+        writer.header_fields = cyclesmax_binary.get_binary_header_fields(self.header_fields)
+        for this_node in self.nodes:
+            writer.add_node(this_node.node_type.value, this_node.name, this_node.position,
+                this_node.float_values, this_node.float3_values, this_node.float4_values, this_node.string_values, this_node.int_values)
+        for this_connection in self.connections:
+            writer.add_connection(this_connection.source_node, this_connection.source_socket, this_connection.dest_node, this_connection.dest_socket)
+        return writer.get_bytes()
+
+class ExportStats:
+    # Optional instrumentation, everything that records into this takes None to skip it entirely
+    def __init__(self):
+        self.material_count = 0
+        self.phase_seconds = dict()
+        self.node_counts = dict()
+        self.node_seconds = dict()
+        # Blender node type -> socket identifier -> number of sockets skipped because they have no Cycles name
+        self.unmapped_sockets = dict()
+        # Export pipeline workers record their phases concurrently, so phase times add up across threads
+        self.phase_lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_seconds(name, time.perf_counter() - start_time)
+
+    def add_phase_seconds(self, name, seconds):
+        with self.phase_lock:
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+
+    def add_node(self, node_type, seconds):
+        self.node_counts[node_type.value] = self.node_counts.get(node_type.value, 0) + 1
+        self.node_seconds[node_type.value] = self.node_seconds.get(node_type.value, 0.0) + seconds
+
+    def add_unmapped_socket(self, bl_idname, identifier):
+        sockets = self.unmapped_sockets.setdefault(bl_idname, dict())
+        sockets[identifier] = sockets.get(identifier, 0) + 1
+
+    def get_unmapped_socket_count(self):
+        return sum(sum(x.values()) for x in self.unmapped_sockets.values())
+
+    def get_summary_lines(self, node_type_count=5):
+        output = list()
+        phases = sorted(self.phase_seconds.items(), key=lambda x: x[1], reverse=True)
+        output.append("Time by phase: " + ", ".join("{0} {1:.3f}s".format(name, seconds) for name, seconds in phases))
+        node_types = sorted(self.node_seconds.items(), key=lambda x: x[1], reverse=True)[:node_type_count]
+        if len(node_types) > 0:
+            output.append("Slowest node types: " + ", ".join("{0} {1:.3f}s ({2} nodes)".format(name, seconds, self.node_counts[name]) for name, seconds in node_types))
+        unmapped_count = self.get_unmapped_socket_count()
+        if unmapped_count > 0:
+            output.append("Skipped {0} unmapped sockets on {1} node types".format(unmapped_count, len(self.unmapped_sockets)))
         return output
-    if dest_node.name not in names_by_bname:
+
+    def to_dict(self):
+        output = dict()
+        output["materials"] = self.material_count
+        output["phase_seconds"] = self.phase_seconds
+        output["node_types"] = dict()
+        for name, count in sorted(self.node_counts.items()):
+            output["node_types"][name] = {"count": count, "seconds": self.node_seconds[name]}
+        output["unmapped_sockets"] = self.unmapped_sockets
         return output
-    output.is_valid = True
-    output.connection.source_node = names_by_bname[source_node.name]
-    output.connection.dest_node = names_by_bname[dest_node.name]
-    output.connection.source_socket = link.from_socket.name
-    output.connection.dest_socket = link.to_socket.name
-    
-    # Some node types do not have matching socket names in the Cycles C++ api and the Blender Python api
-    # For these types, change to the C++ name
-    if source_node.bl_idname == "ShaderNodeMixShader":
-        if link.from_socket.identifier == "Shader":
-            output.connection.source_socket = "Closure"
-    elif source_node.bl_idname == "ShaderNodeAddShader":
-        if link.from_socket.identifier == "Shader":
-            output.connection.source_socket = "Closure"
-
-    if dest_node.bl_idname == "ShaderNodeMixShader":
-        if link.to_socket.identifier == "Shader":
-            output.connection.dest_socket = "Closure1"
-        elif link.to_socket.identifier == "Shader_001":
-            output.connection.dest_socket = "Closure2"
-        elif link.to_socket.identifier == "Shader.001":
-            output.connection.dest_socket = "Closure2"
-    elif dest_node.bl_idname == "ShaderNodeAddShader":
-        if link.to_socket.identifier == "Shader":
-            output.connection.dest_socket = "Closure1"
-        elif link.to_socket.identifier == "Shader_001":
-            output.connection.dest_socket = "Closure2"
-        elif link.to_socket.identifier == "Shader.001":
-            output.connection.dest_socket = "Closure2"
-    elif dest_node.bl_idname == "ShaderNodeMath":
-        if link.to_socket.identifier == "Value":
-            output.connection.dest_socket = "Value1"
-        elif link.to_socket.identifier == "Value_001":
-            output.connection.dest_socket = "Value2"
-        elif link.to_socket.identifier == "Value.001":
-            output.connection.dest_socket = "Value2"
-        elif link.to_socket.identifier == "Value_002":
-            output.connection.dest_socket = "Value3"
-        elif link.to_socket.identifier == "Value.002":
-            output.connection.dest_socket = "Value3"
-    elif dest_node.bl_idname == "ShaderNodeVectorMath":
-        if link.to_socket.identifier == "Vector":
-            output.connection.dest_socket = "Vector1"
-        elif link.to_socket.identifier == "Vector_001":
-            output.connection.dest_socket = "Vector2"
-        elif link.to_socket.identifier == "Vector.001":
-            output.connection.dest_socket = "Vector2"
-        elif link.to_socket.identifier == "Vector_002":
-            output.connection.dest_socket = "Vector3"
-        elif link.to_socket.identifier == "Vector.002":
-            output.connection.dest_socket = "Vector3"
-    
+
+    def save(self, filepath):
+        with atomic_open(filepath) as stats_file:
+            json.dump(self.to_dict(), stats_file, indent=2, sort_keys=True)
+
+NO_STATS_PHASE = nullcontext()
+
+def stats_phase(stats, name):
+    if stats is None:
+        return NO_STATS_PHASE
+    return stats.phase(name)
+
+# Constant folding
+# Math, vector math, mix, invert, combine XYZ, map range and clamp nodes whose inputs are all
+# constant are evaluated here, following the Cycles SVM implementations, and replaced with
+# a single node holding the result. Evaluators return None for anything that can't be folded
+# exactly, and those nodes are left alone.
+
+FOLD_FLOAT = "float"
+FOLD_VECTOR = "vector"
+FOLD_COLOR = "color"
+
+# Smallest float32 step above 1.0, used by the compare operation
+FLOAT_EPSILON = 1.1920929e-07
+
+def safe_divide(a, b):
+    return a / b if b != 0.0 else 0.0
+
+def safe_modulo(a, b):
+    return math.fmod(a, b) if b != 0.0 else 0.0
+
+def fract(a):
+    return a - math.floor(a)
+
+def wrap(value, max_value, min_value):
+    value_range = max_value - min_value
+    return value - value_range * math.floor((value - min_value) / value_range) if value_range != 0.0 else min_value
+
+def saturate(value):
+    return min(max(value, 0.0), 1.0)
+
+def smooth_min(a, b, c):
+    if c != 0.0:
+        h = max(c - abs(a - b), 0.0) / c
+        return min(a, b) - h * h * h * c * (1.0 / 6.0)
+    return min(a, b)
+
+def evaluate_math(math_type, a, b, c):
+    if math_type == "add":
+        return a + b
+    elif math_type == "subtract":
+        return a - b
+    elif math_type == "multiply":
+        return a * b
+    elif math_type == "divide":
+        return safe_divide(a, b)
+    elif math_type == "multiply_add":
+        return a * b + c
+    elif math_type == "power":
+        if a < 0.0 and b != math.floor(b):
+            return 0.0
+        try:
+            return math.pow(a, b)
+        except (OverflowError, ValueError, ZeroDivisionError):
+            return None
+    elif math_type == "logarithm":
+        if a <= 0.0 or b <= 0.0:
+            return 0.0
+        return safe_divide(math.log(a), math.log(b))
+    elif math_type == "sqrt":
+        return math.sqrt(a) if a > 0.0 else 0.0
+    elif math_type == "inverse_sqrt":
+        return 1.0 / math.sqrt(a) if a > 0.0 else 0.0
+    elif math_type == "absolute":
+        return abs(a)
+    elif math_type == "exponent":
+        try:
+            return math.exp(a)
+        except OverflowError:
+            return None
+    elif math_type == "minimum":
+        return min(a, b)
+    elif math_type == "maximum":
+        return max(a, b)
+    elif math_type == "less_than":
+        return 1.0 if a < b else 0.0
+    elif math_type == "greater_than":
+        return 1.0 if a > b else 0.0
+    elif math_type == "sign":
+        return 0.0 if a == 0.0 else math.copysign(1.0, a)
+    elif math_type == "compare":
+        return 1.0 if (a == b or abs(a - b) <= max(c, FLOAT_EPSILON)) else 0.0
+    elif math_type == "smooth_min":
+        return smooth_min(a, b, c)
+    elif math_type == "smooth_max":
+        return -smooth_min(-a, -b, c)
+    elif math_type == "round":
+        return math.floor(a + 0.5)
+    elif math_type == "floor":
+        return math.floor(a)
+    elif math_type == "ceil":
+        return math.ceil(a)
+    elif math_type == "trunc":
+        return math.floor(a) if a >= 0.0 else math.ceil(a)
+    elif math_type == "fract":
+        return fract(a)
+    elif math_type == "modulo":
+        return safe_modulo(a, b)
+    elif math_type == "wrap":
+        return wrap(a, b, c)
+    elif math_type == "snap":
+        return math.floor(safe_divide(a, b)) * b
+    elif math_type == "pingpong":
+        return abs(fract((a - b) / (b * 2.0)) * b * 2.0 - b) if b != 0.0 else 0.0
+    elif math_type == "sine":
+        return math.sin(a)
+    elif math_type == "cosine":
+        return math.cos(a)
+    elif math_type == "tangent":
+        return math.tan(a)
+    elif math_type == "arcsine":
+        return math.asin(min(max(a, -1.0), 1.0))
+    elif math_type == "arccosine":
+        return math.acos(min(max(a, -1.0), 1.0))
+    elif math_type == "arctangent":
+        return math.atan(a)
+    elif math_type == "arctan2":
+        return math.atan2(a, b)
+    elif math_type == "sinh":
+        try:
+            return math.sinh(a)
+        except OverflowError:
+            return None
+    elif math_type == "cosh":
+        try:
+            return math.cosh(a)
+        except OverflowError:
+            return None
+    elif math_type == "tanh":
+        return math.tanh(a)
+    elif math_type == "radians":
+        return a * (math.pi / 180.0)
+    elif math_type == "degrees":
+        return a * (180.0 / math.pi)
+    return None
+
+def vector_dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def vector_length(a):
+    return math.sqrt(vector_dot(a, a))
+
+def vector_scale(a, scale):
+    return (a[0] * scale, a[1] * scale, a[2] * scale)
+
+def vector_map(function, *vectors):
+    return tuple(function(*components) for components in zip(*vectors))
+
+def evaluate_vector_math(math_type, a, b, c, scale):
+    # Returns (vector output, value output), Cycles leaves the unused one at zero
+    zero = (0.0, 0.0, 0.0)
+    if math_type == "add":
+        return vector_map(lambda x, y: x + y, a, b), 0.0
+    elif math_type == "subtract":
+        return vector_map(lambda x, y: x - y, a, b), 0.0
+    elif math_type == "multiply":
+        return vector_map(lambda x, y: x * y, a, b), 0.0
+    elif math_type == "divide":
+        return vector_map(safe_divide, a, b), 0.0
+    elif math_type == "multiply_add":
+        return vector_map(lambda x, y, z: x * y + z, a, b, c), 0.0
+    elif math_type == "cross_product":
+        return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]), 0.0
+    elif math_type == "project":
+        length_squared = vector_dot(b, b)
+        if length_squared == 0.0:
+            return zero, 0.0
+        return vector_scale(b, vector_dot(a, b) / length_squared), 0.0
+    elif math_type == "reflect":
+        length = vector_length(b)
+        if length == 0.0:
+            # Cycles normalizes the zero vector into NaNs here, don't try to reproduce that
+            return None
+        normal = vector_scale(b, 1.0 / length)
+        return vector_map(lambda x, n: x - 2.0 * n * vector_dot(a, normal), a, normal), 0.0
+    elif math_type == "dot_product":
+        return zero, vector_dot(a, b)
+    elif math_type == "distance":
+        return zero, vector_length(vector_map(lambda x, y: x - y, a, b))
+    elif math_type == "length":
+        return zero, vector_length(a)
+    elif math_type == "scale":
+        return vector_scale(a, scale), 0.0
+    elif math_type == "normalize":
+        length = vector_length(a)
+        return (vector_scale(a, 1.0 / length) if length != 0.0 else zero), 0.0
+    elif math_type == "snap":
+        return vector_map(lambda x, y: math.floor(safe_divide(x, y)) * y, a, b), 0.0
+    elif math_type == "floor":
+        return vector_map(math.floor, a), 0.0
+    elif math_type == "ceil":
+        return vector_map(math.ceil, a), 0.0
+    elif math_type == "modulo":
+        return vector_map(safe_modulo, a, b), 0.0
+    elif math_type == "wrap":
+        return vector_map(wrap, a, b, c), 0.0
+    elif math_type == "fraction":
+        return vector_map(fract, a), 0.0
+    elif math_type == "absolute":
+        return vector_map(abs, a), 0.0
+    elif math_type == "minimum":
+        return vector_map(min, a, b), 0.0
+    elif math_type == "maximum":
+        return vector_map(max, a, b), 0.0
+    elif math_type == "sine":
+        return vector_map(math.sin, a), 0.0
+    elif math_type == "cosine":
+        return vector_map(math.cos, a), 0.0
+    elif math_type == "tangent":
+        return vector_map(math.tan, a), 0.0
+    return None
+
+def interpolate(a, b, t):
+    return vector_map(lambda x, y: (1.0 - t) * x + t * y, a, b)
+
+def mix_divide(t, x, y):
+    return (1.0 - t) * x + t * x / y if y != 0.0 else x
+
+def mix_overlay(t, x, y):
+    if x < 0.5:
+        return x * ((1.0 - t) + 2.0 * t * y)
+    return 1.0 - ((1.0 - t) + 2.0 * t * (1.0 - y)) * (1.0 - x)
+
+def mix_dodge(t, x, y):
+    if x == 0.0:
+        return x
+    tmp = 1.0 - t * y
+    if tmp <= 0.0:
+        return 1.0
+    return min(x / tmp, 1.0)
+
+def mix_burn(t, x, y):
+    tmp = (1.0 - t) + t * y
+    if tmp <= 0.0:
+        return 0.0
+    return saturate(1.0 - (1.0 - x) / tmp)
+
+def mix_soft_light(t, x, y):
+    screen = 1.0 - (1.0 - y) * (1.0 - x)
+    return (1.0 - t) * x + t * ((1.0 - x) * y * x + x * screen)
+
+def evaluate_mix(mix_type, fac, color1, color2):
+    t = saturate(fac)
+    if mix_type == "mix":
+        return interpolate(color1, color2, t)
+    elif mix_type == "add":
+        return interpolate(color1, vector_map(lambda x, y: x + y, color1, color2), t)
+    elif mix_type == "multiply":
+        return interpolate(color1, vector_map(lambda x, y: x * y, color1, color2), t)
+    elif mix_type == "subtract":
+        return interpolate(color1, vector_map(lambda x, y: x - y, color1, color2), t)
+    elif mix_type == "screen":
+        return vector_map(lambda x, y: 1.0 - ((1.0 - t) + t * (1.0 - y)) * (1.0 - x), color1, color2)
+    elif mix_type == "divide":
+        return vector_map(lambda x, y: mix_divide(t, x, y), color1, color2)
+    elif mix_type == "difference":
+        return interpolate(color1, vector_map(lambda x, y: abs(x - y), color1, color2), t)
+    elif mix_type == "darken":
+        return interpolate(color1, vector_map(min, color1, color2), t)
+    elif mix_type == "lighten":
+        return interpolate(color1, vector_map(max, color1, color2), t)
+    elif mix_type == "overlay":
+        return vector_map(lambda x, y: mix_overlay(t, x, y), color1, color2)
+    elif mix_type == "dodge":
+        return vector_map(lambda x, y: mix_dodge(t, x, y), color1, color2)
+    elif mix_type == "burn":
+        return vector_map(lambda x, y: mix_burn(t, x, y), color1, color2)
+    elif mix_type == "soft_light":
+        return vector_map(lambda x, y: mix_soft_light(t, x, y), color1, color2)
+    elif mix_type == "linear_light":
+        return vector_map(lambda x, y: x + t * (2.0 * y - 1.0), color1, color2)
+    # Hue, saturation, value and color blending depend on Cycles' HSV conversion, leave them to the renderer
+    return None
+
+def smoothstep(edge0, edge1, x):
+    if x < edge0:
+        return 0.0
+    if x >= edge1:
+        return 1.0
+    t = (x - edge0) / (edge1 - edge0)
+    return (3.0 - 2.0 * t) * (t * t)
+
+def smootherstep(edge0, edge1, x):
+    x = saturate(safe_divide(x - edge0, edge1 - edge0))
+    return x * x * x * (x * (x * 6.0 - 15.0) + 10.0)
+
+def clamp_range(value, min_value, max_value):
+    if min_value > max_value:
+        return min(max(value, max_value), min_value)
+    return min(max(value, min_value), max_value)
+
+def evaluate_map_range(range_type, use_clamp, value, from_min, from_max, to_min, to_max, steps):
+    if range_type == "linear":
+        factor = safe_divide(value - from_min, from_max - from_min)
+    elif range_type == "stepped":
+        factor = safe_divide(value - from_min, from_max - from_min)
+        factor = math.floor(factor * (steps + 1.0)) / steps if steps > 0.0 else 0.0
+    elif range_type == "smoothstep":
+        if from_min > from_max:
+            factor = 1.0 - smoothstep(from_max, from_min, value)
+        else:
+            factor = smoothstep(from_min, from_max, value)
+    elif range_type == "smootherstep":
+        if from_min > from_max:
+            factor = 1.0 - smootherstep(from_max, from_min, value)
+        else:
+            factor = smootherstep(from_min, from_max, value)
+    else:
+        return None
+    result = to_min + factor * (to_max - to_min)
+    # The clamp option only exists for the linear and stepped modes
+    if use_clamp and range_type in ("linear", "stepped"):
+        result = clamp_range(result, to_min, to_max)
+    return result
+
+def evaluate_clamp(clamp_type, value, min_value, max_value):
+    if clamp_type == "minmax":
+        return min(max(value, min_value), max_value)
+    elif clamp_type == "range":
+        return clamp_range(value, min_value, max_value)
+    return None
+
+def fold_math(cycles_node, inputs):
+    result = evaluate_math(cycles_node.string_values.get('math_type'), inputs["value1"], inputs["value2"], inputs["value3"])
+    if result is None:
+        return None
+    if cycles_node.int_values.get('use_clamp', 0):
+        result = saturate(result)
+    return {"Value": (FOLD_FLOAT, result)}
+
+def fold_vector_math(cycles_node, inputs):
+    result = evaluate_vector_math(cycles_node.string_values.get('math_type'), inputs["vector1"], inputs["vector2"], inputs["vector3"], inputs["scale"])
+    if result is None:
+        return None
+    return {"Vector": (FOLD_VECTOR, result[0]), "Value": (FOLD_FLOAT, result[1])}
+
+def fold_mix_rgb(cycles_node, inputs):
+    result = evaluate_mix(cycles_node.string_values.get('mix_type'), inputs["fac"], inputs["color1"], inputs["color2"])
+    if result is None:
+        return None
+    if cycles_node.int_values.get('use_clamp', 0):
+        result = vector_map(saturate, result)
+    return {"Color": (FOLD_COLOR, result)}
+
+def fold_invert(cycles_node, inputs):
+    color = inputs["color"]
+    return {"Color": (FOLD_COLOR, interpolate(color, vector_map(lambda x: 1.0 - x, color), inputs["fac"]))}
+
+def fold_combine_xyz(cycles_node, inputs):
+    return {"Vector": (FOLD_VECTOR, (inputs["x"], inputs["y"], inputs["z"]))}
+
+def fold_map_range(cycles_node, inputs):
+    result = evaluate_map_range(
+        cycles_node.string_values.get('range_type'),
+        cycles_node.int_values.get('clamp', 0),
+        inputs["value"], inputs["from_min"], inputs["from_max"], inputs["to_min"], inputs["to_max"], inputs["steps"])
+    if result is None:
+        return None
+    return {"Result": (FOLD_FLOAT, result)}
+
+def fold_clamp(cycles_node, inputs):
+    result = evaluate_clamp(cycles_node.string_values.get('type'), inputs["value"], inputs["min"], inputs["max"])
+    if result is None:
+        return None
+    return {"Result": (FOLD_FLOAT, result)}
+
+def fold_value(cycles_node, inputs):
+    value = cycles_node.float_values.get('value')
+    if value is None:
+        return None
+    return {"Value": (FOLD_FLOAT, value)}
+
+def fold_rgb(cycles_node, inputs):
+    value = cycles_node.float4_values.get('value')
+    if value is None:
+        return None
+    return {"Color": (FOLD_COLOR, (value[0], value[1], value[2]))}
+
+class ConstantFolder:
+    def __init__(self, inputs, fold):
+        # Maps destination socket name to (parameter name, value kind, default if not exported)
+        self.inputs = inputs
+        self.fold = fold
+
+def get_constant_folder_by_type_dict():
+    output = dict()
+    output[NodeType.MATH] = ConstantFolder({
+        "Value1": ("value1", FOLD_FLOAT, None),
+        "Value2": ("value2", FOLD_FLOAT, None),
+        # Only used by operations added in 2.82, older nodes don't have it
+        "Value3": ("value3", FOLD_FLOAT, 0.0),
+    }, fold_math)
+    output[NodeType.VECTOR_MATH] = ConstantFolder({
+        "Vector1": ("vector1", FOLD_VECTOR, None),
+        "Vector2": ("vector2", FOLD_VECTOR, None),
+        "Vector3": ("vector3", FOLD_VECTOR, (0.0, 0.0, 0.0)),
+        "Scale": ("scale", FOLD_FLOAT, 1.0),
+    }, fold_vector_math)
+    output[NodeType.MIX_RGB] = ConstantFolder({
+        "Fac": ("fac", FOLD_FLOAT, None),
+        "Color1": ("color1", FOLD_COLOR, None),
+        "Color2": ("color2", FOLD_COLOR, None),
+    }, fold_mix_rgb)
+    output[NodeType.INVERT] = ConstantFolder({
+        "Fac": ("fac", FOLD_FLOAT, None),
+        "Color": ("color", FOLD_COLOR, None),
+    }, fold_invert)
+    output[NodeType.COMBINE_XYZ] = ConstantFolder({
+        "X": ("x", FOLD_FLOAT, None),
+        "Y": ("y", FOLD_FLOAT, None),
+        "Z": ("z", FOLD_FLOAT, None),
+    }, fold_combine_xyz)
+    output[NodeType.MAP_RANGE] = ConstantFolder({
+        "Value": ("value", FOLD_FLOAT, None),
+        "From Min": ("from_min", FOLD_FLOAT, None),
+        "From Max": ("from_max", FOLD_FLOAT, None),
+        "To Min": ("to_min", FOLD_FLOAT, None),
+        "To Max": ("to_max", FOLD_FLOAT, None),
+        "Steps": ("steps", FOLD_FLOAT, 4.0),
+    }, fold_map_range)
+    output[NodeType.CLAMP] = ConstantFolder({
+        "Value": ("value", FOLD_FLOAT, None),
+        "Min": ("min", FOLD_FLOAT, None),
+        "Max": ("max", FOLD_FLOAT, None),
+    }, fold_clamp)
+    # Constant sources, they have no inputs and only let the nodes they feed be folded
+    output[NodeType.VALUE] = ConstantFolder(dict(), fold_value)
+    output[NodeType.RGB] = ConstantFolder(dict(), fold_rgb)
     return output
 
-class SerializedNodeGraph:
+# Nodes that already are what folding would replace them with, kept as long as a node that is not folded reads them
+CONSTANT_NODE_TYPES = frozenset([NodeType.VALUE, NodeType.RGB, NodeType.COMBINE_XYZ])
+
+CONSTANT_FOLDER_BY_TYPE = get_constant_folder_by_type_dict()
+
+def convert_folded_value(kind, value, to_kind):
+    if kind == to_kind:
+        return value
+    if kind == FOLD_FLOAT:
+        return (value, value, value)
+    if to_kind == FOLD_FLOAT:
+        if kind == FOLD_VECTOR:
+            return (value[0] + value[1] + value[2]) / 3.0
+        # Color to float conversion uses the scene's luminance coefficients, which we don't know here
+        return None
+    # Color and vector convert to each other unchanged
+    return value
+
+def get_unlinked_input(cycles_node, name, kind, default):
+    if kind == FOLD_FLOAT:
+        value = cycles_node.float_values.get(name)
+    elif kind == FOLD_VECTOR:
+        value = cycles_node.float3_values.get(name)
+    else:
+        value = cycles_node.float4_values.get(name)
+        if value is not None:
+            value = (value[0], value[1], value[2])
+    if value is None:
+        return default
+    return value
+
+def get_folded_outputs(cycles_node, incoming_connections, folded_outputs_by_name):
+    folder = CONSTANT_FOLDER_BY_TYPE[cycles_node.node_type]
+    linked_sockets = dict()
+    for this_connection in incoming_connections:
+        source_outputs = folded_outputs_by_name.get(this_connection.source_node)
+        if source_outputs is None or this_connection.source_socket not in source_outputs:
+            return None
+        if this_connection.dest_socket not in folder.inputs:
+            return None
+        linked_sockets[this_connection.dest_socket] = source_outputs[this_connection.source_socket]
+    inputs = dict()
+    for socket_name, (name, kind, default) in folder.inputs.items():
+        if socket_name in linked_sockets:
+            source_kind, source_value = linked_sockets[socket_name]
+            value = convert_folded_value(source_kind, source_value, kind)
+        else:
+            value = get_unlinked_input(cycles_node, name, kind, default)
+        if value is None:
+            return None
+        inputs[name] = value
+    outputs = folder.fold(cycles_node, inputs)
+    if outputs is None:
+        return None
+    # A NaN or infinity would not survive being written out and read back in as a constant
+    for kind, value in outputs.values():
+        components = (value,) if kind == FOLD_FLOAT else value
+        if not all(math.isfinite(x) for x in components):
+            return None
+    return outputs
+
+def make_constant_node(name, position, kind, value):
+    output = CyclesNode()
+    output.name = name
+    output.position = position
+    if kind == FOLD_FLOAT:
+        output.node_type = NodeType.VALUE
+        output.float_values['value'] = float(value)
+        return output, "Value"
+    elif kind == FOLD_COLOR:
+        output.node_type = NodeType.RGB
+        output.float4_values['value'] = (float(value[0]), float(value[1]), float(value[2]), 1.0)
+        return output, "Color"
+    else:
+        # An RGB node would turn into a luminance rather than an average when plugged into a float socket
+        output.node_type = NodeType.COMBINE_XYZ
+        output.float_values['x'] = float(value[0])
+        output.float_values['y'] = float(value[1])
+        output.float_values['z'] = float(value[2])
+        return output, "Vector"
+
+def fold_constant_nodes(graph):
+    incoming_by_name = dict()
+    outgoing_by_name = dict()
+    for this_connection in graph.connections:
+        incoming_by_name.setdefault(this_connection.dest_node, list()).append(this_connection)
+        outgoing_by_name.setdefault(this_connection.source_node, list()).append(this_connection)
+
+    # Visit foldable nodes in dependency order so every source is evaluated before its consumers
+    candidates = dict()
+    for this_node in graph.nodes:
+        if this_node.node_type in CONSTANT_FOLDER_BY_TYPE:
+            candidates[this_node.name] = this_node
+    pending_source_counts = dict()
+    for this_name in candidates:
+        pending_source_counts[this_name] = len(set(x.source_node for x in incoming_by_name.get(this_name, ()) if x.source_node in candidates))
+    ready_names = [x for x, count in pending_source_counts.items() if count == 0]
+    folded_outputs_by_name = dict()
+    while len(ready_names) > 0:
+        this_name = ready_names.pop()
+        outputs = get_folded_outputs(candidates[this_name], incoming_by_name.get(this_name, ()), folded_outputs_by_name)
+        if outputs is not None:
+            folded_outputs_by_name[this_name] = outputs
+        for dest_name in set(x.dest_node for x in outgoing_by_name.get(this_name, ()) if x.dest_node in candidates):
+            pending_source_counts[dest_name] -= 1
+            if pending_source_counts[dest_name] == 0:
+                ready_names.append(dest_name)
+
+    # Decide which folded nodes are removed, consumers before their sources so a source knows whether
+    # each of its consumers is still there and needs a constant node to read from
+    removed_names = set()
+    for this_name in reversed(list(folded_outputs_by_name)):
+        outgoing_connections = outgoing_by_name.get(this_name, ())
+        if len(outgoing_connections) == 0:
+            # Nothing uses it
+            continue
+        is_unlinked = len(incoming_by_name.get(this_name, ())) == 0
+        has_external_consumers = any(x.dest_node not in removed_names for x in outgoing_connections)
+        if is_unlinked and candidates[this_name].node_type in CONSTANT_NODE_TYPES and has_external_consumers:
+            # It already is the constant node folding would produce
+            continue
+        removed_names.add(this_name)
+
+    new_nodes = list()
+    # id() of a connection -> the connection that replaces it, rerouted to a constant node
+    replaced_connections = dict()
+    for this_node in graph.nodes:
+        if this_node.name not in removed_names:
+            new_nodes.append(this_node)
+            continue
+        outputs = folded_outputs_by_name[this_node.name]
+        external_connections = [x for x in outgoing_by_name.get(this_node.name, ()) if x.dest_node not in removed_names]
+        used_sockets = list()
+        for this_connection in external_connections:
+            if this_connection.source_socket not in used_sockets:
+                used_sockets.append(this_connection.source_socket)
+        for this_socket in used_sockets:
+            if len(used_sockets) == 1:
+                constant_name = this_node.name
+            else:
+                constant_name = "{0}_{1}".format(this_node.name, this_socket.lower())
+            kind, value = outputs[this_socket]
+            constant_node, constant_socket = make_constant_node(constant_name, this_node.position, kind, value)
+            new_nodes.append(constant_node)
+            for this_connection in external_connections:
+                if this_connection.source_socket == this_socket:
+                    replaced_connections[id(this_connection)] = this_connection._replace(source_node=constant_name, source_socket=constant_socket)
+    graph.nodes = new_nodes
+    # Every other connection to or from a removed node goes with it
+    connections = list()
+    for this_connection in graph.connections:
+        replacement = replaced_connections.get(id(this_connection))
+        if replacement is not None:
+            connections.append(replacement)
+        elif this_connection.source_node not in removed_names and this_connection.dest_node not in removed_names:
+            connections.append(this_connection)
+    graph.connections = connections
+    return len(removed_names)
+
+def get_topological_order(graph, incoming_by_name, outgoing_by_name):
+    pending_source_counts = dict()
+    for this_node in graph.nodes:
+        pending_source_counts[this_node.name] = len(set(x.source_node for x in incoming_by_name.get(this_node.name, ())))
+    ready_names = [x.name for x in graph.nodes if pending_source_counts[x.name] == 0]
+    ready_names.reverse()
+    output = list()
+    while len(ready_names) > 0:
+        this_name = ready_names.pop()
+        output.append(this_name)
+        for dest_name in set(x.dest_node for x in outgoing_by_name.get(this_name, ())):
+            if dest_name not in pending_source_counts:
+                continue
+            pending_source_counts[dest_name] -= 1
+            if pending_source_counts[dest_name] == 0:
+                ready_names.append(dest_name)
+    return output
+
+def get_node_values_key(cycles_node):
+    return (
+        cycles_node.node_type,
+        tuple(sorted(cycles_node.float_values.items())),
+        tuple(sorted(cycles_node.float3_values.items())),
+        tuple(sorted(cycles_node.float4_values.items())),
+        tuple(sorted(cycles_node.string_values.items())),
+        tuple(sorted(cycles_node.int_values.items())),
+    )
+
+def merge_duplicate_nodes(graph):
+    # Nodes with the same type, the same parameters and the same (already merged) inputs compute the same thing,
+    # so every duplicate is replaced by the first such node. Visiting in dependency order lets whole duplicated
+    # branches collapse in one pass.
+    incoming_by_name = dict()
+    outgoing_by_name = dict()
+    for this_connection in graph.connections:
+        incoming_by_name.setdefault(this_connection.dest_node, list()).append(this_connection)
+        outgoing_by_name.setdefault(this_connection.source_node, list()).append(this_connection)
+    nodes_by_name = dict()
+    for this_node in graph.nodes:
+        nodes_by_name[this_node.name] = this_node
+
+    canonical_names = dict()
+    names_by_key = dict()
+    for this_name in get_topological_order(graph, incoming_by_name, outgoing_by_name):
+        this_node = nodes_by_name[this_name]
+        if this_node.node_type == NodeType.MATERIAL_OUTPUT:
+            continue
+        inputs = list()
+        for this_connection in incoming_by_name.get(this_name, ()):
+            source_name = canonical_names.get(this_connection.source_node, this_connection.source_node)
+            inputs.append((this_connection.dest_socket, source_name, this_connection.source_socket))
+        inputs.sort()
+        key = (get_node_values_key(this_node), tuple(inputs))
+        if key in names_by_key:
+            canonical_names[this_name] = names_by_key[key]
+        else:
+            names_by_key[key] = this_name
+
+    if len(canonical_names) == 0:
+        return 0
+    graph.nodes = [x for x in graph.nodes if x.name not in canonical_names]
+    new_connections = list()
+    for this_connection in graph.connections:
+        if this_connection.dest_node in canonical_names:
+            continue
+        if this_connection.source_node in canonical_names:
+            this_connection = this_connection._replace(source_node=canonical_names[this_connection.source_node])
+        new_connections.append(this_connection)
+    graph.connections = new_connections
+    return len(canonical_names)
+
+def prune_unreachable_nodes(graph):
+    # Walk backwards from the active output, anything not visited can't affect the shader
+    if graph.output_node_name is None:
+        return 0
+    source_names_by_dest = dict()
+    for this_connection in graph.connections:
+        source_names_by_dest.setdefault(this_connection.dest_node, list()).append(this_connection.source_node)
+    reachable_names = set([graph.output_node_name])
+    pending_names = [graph.output_node_name]
+    while len(pending_names) > 0:
+        this_name = pending_names.pop()
+        for source_name in source_names_by_dest.get(this_name, ()):
+            if source_name not in reachable_names:
+                reachable_names.add(source_name)
+                pending_names.append(source_name)
+    node_count = len(graph.nodes)
+    graph.nodes = [x for x in graph.nodes if x.name in reachable_names]
+    graph.connections = [x for x in graph.connections if x.dest_node in reachable_names]
+    return node_count - len(graph.nodes)
+
+def get_adjacency(from_indices, to_indices, node_count):
+    # Returns offsets and targets, targets[offsets[i]:offsets[i + 1]] are the to_indices of the links from node i
+    # Two flat lists of ints rather than a list per node, large graphs would otherwise trigger many garbage collections
+    offsets = [0] * (node_count + 1)
+    for index in from_indices:
+        offsets[index + 1] += 1
+    for index in range(node_count):
+        offsets[index + 1] += offsets[index]
+    targets = [0] * len(from_indices)
+    next_slots = offsets[:-1]
+    for from_index, to_index in zip(from_indices, to_indices):
+        targets[next_slots[from_index]] = to_index
+        next_slots[from_index] += 1
+    return (offsets, targets)
+
+def order_nodes_topologically(graph):
+    # Moves every node after the nodes linked into it, otherwise keeping the original order, and sorts
+    # connections by destination. Links that close a cycle are dropped, Cycles ignores them as well.
+    # Returns the number of dropped links.
+    node_count = len(graph.nodes)
+    index_by_name = dict((x.name, index) for index, x in enumerate(graph.nodes))
+    source_indices = list()
+    dest_indices = list()
+    for this_connection in graph.connections:
+        source_index = index_by_name.get(this_connection.source_node)
+        dest_index = index_by_name.get(this_connection.dest_node)
+        if source_index is not None and dest_index is not None:
+            source_indices.append(source_index)
+            dest_indices.append(dest_index)
+    dest_offsets, dest_targets = get_adjacency(source_indices, dest_indices, node_count)
+    pending_counts = [0] * node_count
+    for dest_index in dest_indices:
+        pending_counts[dest_index] += 1
+    # Nodes whose sources are all placed, taken lowest original index first
+    ready_indices = [index for index, count in enumerate(pending_counts) if count == 0]
+    heapify(ready_indices)
+    placed = [False] * node_count
+    order = list()
+    next_unplaced = 0
+    source_offsets = None
+    while len(order) < node_count:
+        if len(ready_indices) == 0:
+            # Every remaining node waits on a cycle. Each of them has an unplaced source, so following those
+            # from the first remaining node must come back around, and the first node seen twice is on a cycle.
+            # It is placed next and its links from unplaced nodes are dropped.
+            if source_offsets is None:
+                source_offsets, source_targets = get_adjacency(dest_indices, source_indices, node_count)
+            while placed[next_unplaced]:
+                next_unplaced += 1
+            index = next_unplaced
+            visited = set()
+            while index not in visited:
+                visited.add(index)
+                index = next(x for x in source_targets[source_offsets[index]:source_offsets[index + 1]] if not placed[x])
+            pending_counts[index] = 0
+            ready_indices.append(index)
+        index = heappop(ready_indices)
+        placed[index] = True
+        order.append(index)
+        for dest_index in dest_targets[dest_offsets[index]:dest_offsets[index + 1]]:
+            pending_counts[dest_index] -= 1
+            if pending_counts[dest_index] == 0:
+                heappush(ready_indices, dest_index)
+    graph.nodes = [graph.nodes[x] for x in order]
+    connection_count = len(graph.connections)
+    position_by_name = dict((x.name, position) for position, x in enumerate(graph.nodes))
+    graph.connections = [x for x in graph.connections if position_by_name.get(x.source_node, node_count) < position_by_name.get(x.dest_node, -1)]
+    # Stable, so the links into one node keep their order
+    graph.connections.sort(key=lambda x: position_by_name[x.dest_node])
+    graph.header_fields["order"] = "topological"
+    return connection_count - len(graph.connections)
+
+# Values this close to the default are left out of sparse files, they are written as the default's text anyway
+SPARSE_TOLERANCE = 0.00005
+
+def is_default_value(value, default):
+    if isinstance(default, tuple):
+        # Only the first three components of float4 values are written
+        if not isinstance(value, tuple):
+            return False
+        return abs(value[0] - default[0]) < SPARSE_TOLERANCE and abs(value[1] - default[1]) < SPARSE_TOLERANCE and abs(value[2] - default[2]) < SPARSE_TOLERANCE
+    if isinstance(default, float):
+        return not isinstance(value, tuple) and abs(value - default) < SPARSE_TOLERANCE
+    return value == default
+
+def get_sparse_values(values, default_values):
+    # Returns values without the entries equal to their default, values itself if there are none
+    sparse_values = {name: value for name, value in values.items() if name not in default_values or not is_default_value(value, default_values[name])}
+    if len(sparse_values) == len(values):
+        return values
+    return sparse_values
+
+def omit_default_values(graph):
+    # Leaves out every value equal to DEFAULT_VALUES, loaders fill them back in
+    # Returns the number of values left out
+    # cyclesmax_defaults.py is not part of the add-on itself, it must be importable from where this script is run
+    import cyclesmax_defaults
+    graph.header_fields["defaults"] = cyclesmax_defaults.DEFAULTS_VERSION
+    omitted_count = 0
+    for this_node in graph.nodes:
+        default_values = cyclesmax_defaults.DEFAULT_VALUES.get(this_node.node_type.value)
+        if default_values is None:
+            continue
+        value_count = len(this_node.float_values) + len(this_node.float3_values) + len(this_node.float4_values) + len(this_node.int_values)
+        # New dicts rather than deleting entries, nodes can share EMPTY_VALUES and copied nodes their value dicts
+        this_node.float_values = get_sparse_values(this_node.float_values, default_values)
+        this_node.float3_values = get_sparse_values(this_node.float3_values, default_values)
+        this_node.float4_values = get_sparse_values(this_node.float4_values, default_values)
+        this_node.int_values = get_sparse_values(this_node.int_values, default_values)
+        compact_cycles_node(this_node)
+        omitted_count += value_count - len(this_node.float_values) - len(this_node.float3_values) - len(this_node.float4_values) - len(this_node.int_values)
+    return omitted_count
+
+# Node groups
+# Group nodes are flattened into the exported graph. The contents of each group datablock are
+# converted once per export into a NodeGroupTemplate, which is then copied for every instance
+# with the instance's internal name as a prefix so node names stay unique.
+
+class SocketTarget:
+    def __init__(self, node_name, socket_name, export_name, socket_type):
+        self.node_name = node_name
+        self.socket_name = socket_name
+        # Name of the parameter holding the socket's value when it is not linked, None if it has none
+        self.export_name = export_name
+        self.socket_type = socket_type
+
+class NodeGroupTemplate:
     def __init__(self):
-        self.graph_string = ""
+        self.nodes = list()
+        self.connections = list()
+        # Max texture slots depend on the material, so only the image filename is kept here
+        self.image_filenames = dict()
+        self.images_by_filename = dict()
+        # Group input identifier -> list of SocketTarget the input feeds
+        self.input_targets = dict()
+        # Group output identifier -> (node name, socket name) feeding that output
+        self.output_sources = dict()
+        # Group output identifier -> identifier of a group input wired straight to it
+        self.output_passthroughs = dict()
         self.unsupported_types = set()
         self.incompatible_types = set()
+        self.baked_curve_count = 0
+        self.max_curve_deviation = 0.0
 
-def serialize_node_graph(node_tree):
-    output = SerializedNodeGraph()
+class NodeGroupCache:
+    def __init__(self, stats=None, curve_baker=None):
+        self.templates = dict()
+        self.fingerprints = dict()
+        self.stats = stats
+        self.curve_baker = curve_baker
 
-    type_by_idname = get_type_by_idname_dict()
-    node_names_by_bname = dict()
-    nodes_by_name = dict()
-    connections = list()
+    def get_template(self, node_tree):
+        # Keyed by pointer rather than name, linked libraries can have groups with the same name
+        key = node_tree.as_pointer()
+        template = self.templates.get(key)
+        if template is None:
+            template = convert_node_group(node_tree, self, self.stats)
+            self.templates[key] = template
+        return template
 
-    max_tex_manager = MaxTexManager()
+class ConvertedTreeNodes:
+    def __init__(self):
+        self.names_by_bname = dict()
+        # Blender name of a group node -> (template, prefix of its copied nodes)
+        self.instances_by_bname = dict()
+        self.image_filenames = dict()
+        # Blender name of a reroute or muted node -> the node, links through them are followed to their real source
+        self.passthroughs_by_bname = dict()
+        # (Blender node name, output identifier) of a passthrough output -> what get_link_source returns for it
+        self.resolved_sources = dict()
+
+def copy_cycles_node(cycles_node, name):
+    output = CyclesNode()
+    output.name = name
+    output.node_type = cycles_node.node_type
+    output.position = cycles_node.position
+    output.float_values = dict(cycles_node.float_values)
+    output.float3_values = dict(cycles_node.float3_values)
+    output.float4_values = dict(cycles_node.float4_values)
+    output.string_values = dict(cycles_node.string_values)
+    output.int_values = dict(cycles_node.int_values)
+    return output
+
+def convert_socket_value(value, from_type, to_type):
+    if from_type == to_type:
+        return value
+    if from_type == "VALUE":
+        return (value, value, value, 1.0)
+    if to_type == "VALUE":
+        if from_type == "RGBA":
+            # Luminance weights of Blender's default color management config
+            return 0.2126 * value[0] + 0.7152 * value[1] + 0.0722 * value[2]
+        return (value[0] + value[1] + value[2]) / 3.0
+    return (value[0], value[1], value[2], 1.0)
+
+def node_inputs_with_values(node):
+    for input_socket in node.inputs:
+        if input_socket.type in ("VALUE", "RGBA", "VECTOR"):
+            yield input_socket
+
+def add_group_instance(output, converted, group_node, prefix, template, max_tex_manager):
+    offset = get_node_position(group_node)
+    copied_nodes_by_name = dict()
+    for this_node in template.nodes:
+        copied_node = copy_cycles_node(this_node, prefix + this_node.name)
+        copied_node.position = (this_node.position[0] + offset[0], this_node.position[1] + offset[1])
+        if this_node.name in template.image_filenames:
+            filename = template.image_filenames[this_node.name]
+            copied_node.int_values['slot'] = get_max_tex_slot(max_tex_manager, filename)
+            max_tex_manager.add_image(filename, template.images_by_filename.get(filename))
+            converted.image_filenames[copied_node.name] = filename
+        copied_nodes_by_name[copied_node.name] = copied_node
+        output.nodes.append(copied_node)
+    for this_connection in template.connections:
+        output.connections.append(CyclesConnection(prefix + this_connection.source_node, this_connection.source_socket, prefix + this_connection.dest_node, this_connection.dest_socket))
+    # Values set on the group node replace the defaults inside the group, linked inputs are connected later
+    for input_socket in node_inputs_with_values(group_node):
+        for this_target in template.input_targets.get(input_socket.identifier, ()):
+            if this_target.export_name is None:
+                continue
+            value = convert_socket_value(input_socket.default_value, input_socket.type, this_target.socket_type)
+            set_socket_value(copied_nodes_by_name[prefix + this_target.node_name], this_target.export_name, this_target.socket_type, value)
+    for copied_node in copied_nodes_by_name.values():
+        compact_cycles_node(copied_node)
+    output.unsupported_types.update(template.unsupported_types)
+    output.incompatible_types.update(template.incompatible_types)
+    output.baked_curve_count += template.baked_curve_count
+    output.max_curve_deviation = max(output.max_curve_deviation, template.max_curve_deviation)
 
+def add_tree_nodes(node_tree, output, max_tex_manager, group_cache, stats=None):
+    converted = ConvertedTreeNodes()
+    positions = get_node_positions(node_tree.nodes)
     next_node_index = 0
     for this_node in node_tree.nodes:
         next_node_index += 1
         internal_name = "node" + str(next_node_index)
-        converted_node = get_cycles_node(type_by_idname, internal_name, this_node, max_tex_manager)
+        position = positions[next_node_index - 1]
+        if this_node.bl_idname == "NodeReroute" or this_node.mute:
+            # Not exported, Cycles connects whatever is linked into them straight through
+            converted.passthroughs_by_bname[this_node.name] = this_node
+            continue
+        if this_node.bl_idname == "ShaderNodeGroup":
+            if this_node.node_tree is not None:
+                prefix = internal_name + "_"
+                template = group_cache.get_template(this_node.node_tree)
+                add_group_instance(output, converted, this_node, prefix, template, max_tex_manager)
+                converted.instances_by_bname[this_node.name] = (template, prefix)
+            continue
+        if this_node.bl_idname in ("NodeGroupInput", "NodeGroupOutput"):
+            continue
+        if stats is None:
+            converted_node = get_cycles_node(internal_name, this_node, max_tex_manager, position=position)
+        else:
+            start_time = time.perf_counter()
+            converted_node = get_cycles_node(internal_name, this_node, max_tex_manager, stats, position)
+            stats.add_node(converted_node.node_type, time.perf_counter() - start_time)
         if converted_node.node_type == NodeType.INCOMPATIBLE:
             output.incompatible_types.add(this_node.bl_idname)
         elif converted_node.node_type != NodeType.INVALID:
-            node_names_by_bname[this_node.name] = internal_name
-            nodes_by_name[internal_name] = converted_node
+            converted.names_by_bname[this_node.name] = internal_name
+            output.nodes.append(converted_node)
+            if group_cache.curve_baker is not None:
+                deviation = group_cache.curve_baker.bake(this_node, converted_node)
+                if deviation is not None:
+                    output.baked_curve_count += 1
+                    output.max_curve_deviation = max(output.max_curve_deviation, deviation)
+            if converted_node.node_type == NodeType.MAX_TEX:
+                converted.image_filenames[internal_name] = get_image_filename(this_node)
+            compact_cycles_node(converted_node)
         else:
             output.unsupported_types.add(this_node.bl_idname)
+    return converted
 
-    for this_link in node_tree.links:
-        if this_link.is_valid:
-            converted_link = get_cycles_connection(node_names_by_bname, this_link)
-            if converted_link.is_valid:
-                connections.append(converted_link.connection)
+def get_link_source(link, converted, links_by_dest):
+    # Returns (node name, socket name), (None, group input identifier) or None if the source wasn't exported
+    source_node = link.from_node
+    if source_node.name in converted.names_by_bname:
+        return (converted.names_by_bname[source_node.name], get_source_socket_name(source_node, link.from_socket))
+    if source_node.name in converted.passthroughs_by_bname:
+        return get_passthrough_source(link, converted, links_by_dest)
+    if source_node.bl_idname == "NodeGroupInput":
+        return (None, link.from_socket.identifier)
+    instance = converted.instances_by_bname.get(source_node.name)
+    if instance is None:
+        return None
+    template, prefix = instance
+    identifier = link.from_socket.identifier
+    if identifier in template.output_sources:
+        node_name, socket_name = template.output_sources[identifier]
+        return (prefix + node_name, socket_name)
+    if identifier in template.output_passthroughs:
+        # Continue from whatever is linked to the matching input of the group node
+        outer_link = links_by_dest.get((source_node.name, template.output_passthroughs[identifier]))
+        if outer_link is not None:
+            return get_link_source(outer_link, converted, links_by_dest)
+    return None
 
+def get_passthrough_input(node, output_socket):
+    # Returns the input a reroute or muted node passes on to output_socket, None if it passes nothing
+    if node.bl_idname == "NodeReroute":
+        return node.inputs[0]
+    for this_link in node.internal_links:
+        if this_link.to_socket.identifier == output_socket.identifier:
+            return this_link.from_socket
+    return None
 
-    output_list = list()
+def get_passthrough_source(link, converted, links_by_dest):
+    # Follows a chain of reroutes and muted nodes back to the first other node. Every output on the way
+    # remembers the result, so each chain is only followed once however often its outputs are linked.
+    resolved_keys = list()
+    source = None
+    while True:
+        source_node = link.from_node
+        key = (source_node.name, link.from_socket.identifier)
+        if key in converted.resolved_sources:
+            # Also ends a chain that loops back on itself, outputs on the way are None until it is resolved
+            source = converted.resolved_sources[key]
+            break
+        if source_node.name not in converted.passthroughs_by_bname:
+            source = get_link_source(link, converted, links_by_dest)
+            break
+        converted.resolved_sources[key] = None
+        resolved_keys.append(key)
+        input_socket = get_passthrough_input(source_node, link.from_socket)
+        if input_socket is None:
+            break
+        link = links_by_dest.get((source_node.name, input_socket.identifier))
+        if link is None:
+            break
+    for key in resolved_keys:
+        converted.resolved_sources[key] = source
+    return source
 
-    output_list.append("cycles_shader")
-    output_list.append("1")
-    
-    output_list.append("section_nodes")
-    for cycles_node in nodes_by_name.values():
-        add_node_strings(output_list, cycles_node)
-
-    output_list.append("section_connections")
-    for this_connection in connections:
-        output_list.append(this_connection.source_node)
-        output_list.append(this_connection.source_socket)
-        output_list.append(this_connection.dest_node)
-        output_list.append(this_connection.dest_socket)
-
-    output.graph_string = ("|".join(output_list) + "|")
+def get_link_targets(link, converted):
+    dest_node = link.to_node
+    if dest_node.name in converted.names_by_bname:
+        converter = CONVERTER_BY_IDNAME.get(dest_node.bl_idname)
+        export_name = None
+        if converter is not None:
+            export_name = converter.copy_sockets.get(link.to_socket.identifier)
+        dest_name = converted.names_by_bname[dest_node.name]
+        return [SocketTarget(dest_name, get_dest_socket_name(dest_node, link.to_socket), export_name, link.to_socket.type)]
+    instance = converted.instances_by_bname.get(dest_node.name)
+    if instance is None:
+        return list()
+    template, prefix = instance
+    output = list()
+    for this_target in template.input_targets.get(link.to_socket.identifier, ()):
+        output.append(SocketTarget(prefix + this_target.node_name, this_target.socket_name, this_target.export_name, this_target.socket_type))
     return output
 
-class ExportCyclesMaxShader(bpy.types.Operator, ExportHelper):
-    """Cycles for Max Shader Exporter"""
-    bl_idname = "export_shader.cyclesmax"
-    bl_label = "Export Cycles for Max Shader"
+def add_tree_connections(node_tree, converted, output, template=None, group_output_node=None):
+    valid_links = [x for x in node_tree.links if x.is_valid]
+    # Only group passthroughs, reroutes and muted nodes need to look up links by destination
+    links_by_dest = dict()
+    if len(converted.instances_by_bname) > 0 or len(converted.passthroughs_by_bname) > 0:
+        for this_link in valid_links:
+            links_by_dest[(this_link.to_node.name, this_link.to_socket.identifier)] = this_link
+    names_by_bname = converted.names_by_bname
+    connections = output.connections
+    for this_link in valid_links:
+        # Most links join two exported nodes, convert those straight from the rename table
+        from_node = this_link.from_node
+        to_node = this_link.to_node
+        source_name = names_by_bname.get(from_node.name)
+        dest_name = names_by_bname.get(to_node.name)
+        if source_name is not None and dest_name is not None:
+            connections.append(CyclesConnection(
+                source_name, get_source_socket_name(from_node, this_link.from_socket),
+                dest_name, get_dest_socket_name(to_node, this_link.to_socket)))
+            continue
+        source = get_link_source(this_link, converted, links_by_dest)
+        if source is None:
+            continue
+        source_name, source_socket = source
+        if source_name is None and template is None:
+            continue
+        if group_output_node is not None and this_link.to_node.name == group_output_node.name:
+            if source_name is None:
+                template.output_passthroughs[this_link.to_socket.identifier] = source_socket
+            else:
+                template.output_sources[this_link.to_socket.identifier] = source
+            continue
+        for this_target in get_link_targets(this_link, converted):
+            if source_name is None:
+                template.input_targets.setdefault(source_socket, list()).append(this_target)
+                continue
+            connections.append(CyclesConnection(source_name, source_socket, this_target.node_name, this_target.socket_name))
 
-    filename_ext = ".shader"
-    filter_glob: StringProperty(
-            default="*.shader",
-            options={'HIDDEN'},
-            )
+def get_active_group_output(node_tree):
+    output = None
+    for this_node in node_tree.nodes:
+        if this_node.bl_idname == "NodeGroupOutput":
+            if this_node.is_active_output:
+                return this_node
+            if output is None:
+                output = this_node
+    return output
 
-    def execute(self, context):
-        if context.scene.render.engine != 'CYCLES' and context.scene.render.engine != 'BLENDER_EEVEE':
-            self.report({'ERROR'}, "Shader export is only compatible with Cycles or Eevee.")
-            return {'FINISHED'}
+def convert_node_group(node_tree, group_cache, stats=None):
+    template = NodeGroupTemplate()
+    # Slots assigned here are replaced when the template is instanced
+    max_tex_manager = MaxTexManager()
+    converted = add_tree_nodes(node_tree, template, max_tex_manager, group_cache, stats)
+    template.image_filenames = converted.image_filenames
+    template.images_by_filename = max_tex_manager.images_by_filename
+    add_tree_connections(node_tree, converted, template, template, get_active_group_output(node_tree))
+    return template
+
+def read_node_graph(node_tree, options, group_cache, stats=None, texture_hasher=None):
+    # Everything that reads Blender data, so this has to run on the main thread. The graph it returns
+    # is plain Python data that finish_node_graph can process on any thread.
+    output = SerializedNodeGraph()
+    max_tex_manager = MaxTexManager(texture_hasher if options.texture_manifest else None)
+    with stats_phase(stats, "convert_nodes"):
+        converted = add_tree_nodes(node_tree, output, max_tex_manager, group_cache, stats)
+    if options.texture_manifest:
+        output.max_tex_manager = max_tex_manager
+
+    active_output_node = node_tree.get_output_node('CYCLES')
+    if active_output_node is not None:
+        output.output_node_name = converted.names_by_bname.get(active_output_node.name)
+
+    with stats_phase(stats, "connections"):
+        add_tree_connections(node_tree, converted, output)
+    return output
+
+def finish_node_graph(graph, options, stats=None):
+    # Runs the optional passes, none of which read Blender data
+    if graph.max_tex_manager is not None:
+        # Before the other passes, so merge_duplicates sees image nodes that now share a slot
+        with stats_phase(stats, "texture_manifest"):
+            graph.texture_manifest = merge_texture_slots(graph, graph.max_tex_manager)
+        graph.max_tex_manager = None
+    if options.fold_constants:
+        with stats_phase(stats, "fold_constants"):
+            graph.folded_node_count = fold_constant_nodes(graph)
+    if options.merge_duplicates:
+        with stats_phase(stats, "merge_duplicates"):
+            graph.merged_node_count = merge_duplicate_nodes(graph)
+    if options.prune_unreachable:
+        with stats_phase(stats, "prune_unreachable"):
+            graph.pruned_node_count = prune_unreachable_nodes(graph)
+    if options.topological_order:
+        with stats_phase(stats, "topological_order"):
+            graph.dropped_link_count = order_nodes_topologically(graph)
+    # Last, the other passes expect every value to be present. The binary encoding has no header fields to mark a sparse file.
+    if options.sparse_defaults and not options.binary_format:
+        with stats_phase(stats, "sparse_defaults"):
+            graph.omitted_value_count = omit_default_values(graph)
+    return graph
+
+def serialize_node_graph(node_tree, options=None, group_cache=None, stats=None, texture_hasher=None):
+    if options is None:
+        options = ExportOptions()
+    if group_cache is None:
+        group_cache = NodeGroupCache(stats, get_curve_baker(options))
+    owns_texture_hasher = False
+    if options.texture_manifest and texture_hasher is None:
+        texture_hasher = TextureHasher()
+        owns_texture_hasher = True
+    output = read_node_graph(node_tree, options, group_cache, stats, texture_hasher)
+    finish_node_graph(output, options, stats)
+    if owns_texture_hasher:
+        texture_hasher.close()
+    return output
+
+def graph_from_shader_graph(shader_graph):
+    # Converts a cyclesmax_reader.ShaderGraph, read from a text or binary .shader file, back into a graph that
+    # finish_node_graph and write_shader_file accept. None of this needs Blender.
+    output = SerializedNodeGraph()
+    for this_record in shader_graph.nodes:
+        try:
+            node_type = NodeType(this_record.node_type)
+        except ValueError:
+            raise ValueError("Unknown node type '{0}' for node '{1}'".format(this_record.node_type, this_record.name))
+        cycles_node = CyclesNode()
+        cycles_node.name = this_record.name
+        cycles_node.node_type = node_type
+        # Written the same way get_node_positions produces them, a whole number x and a float y
+        cycles_node.position = (floor(this_record.position[0]), -1.0 * floor(-this_record.position[1]))
+        cycles_node.float_values = dict(this_record.float_values)
+        cycles_node.float3_values = dict(this_record.float3_values)
+        cycles_node.float4_values = dict(this_record.float4_values)
+        cycles_node.string_values = dict(this_record.string_values)
+        cycles_node.int_values = dict(this_record.int_values)
+        compact_cycles_node(cycles_node)
+        output.nodes.append(cycles_node)
+        # Files do not record which output was active, so the first one is used
+        if node_type == NodeType.MATERIAL_OUTPUT and output.output_node_name is None:
+            output.output_node_name = this_record.name
+    for this_record in shader_graph.connections:
+        output.connections.append(CyclesConnection(this_record.source_node, this_record.source_socket, this_record.dest_node, this_record.dest_socket))
+    return output
+
+@contextmanager
+def atomic_open(filepath, mode="w"):
+    # Write to a temporary file in the same directory and rename it over the target once complete,
+    # so readers never see a partially written file
+    temp_path = "{0}.{1}-{2}.tmp".format(filepath, os.getpid(), threading.get_ident())
+    try:
+        with open(temp_path, mode) as output_file:
+            yield output_file
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class TimedFile:
+    # Adds the time spent inside write() to a stats phase, so formatting and file IO can be told apart
+    def __init__(self, output_file, stats, phase_name):
+        self.output_file = output_file
+        self.stats = stats
+        self.phase_name = phase_name
+
+    def write(self, data):
+        start_time = time.perf_counter()
+        self.output_file.write(data)
+        self.stats.add_phase_seconds(self.phase_name, time.perf_counter() - start_time)
+
+def write_strings(output_file, strings, chunk_size=4096):
+    # Join a bounded number of strings at a time so memory use doesn't grow with the graph
+    chunk = list()
+    for this_string in strings:
+        chunk.append(this_string)
+        if len(chunk) >= chunk_size:
+            chunk.append("")
+            output_file.write("|".join(chunk))
+            chunk.clear()
+    if len(chunk) > 0:
+        chunk.append("")
+        output_file.write("|".join(chunk))
 
-        found_shader = False
+# Bump this whenever a change to the exporter changes the output for an unchanged material,
+# so that cached exports from older versions are not reused
+EXPORT_CACHE_VERSION = 4
+EXPORT_CACHE_FILENAME = "shader_cache.json"
+EXPORT_STATS_FILENAME = "export_stats.json"
 
-        for this_object in context.selected_objects:
-            if this_object.active_material is None:
+def get_fingerprint_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    try:
+        return tuple(value)
+    except TypeError:
+        return str(value)
+
+def get_base_node_property_names():
+    # Properties every shader node has are UI state (select, width, hide...) and don't change the export
+    return set(bpy.types.ShaderNode.bl_rna.properties.keys())
+
+CURVE_MAPPING_FINGERPRINT_PROPERTIES = ("use_clip", "clip_min_x", "clip_min_y", "clip_max_x", "clip_max_y", "extend")
+
+def add_node_fingerprint(hasher, node, base_property_names, group_cache):
+    items = list()
+    items.append(node.bl_idname)
+    items.append(node.name)
+    items.append(get_fingerprint_value(node.location))
+    # A base property, but muting a node changes the export
+    items.append(node.mute)
+    for this_property in node.bl_rna.properties:
+        if this_property.identifier in base_property_names:
+            continue
+        if this_property.type in ('ENUM', 'BOOLEAN', 'INT', 'FLOAT', 'STRING'):
+            items.append(this_property.identifier)
+            items.append(get_fingerprint_value(getattr(node, this_property.identifier)))
+    for input_socket in node.inputs:
+        items.append(input_socket.identifier)
+        items.append(get_fingerprint_value(getattr(input_socket, "default_value", None)))
+    for output_socket in node.outputs:
+        items.append(output_socket.identifier)
+        items.append(get_fingerprint_value(getattr(output_socket, "default_value", None)))
+    # Pointer properties that feed the export are not covered by the loop above
+    node_type = TYPE_BY_IDNAME.get(node.bl_idname)
+    if node_type == NodeType.RGB_CURVES:
+        # Clipping and extension change what mapping.evaluate() returns to the curve baker
+        for name in CURVE_MAPPING_FINGERPRINT_PROPERTIES:
+            items.append(get_fingerprint_value(getattr(node.mapping, name)))
+        for this_curve in node.mapping.curves:
+            items.append("curve")
+            for this_point in this_curve.points:
+                items.append(get_fingerprint_value(this_point.location))
+                items.append(this_point.handle_type)
+    elif node_type == NodeType.COLOR_RAMP:
+        items.append(node.color_ramp.interpolation)
+        items.append(node.color_ramp.color_mode)
+        items.append(node.color_ramp.hue_interpolation)
+        for this_element in node.color_ramp.elements:
+            items.append(this_element.position)
+            items.append(get_fingerprint_value(this_element.color))
+            items.append(this_element.alpha)
+    elif node.bl_idname == "ShaderNodeTexImage":
+        if node.image is None:
+            items.append(None)
+        else:
+            items.append(node.image.filepath)
+    elif node.bl_idname == "ShaderNodeGroup":
+        if node.node_tree is None:
+            items.append(None)
+        else:
+            items.append(get_node_group_fingerprint(node.node_tree, base_property_names, group_cache))
+    hasher.update(repr(items).encode("utf-8"))
+
+def add_node_tree_fingerprint(hasher, node_tree, base_property_names, group_cache):
+    for this_node in node_tree.nodes:
+        add_node_fingerprint(hasher, this_node, base_property_names, group_cache)
+    for this_link in node_tree.links:
+        link_items = (
+            this_link.from_node.name,
+            this_link.from_socket.identifier,
+            this_link.to_node.name,
+            this_link.to_socket.identifier,
+            this_link.is_valid,
+        )
+        hasher.update(repr(link_items).encode("utf-8"))
+
+def get_node_group_fingerprint(node_tree, base_property_names, group_cache):
+    # Each group is hashed once per export no matter how many materials use it
+    key = node_tree.as_pointer()
+    fingerprint = group_cache.fingerprints.get(key)
+    if fingerprint is None:
+        hasher = hashlib.sha1()
+        add_node_tree_fingerprint(hasher, node_tree, base_property_names, group_cache)
+        fingerprint = hasher.hexdigest()
+        group_cache.fingerprints[key] = fingerprint
+    return fingerprint
+
+def get_node_tree_fingerprint(node_tree, options, group_cache=None):
+    if group_cache is None:
+        group_cache = NodeGroupCache()
+    hasher = hashlib.sha1()
+    hasher.update("cycles_shader_export/{0}/{1}/{2}".format(EXPORT_CACHE_VERSION, bl_info["version"], options.get_cache_key()).encode("utf-8"))
+    add_node_tree_fingerprint(hasher, node_tree, get_base_node_property_names(), group_cache)
+    return hasher.hexdigest()
+
+class ExportCache:
+    def __init__(self, output_dir):
+        self.manifest_path = os.path.join(output_dir, EXPORT_CACHE_FILENAME)
+        self.old_entries = dict()
+        self.new_entries = dict()
+
+    def load(self):
+        if not os.path.isfile(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except ValueError:
+            # A damaged manifest just means everything gets exported again
+            return
+        if manifest.get("version") != EXPORT_CACHE_VERSION:
+            return
+        self.old_entries = manifest.get("entries", dict())
+
+    def is_current(self, filepath, fingerprint):
+        filename = os.path.basename(filepath)
+        if filename not in self.old_entries:
+            return False
+        if self.old_entries[filename]["fingerprint"] != fingerprint:
+            return False
+        return os.path.isfile(filepath)
+
+    def update(self, filepath, material_name, fingerprint):
+        entry = dict()
+        entry["material"] = material_name
+        entry["fingerprint"] = fingerprint
+        self.new_entries[os.path.basename(filepath)] = entry
+
+    def save(self):
+        # Entries for materials that no longer exist are dropped here
+        manifest = dict()
+        manifest["version"] = EXPORT_CACHE_VERSION
+        manifest["entries"] = self.new_entries
+        with atomic_open(self.manifest_path) as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+def get_material_node_tree(material):
+    if material is None:
+        return None
+    if material.node_tree is None:
+        return None
+    if len(material.node_tree.nodes) == 0:
+        return None
+    return material.node_tree
+
+def write_shader_file(filepath, serialized_graph, binary_format=False, stats=None):
+    # The write phase includes formatting, file_write is only the time spent writing to the file
+    with stats_phase(stats, "write"):
+        with atomic_open(filepath, "wb" if binary_format else "w") as output_file:
+            if stats is not None:
+                output_file = TimedFile(output_file, stats, "file_write")
+            if binary_format:
+                output_file.write(serialized_graph.get_graph_bytes())
+            else:
+                write_strings(output_file, serialized_graph.iter_strings())
+
+TEXTURE_MANIFEST_VERSION = 1
+
+def get_texture_manifest_filepath(filepath):
+    return os.path.splitext(filepath)[0] + ".textures.json"
+
+def write_texture_manifest(filepath, entries):
+    manifest = dict()
+    manifest["version"] = TEXTURE_MANIFEST_VERSION
+    manifest["textures"] = entries
+    with atomic_open(filepath) as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+def update_bundle_texture_manifest(filepath, entries_by_material, material_names):
+    # A bundle keeps one manifest for all its materials, only the exported ones are replaced
+    # and the ones not in material_names are dropped
+    manifest = dict()
+    if os.path.isfile(filepath):
+        try:
+            with open(filepath, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except ValueError:
+            manifest = dict()
+    if manifest.get("version") != TEXTURE_MANIFEST_VERSION:
+        manifest = dict()
+    materials = dict((name, entries) for name, entries in manifest.get("materials", dict()).items() if name in material_names)
+    materials.update(entries_by_material)
+    manifest["version"] = TEXTURE_MANIFEST_VERSION
+    manifest["materials"] = materials
+    with atomic_open(filepath) as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+class MaterialExportResult:
+    def __init__(self):
+        self.material_name = ""
+        self.filepath = ""
+        self.seconds = 0.0
+        self.skipped = False
+        self.pruned_node_count = 0
+        self.folded_node_count = 0
+        self.merged_node_count = 0
+        self.baked_curve_count = 0
+        self.max_curve_deviation = 0.0
+        self.merged_texture_count = 0
+        self.omitted_value_count = 0
+        self.dropped_link_count = 0
+        self.unsupported_types = set()
+        self.incompatible_types = set()
+
+    def set_graph_info(self, serialized_graph):
+        self.pruned_node_count = serialized_graph.pruned_node_count
+        self.folded_node_count = serialized_graph.folded_node_count
+        self.merged_node_count = serialized_graph.merged_node_count
+        self.baked_curve_count = serialized_graph.baked_curve_count
+        self.max_curve_deviation = serialized_graph.max_curve_deviation
+        self.merged_texture_count = serialized_graph.merged_texture_count
+        self.omitted_value_count = serialized_graph.omitted_value_count
+        self.dropped_link_count = serialized_graph.dropped_link_count
+        self.unsupported_types = serialized_graph.unsupported_types
+        self.incompatible_types = serialized_graph.incompatible_types
+
+    def to_dict(self):
+        output = dict()
+        output["material"] = self.material_name
+        output["filepath"] = self.filepath
+        output["seconds"] = self.seconds
+        output["skipped"] = self.skipped
+        output["pruned_nodes"] = self.pruned_node_count
+        output["folded_nodes"] = self.folded_node_count
+        output["merged_nodes"] = self.merged_node_count
+        output["baked_curves"] = self.baked_curve_count
+        output["max_curve_deviation"] = self.max_curve_deviation
+        output["merged_textures"] = self.merged_texture_count
+        output["omitted_values"] = self.omitted_value_count
+        output["dropped_links"] = self.dropped_link_count
+        output["unsupported_types"] = sorted(self.unsupported_types)
+        output["incompatible_types"] = sorted(self.incompatible_types)
+        return output
+
+def get_stats_filepath(filepath):
+    if os.path.isdir(filepath):
+        return os.path.join(filepath, EXPORT_STATS_FILENAME)
+    return os.path.splitext(filepath)[0] + ".stats.json"
+
+def get_unique_filename(material_name, used_filenames):
+    base_name = bpy.path.clean_name(material_name)
+    filename = base_name + ".shader"
+    suffix = 1
+    # Cleaning can map several material names onto the same file name
+    while filename.lower() in used_filenames:
+        suffix += 1
+        filename = "{0}_{1}.shader".format(base_name, suffix)
+    used_filenames.add(filename.lower())
+    return filename
+
+def iter_exportable_materials():
+    for this_material in bpy.data.materials:
+        this_node_tree = get_material_node_tree(this_material)
+        if this_node_tree is not None:
+            yield this_material, this_node_tree
+
+DEFAULT_THREAD_COUNT = min(4, os.cpu_count() or 1)
+
+class ExportPipeline:
+    # Runs the part of an export that doesn't read Blender data (passes, formatting, compression and writing) on
+    # a thread pool, while the calling thread reads the next material. At most max_pending materials are queued
+    # so memory stays bounded. Each done callback is called on the calling thread, in the order work was submitted.
+    # With a thread_count of 0 everything runs on the calling thread as it is submitted.
+    def __init__(self, thread_count=DEFAULT_THREAD_COUNT, max_pending=None):
+        self.executor = None
+        if thread_count > 0:
+            self.executor = ThreadPoolExecutor(max_workers=thread_count)
+        self.max_pending = 2 * thread_count if max_pending is None else max_pending
+        self.pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.finish()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+
+    def submit(self, work, *args, done=None):
+        if self.executor is None:
+            result = work(*args)
+            if done is not None:
+                done(result)
+            return
+        self.pending.append((self.executor.submit(work, *args), done))
+        while len(self.pending) > self.max_pending:
+            self.finish_oldest()
+
+    def finish_oldest(self):
+        future, done = self.pending.popleft()
+        # Raises whatever the work raised
+        result = future.result()
+        if done is not None:
+            done(result)
+
+    def finish(self):
+        while len(self.pending) > 0:
+            self.finish_oldest()
+
+def write_material_file(result, serialized_graph, options, stats):
+    start_time = time.perf_counter()
+    finish_node_graph(serialized_graph, options, stats)
+    write_shader_file(result.filepath, serialized_graph, options.binary_format, stats)
+    if serialized_graph.texture_manifest is not None:
+        write_texture_manifest(get_texture_manifest_filepath(result.filepath), serialized_graph.texture_manifest)
+    result.set_graph_info(serialized_graph)
+    result.seconds += time.perf_counter() - start_time
+
+def export_all_materials(output_dir, options, use_cache=True, stats=None, thread_count=DEFAULT_THREAD_COUNT):
+    os.makedirs(output_dir, exist_ok=True)
+    export_cache = ExportCache(output_dir)
+    if use_cache:
+        export_cache.load()
+    results = list()
+    used_filenames = set()
+    group_cache = NodeGroupCache(stats, get_curve_baker(options))
+    texture_hasher = TextureHasher() if options.texture_manifest else None
+    with ExportPipeline(thread_count) as pipeline:
+        for this_material, this_node_tree in iter_exportable_materials():
+            start_time = time.perf_counter()
+            result = MaterialExportResult()
+            result.material_name = this_material.name
+            result.filepath = os.path.join(output_dir, get_unique_filename(this_material.name, used_filenames))
+            results.append(result)
+            with stats_phase(stats, "fingerprint"):
+                fingerprint = get_node_tree_fingerprint(this_node_tree, options, group_cache)
+            export_cache.update(result.filepath, this_material.name, fingerprint)
+            if export_cache.is_current(result.filepath, fingerprint):
+                result.skipped = True
+                result.seconds = time.perf_counter() - start_time
                 continue
-            this_material = this_object.active_material
-            if this_material.node_tree is None:
+            serialized_graph = read_node_graph(this_node_tree, options, group_cache, stats, texture_hasher)
+            if stats is not None:
+                stats.material_count += 1
+            result.seconds = time.perf_counter() - start_time
+            pipeline.submit(write_material_file, result, serialized_graph, options, stats)
+    if texture_hasher is not None:
+        texture_hasher.close()
+    export_cache.save()
+    return results
+
+def prepare_bundle_entry(result, bundle_writer, serialized_graph, fingerprint, options, stats):
+    # Formats and compresses on a pipeline thread, only adding the entry to the bundle is left for the calling thread
+    start_time = time.perf_counter()
+    finish_node_graph(serialized_graph, options, stats)
+    with stats_phase(stats, "write"):
+        if options.binary_format:
+            prepared = bundle_writer.prepare(result.material_name, serialized_graph.get_graph_bytes(), fingerprint)
+        else:
+            prepared = bundle_writer.prepare(result.material_name, serialized_graph.get_graph_string(), fingerprint)
+    result.seconds += time.perf_counter() - start_time
+    return result, serialized_graph, prepared
+
+def export_all_materials_to_bundle(bundle_path, options, use_cache=True, stats=None, thread_count=DEFAULT_THREAD_COUNT):
+    # cyclesmax_bundle.py is not part of the add-on itself, it must be importable from where this script is run
+    import cyclesmax_bundle
+    results = list()
+    group_cache = NodeGroupCache(stats, get_curve_baker(options))
+    texture_hasher = TextureHasher() if options.texture_manifest else None
+    texture_manifests = dict()
+    with cyclesmax_bundle.BundleWriter(bundle_path) as bundle_writer:
+
+        def add_entry(prepared_entry):
+            # Entries are added in material order, so the bundle does not depend on which thread finished first
+            result, serialized_graph, prepared = prepared_entry
+            bundle_writer.add_prepared(*prepared)
+            if serialized_graph.texture_manifest is not None:
+                texture_manifests[result.material_name] = serialized_graph.texture_manifest
+            result.set_graph_info(serialized_graph)
+
+        with ExportPipeline(thread_count) as pipeline:
+            for this_material, this_node_tree in iter_exportable_materials():
+                start_time = time.perf_counter()
+                result = MaterialExportResult()
+                result.material_name = this_material.name
+                result.filepath = bundle_path
+                results.append(result)
+                # Bundle entries carry their own fingerprint, so no separate cache manifest is needed
+                with stats_phase(stats, "fingerprint"):
+                    fingerprint = get_node_tree_fingerprint(this_node_tree, options, group_cache)
+                if use_cache and bundle_writer.is_current(this_material.name, fingerprint):
+                    result.skipped = True
+                    result.seconds = time.perf_counter() - start_time
+                    continue
+                serialized_graph = read_node_graph(this_node_tree, options, group_cache, stats, texture_hasher)
+                if stats is not None:
+                    stats.material_count += 1
+                result.seconds = time.perf_counter() - start_time
+                pipeline.submit(prepare_bundle_entry, result, bundle_writer, serialized_graph, fingerprint, options, stats, done=add_entry)
+        # Same as ExportCache.save in a directory, materials that were deleted or renamed are dropped
+        material_names = set(x.material_name for x in results)
+        removed_names = [x for x in bundle_writer.entries if x not in material_names]
+        for this_name in removed_names:
+            bundle_writer.remove(this_name)
+    if texture_hasher is not None:
+        texture_hasher.close()
+        if len(texture_manifests) > 0 or len(removed_names) > 0:
+            update_bundle_texture_manifest(get_texture_manifest_filepath(bundle_path), texture_manifests, material_names)
+    return results
+
+class MaterialWatcher:
+    # Re-exports materials to a directory while they are being edited. Depsgraph updates only mark materials
+    # as dirty, a timer exports them once no edits have come in for debounce_seconds, and the files are written
+    # on a background thread so the UI doesn't wait for formatting and file IO.
+    # With a live_port, every exported graph is also streamed to clients connected to that port on localhost.
+    def __init__(self, output_dir, options, debounce_seconds=0.5, live_port=0):
+        self.output_dir = output_dir
+        self.options = options
+        self.debounce_seconds = debounce_seconds
+        self.live_port = live_port
+        self.live_server = None
+        self.dirty_names = set()
+        self.all_dirty = False
+        self.deadline = 0.0
+        # Material name -> fingerprint of the last written export, edits that don't change the output are skipped.
+        # Only the writer thread changes it, so a material whose export failed is exported again on its next update.
+        self.fingerprints = dict()
+        self.filenames = dict()
+        self.used_filenames = set()
+        self.writer = None
+        self.texture_hasher = None
+        self.export_count = 0
+        self.skipped_count = 0
+        self.read_seconds = 0.0
+        # Only the writer thread adds to these
+        self.write_seconds = 0.0
+        self.write_errors = list()
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.live_port > 0:
+            # cyclesmax_live.py is not part of the add-on itself, it must be importable from where this script is run
+            import cyclesmax_live
+            self.live_server = cyclesmax_live.LiveServer(port=self.live_port)
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        if self.options.texture_manifest:
+            self.texture_hasher = TextureHasher()
+        # Export everything once so the directory starts out complete
+        self.all_dirty = True
+        self.export_dirty()
+
+    def stop(self):
+        if self.all_dirty or len(self.dirty_names) > 0:
+            self.export_dirty()
+        # Wait for queued writes so no file is left half written
+        self.writer.shutdown(wait=True)
+        if self.texture_hasher is not None:
+            self.texture_hasher.close()
+        if self.live_server is not None:
+            self.live_server.close()
+
+    def mark_dirty(self, depsgraph):
+        changed = False
+        for this_update in depsgraph.updates:
+            this_id = this_update.id.original
+            if isinstance(this_id, bpy.types.Material):
+                self.dirty_names.add(this_id.name)
+                changed = True
+            elif isinstance(this_id, bpy.types.NodeTree):
+                material_names = [x.name for x in bpy.data.materials if x.node_tree is not None and x.node_tree.as_pointer() == this_id.as_pointer()]
+                if len(material_names) > 0:
+                    self.dirty_names.update(material_names)
+                else:
+                    # A node group can be used by any material, the ones that did not change are skipped by fingerprint
+                    self.all_dirty = True
+                changed = True
+        if changed:
+            self.deadline = time.monotonic() + self.debounce_seconds
+            if not bpy.app.timers.is_registered(watch_timer):
+                bpy.app.timers.register(watch_timer, first_interval=self.debounce_seconds)
+
+    def on_timer(self):
+        # Returns the seconds until the timer should run again, or None once the dirty materials are exported
+        remaining = self.deadline - time.monotonic()
+        if remaining > 0.0:
+            return remaining
+        self.export_dirty()
+        return None
+
+    def get_filepath(self, material_name):
+        if material_name not in self.filenames:
+            self.filenames[material_name] = get_unique_filename(material_name, self.used_filenames)
+        return os.path.join(self.output_dir, self.filenames[material_name])
+
+    def remove_missing(self):
+        # Materials that were deleted or renamed since they were exported, or no longer use nodes, lose their files
+        for this_name in [x for x in self.filenames if get_material_node_tree(bpy.data.materials.get(x)) is None]:
+            filename = self.filenames.pop(this_name)
+            # The writer removes the file before it writes any material that is given the file name next
+            self.used_filenames.discard(filename.lower())
+            self.writer.submit(self.remove, os.path.join(self.output_dir, filename), this_name)
+
+    def export_dirty(self):
+        self.remove_missing()
+        if self.all_dirty:
+            material_names = [x.name for x, _ in iter_exportable_materials()]
+        else:
+            material_names = sorted(self.dirty_names)
+        self.all_dirty = False
+        self.dirty_names.clear()
+        group_cache = NodeGroupCache(None, get_curve_baker(self.options))
+        for this_name in material_names:
+            node_tree = get_material_node_tree(bpy.data.materials.get(this_name))
+            if node_tree is None:
                 continue
-            this_node_tree = this_material.node_tree
-            if len(this_node_tree.nodes) == 0:
+            start_time = time.perf_counter()
+            fingerprint = get_node_tree_fingerprint(node_tree, self.options, group_cache)
+            if self.fingerprints.get(this_name) == fingerprint:
+                self.skipped_count += 1
                 continue
-            found_shader = True
-            serialized_graph = serialize_node_graph(this_node_tree)
-            if len(serialized_graph.unsupported_types) > 0:
-                self.report({'WARNING'}, "Ignored unsupported node types: " + ", ".join(serialized_graph.unsupported_types))
-            if len(serialized_graph.incompatible_types) > 0:
-                self.report({'WARNING'}, "Ignored incompatible node types: " + ", ".join(serialized_graph.incompatible_types) + ". Load this .blend file in Blender 2.81 or newer to correct this.")
-            output_file = open(self.filepath, "w")
-            output_file.write(serialized_graph.graph_string)
-            break
+            serialized_graph = read_node_graph(node_tree, self.options, group_cache, texture_hasher=self.texture_hasher)
+            self.read_seconds += time.perf_counter() - start_time
+            self.export_count += 1
+            self.writer.submit(self.write, self.get_filepath(this_name), serialized_graph, this_name, fingerprint)
+
+    def write(self, filepath, serialized_graph, material_name, fingerprint):
+        start_time = time.perf_counter()
+        try:
+            finish_node_graph(serialized_graph, self.options)
+            if self.live_server is not None:
+                # Clients are sent the text format even when the files are binary
+                self.live_server.push(material_name, serialized_graph.get_graph_string())
+            write_shader_file(filepath, serialized_graph, self.options.binary_format)
+            if serialized_graph.texture_manifest is not None:
+                write_texture_manifest(get_texture_manifest_filepath(filepath), serialized_graph.texture_manifest)
+        except OSError as error:
+            self.write_errors.append("{0}: {1}".format(filepath, error))
+        except Exception as error:
+            # The executor would keep it in a future nobody reads, so the material would silently stop updating
+            self.write_errors.append("Material '{0}' could not be exported: {1}: {2}".format(material_name, type(error).__name__, error))
+        else:
+            self.fingerprints[material_name] = fingerprint
+        self.write_seconds += time.perf_counter() - start_time
+
+    def remove(self, filepath, material_name):
+        self.fingerprints.pop(material_name, None)
+        for this_path in (filepath, get_texture_manifest_filepath(filepath)):
+            try:
+                os.remove(this_path)
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                self.write_errors.append("{0}: {1}".format(this_path, error))
+
+    def get_summary_line(self):
+        line = "Exported {0} materials to {1} and skipped {2} unchanged ones. Reading them took {3:.3f}s, optimizing and writing {4:.3f}s in the background".format(
+            self.export_count, self.output_dir, self.skipped_count, self.read_seconds, self.write_seconds)
+        if self.live_server is not None:
+            line += ". " + self.live_server.get_summary_line()
+        return line
+
+active_watcher = None
+
+def watch_depsgraph_update(scene, depsgraph):
+    if active_watcher is not None:
+        active_watcher.mark_dirty(depsgraph)
+
+def watch_timer():
+    if active_watcher is None:
+        return None
+    return active_watcher.on_timer()
+
+def watch_load_pre(*args):
+    # Material names from the old file mean nothing in the next one
+    stop_watching()
+
+def start_watching(output_dir, options, debounce_seconds=0.5, live_port=0):
+    global active_watcher
+    stop_watching()
+    watcher = MaterialWatcher(output_dir, options, debounce_seconds, live_port)
+    watcher.start()
+    active_watcher = watcher
+    bpy.app.handlers.depsgraph_update_post.append(watch_depsgraph_update)
+    bpy.app.handlers.load_pre.append(watch_load_pre)
+    return active_watcher
+
+def stop_watching():
+    # Returns the watcher that was stopped, or None if watch mode was not running
+    global active_watcher
+    if active_watcher is None:
+        return None
+    if watch_depsgraph_update in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(watch_depsgraph_update)
+    if watch_load_pre in bpy.app.handlers.load_pre:
+        bpy.app.handlers.load_pre.remove(watch_load_pre)
+    if bpy.app.timers.is_registered(watch_timer):
+        bpy.app.timers.unregister(watch_timer)
+    watcher = active_watcher
+    active_watcher = None
+    watcher.stop()
+    return watcher
+
+# The add-on itself, only defined when running inside Blender
+if bpy is not None:
+    class ExportOptionsProperties:
+        # Export settings shared by the export and watch operators
+        prune_unreachable: BoolProperty(
+                name="Remove Unused Nodes",
+                description="Only export nodes that contribute to the active material output",
+                default=False,
+                )
+        fold_constants: BoolProperty(
+                name="Fold Constants",
+                description="Replace math and converter nodes that only have constant inputs with their result",
+                default=False,
+                )
+        merge_duplicates: BoolProperty(
+                name="Merge Duplicate Nodes",
+                description="Replace nodes that have the same settings and inputs as another node with that node",
+                default=False,
+                )
+        curve_mode: EnumProperty(
+                name="Curves and Ramps",
+                description="How RGB Curves and Color Ramp nodes are written",
+                items=(
+                    ('POINTS', "Control Points", "Write every control point as it is"),
+                    ('LUT', "Lookup Table", "Replace curves and ramps that have more points than the table size with evenly spaced samples"),
+                    ('DECIMATE', "Decimate", "Replace curves and ramps with as few samples as stay within the tolerance"),
+                    ),
+                default='POINTS',
+                )
+        curve_lut_size: IntProperty(
+                name="Lookup Table Size",
+                description="Number of samples in a baked curve or ramp",
+                default=32,
+                min=2,
+                max=1024,
+                )
+        curve_tolerance: FloatProperty(
+                name="Curve Tolerance",
+                description="Largest difference from the original curve or ramp that decimation may introduce",
+                default=0.001,
+                min=0.0,
+                precision=4,
+                )
+        texture_manifest: BoolProperty(
+                name="Write Texture Manifest",
+                description="Give images of the same file one texture slot and describe each slot in a .textures.json file next to the shader",
+                default=False,
+                )
+        sparse_defaults: BoolProperty(
+                name="Leave Out Default Values",
+                description="Only write values that differ from their Blender default, the loader fills in the rest",
+                default=False,
+                )
+        topological_order: BoolProperty(
+                name="Dependency Order",
+                description="Write every node after the nodes linked into it, with node and connection counts in the header",
+                default=False,
+                )
+
+        def get_export_options(self):
+            options = ExportOptions()
+            options.prune_unreachable = self.prune_unreachable
+            options.fold_constants = self.fold_constants
+            options.merge_duplicates = self.merge_duplicates
+            options.curve_mode = self.curve_mode.lower()
+            options.curve_lut_size = self.curve_lut_size
+            options.curve_tolerance = self.curve_tolerance
+            options.texture_manifest = self.texture_manifest
+            options.sparse_defaults = self.sparse_defaults
+            options.topological_order = self.topological_order
+            return options
+
+    class ExportCyclesMaxShader(bpy.types.Operator, ExportHelper, ExportOptionsProperties):
+        """Cycles for Max Shader Exporter"""
+        bl_idname = "export_shader.cyclesmax"
+        bl_label = "Export Cycles for Max Shader"
+
+        filename_ext = ".shader"
+        filter_glob: StringProperty(
+                default="*.shader",
+                options={'HIDDEN'},
+                )
+        collect_stats: BoolProperty(
+                name="Collect Statistics",
+                description="Report where the export time goes and save the details to a .stats.json file next to the shader",
+                default=False,
+                )
 
-        if found_shader == False:
-            self.report({'ERROR'}, "Failed to find shader on selected objects")
+        def execute(self, context):
+            if context.scene.render.engine != 'CYCLES' and context.scene.render.engine != 'BLENDER_EEVEE':
+                self.report({'ERROR'}, "Shader export is only compatible with Cycles or Eevee.")
+                return {'FINISHED'}
 
-        return {'FINISHED'}
+            found_shader = False
 
-def menu_export(self, context):
-    self.layout.operator(ExportCyclesMaxShader.bl_idname, text="Cycles for Max Shader (.shader)")
+            for this_object in context.selected_objects:
+                this_node_tree = get_material_node_tree(this_object.active_material)
+                if this_node_tree is None:
+                    continue
+                found_shader = True
+                stats = ExportStats() if self.collect_stats else None
+                serialized_graph = serialize_node_graph(this_node_tree, self.get_export_options(), stats=stats)
+                if serialized_graph.folded_node_count > 0:
+                    self.report({'INFO'}, "Folded {0} constant nodes".format(serialized_graph.folded_node_count))
+                if serialized_graph.merged_node_count > 0:
+                    self.report({'INFO'}, "Merged {0} duplicate nodes".format(serialized_graph.merged_node_count))
+                if serialized_graph.pruned_node_count > 0:
+                    self.report({'INFO'}, "Removed {0} unused nodes".format(serialized_graph.pruned_node_count))
+                if serialized_graph.baked_curve_count > 0:
+                    self.report({'INFO'}, "Baked {0} curves and ramps, max deviation {1:.5f}".format(serialized_graph.baked_curve_count, serialized_graph.max_curve_deviation))
+                if serialized_graph.merged_texture_count > 0:
+                    self.report({'INFO'}, "Merged {0} texture slots that use the same file".format(serialized_graph.merged_texture_count))
+                if serialized_graph.omitted_value_count > 0:
+                    self.report({'INFO'}, "Left out {0} values equal to their default".format(serialized_graph.omitted_value_count))
+                if serialized_graph.dropped_link_count > 0:
+                    self.report({'WARNING'}, "Dropped {0} links that form a cycle".format(serialized_graph.dropped_link_count))
+                if len(serialized_graph.unsupported_types) > 0:
+                    self.report({'WARNING'}, "Ignored unsupported node types: " + ", ".join(serialized_graph.unsupported_types))
+                if len(serialized_graph.incompatible_types) > 0:
+                    self.report({'WARNING'}, "Ignored incompatible node types: " + ", ".join(serialized_graph.incompatible_types) + ". Load this .blend file in Blender 2.81 or newer to correct this.")
+                write_shader_file(self.filepath, serialized_graph, stats=stats)
+                if serialized_graph.texture_manifest is not None:
+                    write_texture_manifest(get_texture_manifest_filepath(self.filepath), serialized_graph.texture_manifest)
+                if stats is not None:
+                    stats.material_count = 1
+                    for this_line in stats.get_summary_lines():
+                        self.report({'INFO'}, this_line)
+                    stats.save(get_stats_filepath(self.filepath))
+                break
 
-def register():
-    bpy.utils.register_class(ExportCyclesMaxShader)
-    bpy.types.TOPBAR_MT_file_export.append(menu_export)
+            if found_shader == False:
+                self.report({'ERROR'}, "Failed to find shader on selected objects")
 
-def unregister():
-    bpy.types.TOPBAR_MT_file_export.remove(menu_export)
-    bpy.utils.unregister_class(ExportCyclesMaxShader)
+            return {'FINISHED'}
+
+    class WatchCyclesMaxShaders(bpy.types.Operator, ExportOptionsProperties):
+        """Export every material to a directory and export them again whenever they are edited"""
+        bl_idname = "export_shader.cyclesmax_watch"
+        bl_label = "Watch Cycles for Max Shaders"
+
+        directory: StringProperty(
+                subtype='DIR_PATH',
+                )
+        debounce_seconds: FloatProperty(
+                name="Delay",
+                description="Seconds without further edits before changed materials are exported",
+                default=0.5,
+                min=0.0,
+                )
+        live_port: IntProperty(
+                name="Live Port",
+                description="Also stream every export to clients connected to this port on localhost, 0 to only write files",
+                default=0,
+                min=0,
+                max=65535,
+                )
+
+        def invoke(self, context, event):
+            context.window_manager.fileselect_add(self)
+            return {'RUNNING_MODAL'}
+
+        def execute(self, context):
+            try:
+                watcher = start_watching(bpy.path.abspath(self.directory), self.get_export_options(), self.debounce_seconds, self.live_port)
+            except (ImportError, OSError) as error:
+                self.report({'ERROR'}, "Could not start watching: {0}".format(error))
+                return {'CANCELLED'}
+            self.report({'INFO'}, "Watching materials, exported {0} to {1}".format(watcher.export_count, watcher.output_dir))
+            if watcher.live_server is not None:
+                self.report({'INFO'}, "Streaming updates on port {0}".format(watcher.live_server.port))
+            return {'FINISHED'}
+
+    class StopWatchingCyclesMaxShaders(bpy.types.Operator):
+        """Stop exporting materials when they are edited"""
+        bl_idname = "export_shader.cyclesmax_watch_stop"
+        bl_label = "Stop Watching Cycles for Max Shaders"
+
+        def execute(self, context):
+            watcher = stop_watching()
+            if watcher is None:
+                self.report({'WARNING'}, "Materials are not being watched")
+                return {'CANCELLED'}
+            self.report({'INFO'}, watcher.get_summary_line())
+            for this_error in watcher.write_errors:
+                self.report({'ERROR'}, this_error)
+            return {'FINISHED'}
+
+    def menu_export(self, context):
+        self.layout.operator(ExportCyclesMaxShader.bl_idname, text="Cycles for Max Shader (.shader)")
+        if active_watcher is None:
+            self.layout.operator(WatchCyclesMaxShaders.bl_idname, text="Cycles for Max Shaders (watch directory)")
+        else:
+            self.layout.operator(StopWatchingCyclesMaxShaders.bl_idname, text="Stop Watching Cycles for Max Shaders")
+
+    def register():
+        bpy.utils.register_class(ExportCyclesMaxShader)
+        bpy.utils.register_class(WatchCyclesMaxShaders)
+        bpy.utils.register_class(StopWatchingCyclesMaxShaders)
+        bpy.types.TOPBAR_MT_file_export.append(menu_export)
+
+    def unregister():
+        # Removes the watch mode handlers and timer, and waits for its pending writes
+        stop_watching()
+        bpy.types.TOPBAR_MT_file_export.remove(menu_export)
+        bpy.utils.unregister_class(StopWatchingCyclesMaxShaders)
+        bpy.utils.unregister_class(WatchCyclesMaxShaders)
+        bpy.utils.unregister_class(ExportCyclesMaxShader)
+
+def get_cli_args():
+    # Blender passes everything after "--" through to the script untouched
+    if "--" in sys.argv:
+        return sys.argv[sys.argv.index("--") + 1:]
+    return list()
+
+def cli_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="blender -b file.blend --python io_cyclesmax_shader.py --",
+        description="Export every material in the open .blend file to its own .shader file, or to a shader library bundle.")
+    destination_group = parser.add_mutually_exclusive_group(required=True)
+    destination_group.add_argument("--output-dir", help="Directory to write .shader files to")
+    destination_group.add_argument("--bundle", help="Shader library bundle to add or replace materials in")
+    parser.add_argument("--report", help="Write a JSON report of the exported materials to this path")
+    parser.add_argument("--force", action="store_true", help="Export every material even if it is unchanged since the last export")
+    parser.add_argument("--prune", action="store_true", help="Only export nodes that contribute to the active material output")
+    parser.add_argument("--fold-constants", action="store_true", help="Replace math and converter nodes that only have constant inputs with their result")
+    parser.add_argument("--merge-duplicates", action="store_true", help="Replace nodes that have the same settings and inputs as another node with that node")
+    parser.add_argument("--curves", choices=CURVE_MODES, default=CURVE_MODE_POINTS, help="Write curves and color ramps as their control points, as a lookup table or decimated within --curve-tolerance")
+    parser.add_argument("--curve-lut-size", type=int, default=32, help="Number of samples in a baked curve or ramp with --curves lut")
+    parser.add_argument("--curve-tolerance", type=float, default=0.001, help="Largest difference from the original curve or ramp with --curves decimate")
+    parser.add_argument("--texture-manifest", action="store_true", help="Give images of the same file one texture slot and describe each slot in a .textures.json file")
+    parser.add_argument("--binary", action="store_true", help="Write the compact binary encoding instead of text, see cyclesmax_binary.py")
+    parser.add_argument("--sparse", action="store_true", help="Leave out values equal to their Blender default, the loader fills them back in")
+    parser.add_argument("--topological", action="store_true", help="Write every node after the nodes linked into it, with node, connection and string counts in the header")
+    parser.add_argument("--stats", action="store_true", help="Print where the export time goes and save the details to a .stats.json file next to the output")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREAD_COUNT, help="Threads that optimize, format and write materials while the next ones are read, 0 to do everything on the main thread")
+    args = parser.parse_args(argv)
+    if args.curve_lut_size < 2:
+        parser.error("--curve-lut-size must be at least 2")
+    if args.curve_tolerance < 0.0:
+        parser.error("--curve-tolerance must not be negative")
+    if args.threads < 0:
+        parser.error("--threads must not be negative")
+    if args.sparse and args.binary:
+        parser.error("--sparse only applies to text files, it can not be combined with --binary")
+
+    options = ExportOptions()
+    options.prune_unreachable = args.prune
+    options.fold_constants = args.fold_constants
+    options.merge_duplicates = args.merge_duplicates
+    options.binary_format = args.binary
+    options.curve_mode = args.curves
+    options.curve_lut_size = args.curve_lut_size
+    options.curve_tolerance = args.curve_tolerance
+    options.texture_manifest = args.texture_manifest
+    options.sparse_defaults = args.sparse
+    options.topological_order = args.topological
+
+    stats = ExportStats() if args.stats else None
+    start_time = time.perf_counter()
+    if args.bundle is not None:
+        results = export_all_materials_to_bundle(args.bundle, options, use_cache=not args.force, stats=stats, thread_count=args.threads)
+    else:
+        results = export_all_materials(args.output_dir, options, use_cache=not args.force, stats=stats, thread_count=args.threads)
+    total_seconds = time.perf_counter() - start_time
+
+    skipped_count = 0
+    for this_result in results:
+        if this_result.skipped:
+            skipped_count += 1
+            continue
+        print("Exported '{0}' to {1} ({2:.3f}s)".format(this_result.material_name, this_result.filepath, this_result.seconds))
+        if this_result.folded_node_count > 0:
+            print("  Folded {0} constant nodes".format(this_result.folded_node_count))
+        if this_result.merged_node_count > 0:
+            print("  Merged {0} duplicate nodes".format(this_result.merged_node_count))
+        if this_result.pruned_node_count > 0:
+            print("  Removed {0} unused nodes".format(this_result.pruned_node_count))
+        if this_result.baked_curve_count > 0:
+            print("  Baked {0} curves and ramps, max deviation {1:.5f}".format(this_result.baked_curve_count, this_result.max_curve_deviation))
+        if this_result.merged_texture_count > 0:
+            print("  Merged {0} texture slots that use the same file".format(this_result.merged_texture_count))
+        if this_result.omitted_value_count > 0:
+            print("  Left out {0} values equal to their default".format(this_result.omitted_value_count))
+        if this_result.dropped_link_count > 0:
+            print("  Dropped {0} links that form a cycle".format(this_result.dropped_link_count))
+        if len(this_result.unsupported_types) > 0:
+            print("  Ignored unsupported node types: " + ", ".join(sorted(this_result.unsupported_types)))
+        if len(this_result.incompatible_types) > 0:
+            print("  Ignored incompatible node types: " + ", ".join(sorted(this_result.incompatible_types)))
+    print("Exported {0} materials from {1} in {2:.3f}s, {3} unchanged".format(len(results) - skipped_count, bpy.data.filepath, total_seconds, skipped_count))
+    if stats is not None:
+        for this_line in stats.get_summary_lines():
+            print(this_line)
+        stats.save(get_stats_filepath(args.bundle if args.bundle is not None else args.output_dir))
+
+    if args.report is not None:
+        report = dict()
+        report["blend_file"] = bpy.data.filepath
+        report["seconds"] = total_seconds
+        report["materials"] = [this_result.to_dict() for this_result in results]
+        with open(args.report, "w") as report_file:
+            json.dump(report, report_file, indent=2)
 
 # This allows you to run the script directly from blenders text editor
 # to test the addon without having to install it.
+# When run from the command line with arguments after "--", export every material instead:
+#   blender -b file.blend --python io_cyclesmax_shader.py -- --output-dir path/to/output
 if __name__ == "__main__":
-    register()
+    cli_args = get_cli_args()
+    if len(cli_args) > 0:
+        # Make the helper modules that live next to this script importable
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        cli_main(cli_args)
+    else:
+        register()
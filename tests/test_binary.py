@@ -0,0 +1,105 @@
+# Checks that binary .shader files convert back to exactly the text the exporter writes, run without Blender
+#
+#   python -m pytest tests
+
+import math
+import os
+import random
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cyclesmax_binary
+import cyclesmax_reader
+import io_cyclesmax_shader as shader
+
+def make_node(name, node_type, node_location, **values):
+    output = shader.CyclesNode()
+    output.name = name
+    output.node_type = node_type
+    # The same as get_node_positions makes of a node location
+    output.position = (math.floor(node_location[0]), -1.0 * math.floor(node_location[1]))
+    for name, value in values.items():
+        if isinstance(value, str):
+            output.string_values[name] = value
+        elif isinstance(value, int):
+            output.int_values[name] = value
+        elif isinstance(value, tuple) and len(value) == 4:
+            output.float4_values[name] = value
+        elif isinstance(value, tuple):
+            output.float3_values[name] = value
+        else:
+            output.float_values[name] = value
+    return output
+
+def make_graph(rng):
+    nodes = [
+        make_node("value", shader.NodeType.VALUE, (-600.5, 120.25), value=rng.random()),
+        make_node("math", shader.NodeType.MATH, (-400.0, -40.0), math_type="multiply", use_clamp=1, value1=rng.random(), value2=rng.random() * 1000.0, value3=-rng.random()),
+        make_node("mapping", shader.NodeType.MAPPING, (-400.0, 200.0), mapping_type="point", location=(rng.random(), -rng.random(), 12.5), rotation=(0.0, 0.0, rng.random()), scale=(1.0, 1.0, 1.0)),
+        make_node("principled", shader.NodeType.PRINCIPLED_BSDF, (-200.0, 0.5), base_color=(rng.random(), rng.random(), rng.random(), 1.0), roughness=0.5, metallic=0.0),
+        make_node("output", shader.NodeType.MATERIAL_OUTPUT, (0.0, 0.0)),
+    ]
+    graph = shader.SerializedNodeGraph()
+    graph.nodes = nodes
+    graph.connections = [
+        shader.CyclesConnection("value", "Value", "math", "Value1"),
+        shader.CyclesConnection("math", "Value", "principled", "Roughness"),
+        shader.CyclesConnection("principled", "BSDF", "output", "Surface"),
+    ]
+    graph.output_node_name = "output"
+    return graph
+
+def export(seed, **options):
+    export_options = shader.ExportOptions()
+    for name, value in options.items():
+        setattr(export_options, name, value)
+    return shader.finish_node_graph(make_graph(random.Random(seed)), export_options)
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("options", [dict(), dict(topological_order=True)])
+def test_binary_to_text(seed, options):
+    graph = export(seed, **options)
+    text_graph = cyclesmax_binary.parse_shader_bytes(graph.get_graph_bytes())
+    assert cyclesmax_binary.encode_text(text_graph) == graph.get_graph_string()
+
+@pytest.mark.parametrize("options", [dict(), dict(topological_order=True), dict(sparse_defaults=True), dict(topological_order=True, sparse_defaults=True)])
+def test_text_to_text(options):
+    graph = export(0, **options)
+    shader_string = graph.get_graph_string()
+    assert cyclesmax_binary.encode_text(cyclesmax_reader.parse_shader_string(shader_string)) == shader_string
+
+def test_text_to_binary_to_text():
+    shader_string = export(0, topological_order=True).get_graph_string()
+    data = cyclesmax_binary.encode_graph(cyclesmax_reader.parse_shader_string(shader_string))
+    assert cyclesmax_binary.encode_text(cyclesmax_binary.parse_shader_bytes(data)) == shader_string
+
+def test_values_near_rounding_boundary():
+    # float32 of each of these is written with a different last decimal than the value itself
+    values = [0.75224999999, 0.12344999999, 1234.56785, 0.00015]
+    for value in values:
+        assert "%.4f" % value != "%.4f" % struct.unpack("<f", struct.pack("<f", value))[0]
+    graph = shader.SerializedNodeGraph()
+    graph.nodes = [make_node("value {0}".format(index), shader.NodeType.VALUE, (0.0, 0.0), value=value) for index, value in enumerate(values)]
+    graph.nodes.append(make_node("rgb", shader.NodeType.RGB, (0.0, 0.0), value=(0.5, values[0], 0.25, 1.0)))
+    text_graph = cyclesmax_binary.parse_shader_bytes(graph.get_graph_bytes())
+    assert cyclesmax_binary.encode_text(text_graph) == graph.get_graph_string()
+
+def test_read_old_binary():
+    # CMXSHDB1 files are the same without the header field count that follows the string table
+    graph = export(0)
+    data = graph.get_graph_bytes()
+    string_count = cyclesmax_binary.HEADER_STRUCT.unpack_from(data, 0)[1]
+    offset = cyclesmax_binary.HEADER_STRUCT.size
+    for _ in range(string_count):
+        length, offset = cyclesmax_binary.unpack_varint(data, offset)
+        offset += length
+    assert data[offset] == 0
+    old_data = cyclesmax_binary.OLD_BINARY_MAGIC + data[len(cyclesmax_binary.BINARY_MAGIC):offset] + data[offset + 1:]
+    old_graph = cyclesmax_binary.parse_shader_bytes(old_data)
+    new_graph = cyclesmax_binary.parse_shader_bytes(data)
+    assert [x.to_dict() for x in old_graph.nodes] == [x.to_dict() for x in new_graph.nodes]
+    assert [x.to_tuple() for x in old_graph.connections] == [x.to_tuple() for x in new_graph.connections]
@@ -0,0 +1,270 @@
+# Checks the constant folding pass against the formulas of Cycles' SVM nodes, run without Blender
+#
+#   python -m pytest tests
+
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import io_cyclesmax_shader as shader
+
+def make_node(name, node_type, **values):
+    output = shader.CyclesNode()
+    output.name = name
+    output.node_type = node_type
+    for name, value in values.items():
+        if isinstance(value, str):
+            output.string_values[name] = value
+        elif isinstance(value, int):
+            output.int_values[name] = value
+        elif isinstance(value, tuple) and len(value) == 4:
+            output.float4_values[name] = value
+        elif isinstance(value, tuple):
+            output.float3_values[name] = value
+        else:
+            output.float_values[name] = value
+    return output
+
+def make_math_node(name, math_type, value1=0.5, value2=0.5, value3=0.5, use_clamp=0):
+    return make_node(name, shader.NodeType.MATH, math_type=math_type, use_clamp=use_clamp, value1=value1, value2=value2, value3=value3)
+
+def assert_vector(actual, expected):
+    assert actual == pytest.approx(expected)
+
+@pytest.mark.parametrize("math_type, a, b, c, expected", [
+    ("add", 1.5, 2.0, 0.0, 3.5),
+    ("subtract", 1.5, 2.0, 0.0, -0.5),
+    ("multiply", 1.5, 2.0, 0.0, 3.0),
+    ("divide", 3.0, 2.0, 0.0, 1.5),
+    ("multiply_add", 2.0, 3.0, 1.0, 7.0),
+    ("power", 2.0, 3.0, 0.0, 8.0),
+    ("power", -2.0, 3.0, 0.0, -8.0),
+    ("logarithm", 8.0, 2.0, 0.0, 3.0),
+    ("sqrt", 9.0, 0.0, 0.0, 3.0),
+    ("inverse_sqrt", 4.0, 0.0, 0.0, 0.5),
+    ("absolute", -2.0, 0.0, 0.0, 2.0),
+    ("exponent", 0.0, 0.0, 0.0, 1.0),
+    ("minimum", 1.0, 2.0, 0.0, 1.0),
+    ("maximum", 1.0, 2.0, 0.0, 2.0),
+    ("less_than", 1.0, 2.0, 0.0, 1.0),
+    ("greater_than", 1.0, 2.0, 0.0, 0.0),
+    ("sign", -3.0, 0.0, 0.0, -1.0),
+    ("sign", 0.0, 0.0, 0.0, 0.0),
+    ("compare", 1.0, 1.05, 0.1, 1.0),
+    ("compare", 1.0, 1.5, 0.1, 0.0),
+    ("smooth_min", 1.0, 2.0, 0.0, 1.0),
+    ("smooth_min", 1.0, 1.0, 1.0, 1.0 - 1.0 / 6.0),
+    ("smooth_max", 1.0, 1.0, 1.0, 1.0 + 1.0 / 6.0),
+    ("round", 1.5, 0.0, 0.0, 2.0),
+    ("round", -1.5, 0.0, 0.0, -1.0),
+    ("floor", -1.5, 0.0, 0.0, -2.0),
+    ("ceil", -1.5, 0.0, 0.0, -1.0),
+    ("trunc", -1.5, 0.0, 0.0, -1.0),
+    ("fract", -1.25, 0.0, 0.0, 0.75),
+    ("modulo", 5.5, 2.0, 0.0, 1.5),
+    ("modulo", -5.5, 2.0, 0.0, -1.5),
+    ("wrap", 1.25, 1.0, 0.0, 0.25),
+    ("wrap", 0.5, 1.0, 1.0, 1.0),
+    ("snap", 1.3, 0.5, 0.0, 1.0),
+    ("pingpong", 1.25, 1.0, 0.0, 0.75),
+    ("sine", math.pi / 2.0, 0.0, 0.0, 1.0),
+    ("arcsine", 2.0, 0.0, 0.0, math.pi / 2.0),
+    ("arccosine", -2.0, 0.0, 0.0, math.pi),
+    ("arctan2", 1.0, 1.0, 0.0, math.pi / 4.0),
+    ("radians", 180.0, 0.0, 0.0, math.pi),
+    ("degrees", math.pi, 0.0, 0.0, 180.0),
+])
+def test_evaluate_math(math_type, a, b, c, expected):
+    assert shader.evaluate_math(math_type, a, b, c) == pytest.approx(expected)
+
+@pytest.mark.parametrize("math_type, a, b", [
+    # Cycles' safe_divide, safe_modulo, safe_powf, safe_logf and safe_sqrtf all return zero where the math is undefined
+    ("divide", 1.0, 0.0),
+    ("modulo", 1.0, 0.0),
+    ("power", -2.0, 0.5),
+    ("logarithm", -1.0, 2.0),
+    ("logarithm", 8.0, 0.0),
+    ("logarithm", 8.0, 1.0),
+    ("sqrt", -4.0, 0.0),
+    ("inverse_sqrt", 0.0, 0.0),
+    ("snap", 1.0, 0.0),
+    ("pingpong", 1.0, 0.0),
+])
+def test_evaluate_math_safe(math_type, a, b):
+    assert shader.evaluate_math(math_type, a, b, 0.0) == 0.0
+
+def test_evaluate_math_not_folded():
+    assert shader.evaluate_math("exponent", 1000.0, 0.0, 0.0) is None
+    assert shader.evaluate_math("unknown", 1.0, 1.0, 1.0) is None
+
+def test_fold_math_use_clamp():
+    inputs = {"value1": 2.0, "value2": 3.0, "value3": 0.0}
+    unclamped = shader.fold_math(make_math_node("a", "add"), inputs)
+    clamped = shader.fold_math(make_math_node("a", "add", use_clamp=1), inputs)
+    negative = shader.fold_math(make_math_node("a", "subtract", use_clamp=1), inputs)
+    assert unclamped == {"Value": (shader.FOLD_FLOAT, 5.0)}
+    assert clamped == {"Value": (shader.FOLD_FLOAT, 1.0)}
+    assert negative == {"Value": (shader.FOLD_FLOAT, 0.0)}
+
+@pytest.mark.parametrize("math_type, a, b, c, scale, expected_vector, expected_value", [
+    ("add", (1.0, 2.0, 3.0), (1.0, 1.0, 1.0), None, 1.0, (2.0, 3.0, 4.0), 0.0),
+    ("divide", (1.0, 2.0, 3.0), (2.0, 0.0, 3.0), None, 1.0, (0.5, 0.0, 1.0), 0.0),
+    ("multiply_add", (1.0, 2.0, 3.0), (2.0, 2.0, 2.0), (1.0, 1.0, 1.0), 1.0, (3.0, 5.0, 7.0), 0.0),
+    ("cross_product", (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), None, 1.0, (0.0, 0.0, 1.0), 0.0),
+    ("project", (1.0, 1.0, 0.0), (2.0, 0.0, 0.0), None, 1.0, (1.0, 0.0, 0.0), 0.0),
+    ("project", (1.0, 1.0, 0.0), (0.0, 0.0, 0.0), None, 1.0, (0.0, 0.0, 0.0), 0.0),
+    ("reflect", (1.0, -1.0, 0.0), (0.0, 2.0, 0.0), None, 1.0, (1.0, 1.0, 0.0), 0.0),
+    ("dot_product", (1.0, 2.0, 3.0), (4.0, 5.0, 6.0), None, 1.0, (0.0, 0.0, 0.0), 32.0),
+    ("distance", (1.0, 1.0, 1.0), (1.0, 4.0, 5.0), None, 1.0, (0.0, 0.0, 0.0), 5.0),
+    ("length", (3.0, 4.0, 0.0), None, None, 1.0, (0.0, 0.0, 0.0), 5.0),
+    ("scale", (1.0, 2.0, 3.0), None, None, 2.0, (2.0, 4.0, 6.0), 0.0),
+    ("normalize", (3.0, 0.0, 4.0), None, None, 1.0, (0.6, 0.0, 0.8), 0.0),
+    ("normalize", (0.0, 0.0, 0.0), None, None, 1.0, (0.0, 0.0, 0.0), 0.0),
+    ("snap", (1.3, -1.3, 2.0), (0.5, 0.5, 0.0), None, 1.0, (1.0, -1.5, 0.0), 0.0),
+    ("modulo", (5.5, -5.5, 1.0), (2.0, 2.0, 0.0), None, 1.0, (1.5, -1.5, 0.0), 0.0),
+    ("wrap", (1.25, -0.25, 0.5), (1.0, 1.0, 1.0), (0.0, 0.0, 0.0), 1.0, (0.25, 0.75, 0.5), 0.0),
+    ("fraction", (1.25, -1.25, 0.0), None, None, 1.0, (0.25, 0.75, 0.0), 0.0),
+    ("minimum", (1.0, 5.0, 3.0), (2.0, 4.0, 3.0), None, 1.0, (1.0, 4.0, 3.0), 0.0),
+])
+def test_evaluate_vector_math(math_type, a, b, c, scale, expected_vector, expected_value):
+    zero = (0.0, 0.0, 0.0)
+    vector, value = shader.evaluate_vector_math(math_type, a, b or zero, c or zero, scale)
+    assert_vector(vector, expected_vector)
+    assert value == pytest.approx(expected_value)
+
+def test_evaluate_vector_math_not_folded():
+    # Cycles normalizes a zero normal into NaNs
+    assert shader.evaluate_vector_math("reflect", (1.0, 0.0, 0.0), (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 1.0) is None
+    assert shader.evaluate_vector_math("unknown", (1.0, 0.0, 0.0), (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 1.0) is None
+
+@pytest.mark.parametrize("mix_type, fac, expected", [
+    ("mix", 0.5, (0.4, 0.5, 0.6)),
+    ("mix", 2.0, (0.6, 0.6, 0.6)),
+    ("add", 1.0, (0.8, 1.0, 1.2)),
+    ("multiply", 1.0, (0.12, 0.24, 0.36)),
+    ("subtract", 1.0, (-0.4, -0.2, 0.0)),
+    ("screen", 1.0, (0.68, 0.76, 0.84)),
+    ("divide", 1.0, (0.2 / 0.6, 0.4 / 0.6, 1.0)),
+    ("difference", 1.0, (0.4, 0.2, 0.0)),
+    ("darken", 1.0, (0.2, 0.4, 0.6)),
+    ("lighten", 1.0, (0.6, 0.6, 0.6)),
+    ("overlay", 1.0, (2.0 * 0.2 * 0.6, 2.0 * 0.4 * 0.6, 1.0 - 2.0 * 0.4 * 0.4)),
+    ("dodge", 1.0, (0.5, 1.0, 1.0)),
+    ("burn", 1.0, (0.0, 0.0, 1.0 - 0.4 / 0.6)),
+    ("linear_light", 1.0, (0.4, 0.6, 0.8)),
+])
+def test_evaluate_mix(mix_type, fac, expected):
+    assert_vector(shader.evaluate_mix(mix_type, fac, (0.2, 0.4, 0.6), (0.6, 0.6, 0.6)), expected)
+
+def test_evaluate_mix_not_folded():
+    assert shader.evaluate_mix("hue", 1.0, (0.2, 0.4, 0.6), (0.6, 0.6, 0.6)) is None
+
+def test_fold_mix_rgb_use_clamp():
+    node = make_node("a", shader.NodeType.MIX_RGB, mix_type="add", use_clamp=1)
+    outputs = shader.fold_mix_rgb(node, {"fac": 1.0, "color1": (0.8, 0.5, -0.5), "color2": (0.8, 0.2, 0.0)})
+    kind, value = outputs["Color"]
+    assert kind == shader.FOLD_COLOR
+    assert_vector(value, (1.0, 0.7, 0.0))
+
+@pytest.mark.parametrize("range_type, use_clamp, value, from_min, from_max, to_min, to_max, steps, expected", [
+    ("linear", 0, 0.5, 0.0, 1.0, 10.0, 20.0, 4.0, 15.0),
+    ("linear", 0, 2.0, 0.0, 1.0, 10.0, 20.0, 4.0, 30.0),
+    ("linear", 1, 2.0, 0.0, 1.0, 10.0, 20.0, 4.0, 20.0),
+    # Clamping works with a reversed target range
+    ("linear", 1, 2.0, 0.0, 1.0, 20.0, 10.0, 4.0, 10.0),
+    # A zero source range divides safely
+    ("linear", 0, 0.5, 1.0, 1.0, 10.0, 20.0, 4.0, 10.0),
+    ("stepped", 0, 0.6, 0.0, 1.0, 0.0, 1.0, 4.0, 0.75),
+    ("stepped", 0, 0.6, 0.0, 1.0, 0.0, 1.0, 0.0, 0.0),
+    ("smoothstep", 0, 0.5, 0.0, 1.0, 0.0, 1.0, 4.0, 0.5),
+    ("smoothstep", 0, 0.25, 0.0, 1.0, 0.0, 1.0, 4.0, 0.15625),
+    ("smoothstep", 0, 0.25, 1.0, 0.0, 0.0, 1.0, 4.0, 0.84375),
+    ("smoothstep", 1, 2.0, 0.0, 1.0, 0.0, 1.0, 4.0, 1.0),
+    ("smootherstep", 0, 0.25, 0.0, 1.0, 0.0, 1.0, 4.0, 0.103515625),
+])
+def test_evaluate_map_range(range_type, use_clamp, value, from_min, from_max, to_min, to_max, steps, expected):
+    assert shader.evaluate_map_range(range_type, use_clamp, value, from_min, from_max, to_min, to_max, steps) == pytest.approx(expected)
+
+@pytest.mark.parametrize("clamp_type, value, min_value, max_value, expected", [
+    ("minmax", 2.0, 0.0, 1.0, 1.0),
+    ("minmax", -1.0, 0.0, 1.0, 0.0),
+    # Min/Max applies max then min, so a reversed range gives the max value
+    ("minmax", 0.5, 1.0, 0.0, 0.0),
+    ("range", 0.5, 1.0, 0.0, 0.5),
+    ("range", 2.0, 1.0, 0.0, 1.0),
+    ("range", -1.0, 1.0, 0.0, 0.0),
+])
+def test_evaluate_clamp(clamp_type, value, min_value, max_value, expected):
+    assert shader.evaluate_clamp(clamp_type, value, min_value, max_value) == pytest.approx(expected)
+
+def make_graph(nodes, connections):
+    graph = shader.SerializedNodeGraph()
+    graph.nodes = nodes
+    graph.connections = [shader.CyclesConnection(*x) for x in connections]
+    return graph
+
+def assert_connections_resolve(graph):
+    names = set(x.name for x in graph.nodes)
+    for this_connection in graph.connections:
+        assert this_connection.source_node in names
+        assert this_connection.dest_node in names
+
+def test_fold_chain_into_unused_node():
+    # b is folded but nothing reads it, so it stays and needs a constant in place of a
+    a = make_math_node("a", "add", 1.0, 2.0)
+    b = make_math_node("b", "multiply", value2=2.0)
+    graph = make_graph([a, b], [("a", "Value", "b", "Value1")])
+    assert shader.fold_constant_nodes(graph) == 1
+    assert_connections_resolve(graph)
+    nodes_by_name = dict((x.name, x) for x in graph.nodes)
+    assert nodes_by_name["a"].node_type == shader.NodeType.VALUE
+    assert nodes_by_name["a"].float_values["value"] == 3.0
+    assert nodes_by_name["b"].node_type == shader.NodeType.MATH
+    assert graph.connections == [shader.CyclesConnection("a", "Value", "b", "Value1")]
+    # Every connection has both of its nodes, so the binary encoding can index them
+    assert len(graph.get_graph_bytes()) > 0
+
+def test_fold_chain_into_shader():
+    a = make_math_node("a", "add", 1.0, 2.0)
+    b = make_math_node("b", "multiply", value2=2.0)
+    diffuse = make_node("diffuse", shader.NodeType.DIFFUSE_BSDF, roughness=0.0)
+    graph = make_graph([a, b, diffuse], [("a", "Value", "b", "Value1"), ("b", "Value", "diffuse", "Roughness")])
+    assert shader.fold_constant_nodes(graph) == 2
+    assert_connections_resolve(graph)
+    nodes_by_name = dict((x.name, x) for x in graph.nodes)
+    assert "a" not in nodes_by_name
+    assert nodes_by_name["b"].node_type == shader.NodeType.VALUE
+    assert nodes_by_name["b"].float_values["value"] == 6.0
+    assert graph.connections == [shader.CyclesConnection("b", "Value", "diffuse", "Roughness")]
+
+def test_fold_chain_from_value_node():
+    value = make_node("value", shader.NodeType.VALUE, value=2.0)
+    a = make_math_node("a", "multiply", value2=3.0)
+    diffuse = make_node("diffuse", shader.NodeType.DIFFUSE_BSDF, roughness=0.0)
+    graph = make_graph([value, a, diffuse], [("value", "Value", "a", "Value1"), ("a", "Value", "diffuse", "Roughness")])
+    assert shader.fold_constant_nodes(graph) == 2
+    assert_connections_resolve(graph)
+    nodes_by_name = dict((x.name, x) for x in graph.nodes)
+    assert "value" not in nodes_by_name
+    assert nodes_by_name["a"].node_type == shader.NodeType.VALUE
+    assert nodes_by_name["a"].float_values["value"] == 6.0
+    assert graph.connections == [shader.CyclesConnection("a", "Value", "diffuse", "Roughness")]
+
+def test_fold_chain_from_shared_rgb_node():
+    # The RGB node is still read by the shader, so it stays as it is
+    rgb = make_node("rgb", shader.NodeType.RGB, value=(0.2, 0.4, 0.6, 1.0))
+    invert = make_node("invert", shader.NodeType.INVERT, fac=1.0)
+    diffuse = make_node("diffuse", shader.NodeType.DIFFUSE_BSDF, roughness=0.0)
+    emission = make_node("emission", shader.NodeType.EMISSION, strength=1.0)
+    graph = make_graph([rgb, invert, diffuse, emission], [("rgb", "Color", "invert", "Color"), ("rgb", "Color", "diffuse", "Color"), ("invert", "Color", "emission", "Color")])
+    assert shader.fold_constant_nodes(graph) == 1
+    assert_connections_resolve(graph)
+    nodes_by_name = dict((x.name, x) for x in graph.nodes)
+    assert nodes_by_name["rgb"] is rgb
+    assert nodes_by_name["invert"].node_type == shader.NodeType.RGB
+    assert_vector(nodes_by_name["invert"].float4_values["value"], (0.8, 0.6, 0.4, 1.0))
+    assert sorted(tuple(x) for x in graph.connections) == [("invert", "Color", "emission", "Color"), ("rgb", "Color", "diffuse", "Color")]
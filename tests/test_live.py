@@ -0,0 +1,180 @@
+# Checks that a live update delta turns a client's copy of one export into the next, run without Blender
+#
+#   python -m pytest tests
+
+import os
+import socket
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cyclesmax_live
+import cyclesmax_reader
+import io_cyclesmax_shader as shader
+
+def make_node(name, node_type, position=(0.0, 0.0), **float_values):
+    output = shader.CyclesNode()
+    output.name = name
+    output.node_type = node_type
+    output.position = position
+    output.float_values.update(float_values)
+    return output
+
+def make_base_nodes():
+    return [
+        make_node("value", shader.NodeType.VALUE, (-400.0, 0.0), value=0.5),
+        make_node("diffuse", shader.NodeType.DIFFUSE_BSDF, (-200.0, 0.0), roughness=0.0),
+        make_node("output", shader.NodeType.MATERIAL_OUTPUT),
+    ]
+
+BASE_LINKS = [("value", "Value", "diffuse", "Roughness"), ("diffuse", "BSDF", "output", "Surface")]
+
+def export(nodes, links, topological=False, sparse=False):
+    graph = shader.SerializedNodeGraph()
+    graph.nodes = nodes
+    graph.connections = [shader.CyclesConnection(*x) for x in links]
+    graph.output_node_name = "output"
+    options = shader.ExportOptions()
+    options.topological_order = topological
+    options.sparse_defaults = sparse
+    shader.finish_node_graph(graph, options)
+    return graph.get_graph_string()
+
+def edit_nothing(nodes, links):
+    return (nodes, links)
+
+def edit_add_node(nodes, links):
+    nodes.insert(1, make_node("invert", shader.NodeType.INVERT, (-300.0, 0.0), fac=1.0))
+    links = [x for x in links if x[2] != "diffuse"]
+    links.append(("value", "Value", "invert", "Color"))
+    links.append(("invert", "Color", "diffuse", "Roughness"))
+    return (nodes, links)
+
+def edit_remove_node(nodes, links):
+    nodes = [x for x in nodes if x.name != "value"]
+    links = [x for x in links if x[0] != "value"]
+    return (nodes, links)
+
+def edit_change_type(nodes, links):
+    nodes[1] = make_node("diffuse", shader.NodeType.EMISSION, (-200.0, 0.0), strength=1.0)
+    links[1] = ("diffuse", "Emission", "output", "Surface")
+    return (nodes, links)
+
+def edit_move_node(nodes, links):
+    nodes[0].position = (-500.0, 100.0)
+    return (nodes, links)
+
+def edit_set_parameter(nodes, links):
+    nodes[0].float_values["value"] = 0.25
+    nodes[1].float_values["roughness"] = 0.5
+    return (nodes, links)
+
+def edit_unset_parameter(nodes, links):
+    # Sparse exports leave the value out once it is back at its default
+    nodes[1].float_values["roughness"] = 0.5
+    return (nodes, links)
+
+def edit_add_link(nodes, links):
+    nodes.append(make_node("color", shader.NodeType.RGB, (-400.0, 200.0)))
+    nodes[3].float3_values["value"] = (1.0, 0.5, 0.0)
+    links.append(("color", "Color", "diffuse", "Color"))
+    return (nodes, links)
+
+def edit_remove_link(nodes, links):
+    return (nodes, links[1:])
+
+EDITS = [edit_nothing, edit_add_node, edit_remove_node, edit_change_type, edit_move_node, edit_set_parameter, edit_unset_parameter, edit_add_link, edit_remove_link]
+
+def canonical_graph(shader_string):
+    graph = cyclesmax_reader.parse_shader_string(shader_string)
+    assert cyclesmax_reader.validate_graph(graph) == []
+    return (graph.version, graph.header_fields, [x.to_dict() for x in graph.nodes], sorted(x.to_tuple() for x in graph.connections))
+
+def check_round_trip(old_string, new_string):
+    client_snapshot = cyclesmax_live.split_shader_string(old_string)
+    delta = cyclesmax_live.get_delta(client_snapshot, cyclesmax_live.split_shader_string(new_string))
+    # Deltas go over the wire as JSON
+    delta = cyclesmax_live.json.loads(cyclesmax_live.json.dumps(delta))
+    cyclesmax_live.apply_delta(client_snapshot, delta)
+    # The snapshot writes links sorted, everything else must come out as exported
+    assert client_snapshot.to_shader_string() == cyclesmax_live.split_shader_string(new_string).to_shader_string()
+    assert canonical_graph(client_snapshot.to_shader_string()) == canonical_graph(new_string)
+    return delta
+
+@pytest.mark.parametrize("topological", [False, True])
+@pytest.mark.parametrize("sparse", [False, True])
+@pytest.mark.parametrize("edit", EDITS)
+def test_delta_round_trip(edit, sparse, topological):
+    old_string = export(make_base_nodes(), list(BASE_LINKS), topological, sparse)
+    new_string = export(*edit(make_base_nodes(), list(BASE_LINKS)), topological=topological, sparse=sparse)
+    delta = check_round_trip(old_string, new_string)
+    if edit is edit_nothing:
+        assert delta == dict()
+    # And back again
+    check_round_trip(new_string, old_string)
+
+def test_delta_round_trip_header():
+    old_string = export(make_base_nodes(), list(BASE_LINKS))
+    new_string = export(make_base_nodes(), list(BASE_LINKS), topological=True)
+    delta = check_round_trip(old_string, new_string)
+    assert delta["header"][0] == "2"
+    check_round_trip(new_string, old_string)
+
+def test_delta_topological_insert():
+    # Inserting a node before others in a topologically ordered file moves every node after it
+    old_string = export(make_base_nodes(), list(BASE_LINKS), topological=True)
+    new_string = export(*edit_add_node(make_base_nodes(), list(BASE_LINKS)), topological=True)
+    delta = check_round_trip(old_string, new_string)
+    assert delta["order"] == ["value", "invert", "diffuse", "output"]
+
+def test_delta_without_order():
+    # Nodes added at the end need no order
+    old_string = export(make_base_nodes(), list(BASE_LINKS))
+    new_string = export(*edit_add_link(make_base_nodes(), list(BASE_LINKS)))
+    delta = check_round_trip(old_string, new_string)
+    assert "order" not in delta
+
+def wait_for_connections(server, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while len(server.connections) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_close_sends_last_push():
+    server = cyclesmax_live.LiveServer(port=0)
+    client = cyclesmax_live.LiveClient(port=server.port, timeout=5.0)
+    try:
+        wait_for_connections(server, 1)
+        first_string = export(make_base_nodes(), list(BASE_LINKS))
+        last_string = export(*edit_set_parameter(make_base_nodes(), list(BASE_LINKS)))
+        # With the sender waiting for the lock, both pushes and the close land in one batch
+        with server.lock:
+            server.push("Material", first_string)
+            server.push("Material", last_string)
+            server.events.put(None)
+        server.close()
+        while client.receive() is not None:
+            pass
+        assert client.snapshots["Material"].to_shader_string() == cyclesmax_live.split_shader_string(last_string).to_shader_string()
+    finally:
+        client.close()
+
+def test_close_with_stalled_client():
+    server = cyclesmax_live.LiveServer(port=0)
+    # Connects but never reads, so the socket buffers fill up and the send blocks
+    stalled = socket.create_connection(("127.0.0.1", server.port))
+    try:
+        wait_for_connections(server, 1)
+        nodes = [make_node("value {0}".format(index), shader.NodeType.VALUE, value=0.5) for index in range(50000)]
+        shader_string = export(nodes, [])
+        for index in range(8):
+            server.push("Material {0}".format(index), shader_string)
+        start_time = time.monotonic()
+        server.close()
+        assert time.monotonic() - start_time < 3.0 * cyclesmax_live.SEND_TIMEOUT
+        assert server.connections == []
+    finally:
+        stalled.close()
@@ -0,0 +1,26 @@
+# Checks that cyclesmax_reader.py reads .shader files on its own, run without Blender
+#
+#   python -m pytest tests
+
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+
+import cyclesmax_reader
+
+def test_reader_without_addon():
+    # Loaders ship the reader and the defaults table, not the add-on
+    code = "import sys, cyclesmax_reader; sys.exit('io_cyclesmax_shader' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR).returncode == 0
+
+def test_vector_type_from_defaults(monkeypatch):
+    # A default in the table decides between float3 and float4, the parameter name only when there is none
+    monkeypatch.setitem(cyclesmax_reader.DEFAULT_VALUES, "test_node", {"value": (0.0, 0.0, 0.0), "offset": (0.0, 0.0, 0.0, 1.0)})
+    graph = cyclesmax_reader.parse_shader_string("cycles_shader|1|section_nodes|test_node|a|0.0|-0.0|value|0.1,0.2,0.3|offset|0.1,0.2,0.3|color|0.1,0.2,0.3|node_end|"
+        "rgb|b|0.0|-0.0|value|0.1,0.2,0.3|node_end|section_connections|")
+    assert graph.nodes[0].float3_values == {"value": (0.1, 0.2, 0.3)}
+    assert graph.nodes[0].float4_values == {"offset": (0.1, 0.2, 0.3, 1.0), "color": (0.1, 0.2, 0.3, 1.0)}
+    assert graph.nodes[1].float4_values == {"value": (0.1, 0.2, 0.3, 1.0)}